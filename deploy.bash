@@ -7,11 +7,22 @@ trap "rm -rf data" EXIT
 
 if test "$1" = 'hub'; then
   echo "setting up hub..."
+  mpy-cross -o data/backoff.mpy esp_now_hub/hub/backoff.py
   mpy-cross -o data/wifi.mpy esp_now_hub/hub/wifi.py
   mkdir data/umqtt
   mpy-cross -o data/umqtt/simple.mpy esp_now_hub/hub/umqtt/simple.py
+  mpy-cross -o data/latency.mpy esp_now_hub/hub/latency.py
+  mpy-cross -o data/ring_buffer.mpy esp_now_hub/hub/ring_buffer.py
+  mpy-cross -o data/spool.mpy esp_now_hub/hub/spool.py
+  mpy-cross -o data/flat_json.mpy esp_now_hub/hub/flat_json.py
+  mpy-cross -o data/packet_writer.mpy esp_now_hub/hub/packet_writer.py
+  mpy-cross -o data/mqtt5.mpy esp_now_hub/hub/mqtt5.py
+  mpy-cross -o data/deadlines.mpy esp_now_hub/hub/deadlines.py
   mpy-cross -o data/mqtt.mpy esp_now_hub/hub/mqtt.py
+  mpy-cross -o data/wire.mpy esp_now_hub/wire.py
   mpy-cross -o data/esp_now.mpy esp_now_hub/hub/esp_now.py
+  mpy-cross -o data/telemetry.mpy esp_now_hub/hub/telemetry.py
+  mpy-cross -o data/aio.mpy esp_now_hub/hub/aio.py
   mpy-cross -o data/main.mpy esp_now_hub/hub/main.py
   printf "import main\n" > data/boot.py
 else
@@ -21,10 +32,15 @@ else
   else
     echo "setting up sensor..."
     mpy-cross -o data/main.mpy esp_now_hub/sensors/main.py
+    mpy-cross -o data/channel.mpy esp_now_hub/sensors/channel.py
+    mpy-cross -o data/settings.mpy esp_now_hub/sensors/settings.py
     printf "import main\n" > data/boot.py
   fi
+  mpy-cross -o data/wire.mpy esp_now_hub/wire.py
+  mpy-cross -o data/rtc_memory.mpy esp_now_hub/sensors/rtc_memory.py
   mpy-cross -o data/setup.mpy esp_now_hub/sensors/setup.py
   mpy-cross -o data/value_cache.mpy esp_now_hub/sensors/value_cache.py
+  mpy-cross -o data/calibration.mpy esp_now_hub/sensors/calibration.py
   if grep -q 'aht20' config.py; then
     mpy-cross -o data/aht20.mpy esp_now_hub/sensors/aht20.py
   fi
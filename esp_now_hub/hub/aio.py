@@ -0,0 +1,154 @@
+import asyncio
+
+import telemetry  # ty: ignore[unresolved-import]
+from micropython import const
+
+_MQTT_POLL_INTERVAL = const(0.05)
+# Reconnections requested by other tasks start within this many ms.
+_KEEPALIVE_MAX_WAIT = const(1000)
+
+if hasattr(asyncio, "ThreadSafeFlag"):
+    # Can be set from the ESP-Now IRQ callback.
+    _Flag = asyncio.ThreadSafeFlag  # ty: ignore[unresolved-attribute]
+else:
+
+    class _Flag(asyncio.Event):
+        async def wait(self):
+            await super().wait()
+            self.clear()
+
+
+class Queue:
+    """Bounded FIFO, drops the oldest item when full so producers never wait."""
+
+    def __init__(self, size):
+        self._items = [None] * size
+        self._head = 0
+        self._count = 0
+        self._flag = _Flag()
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def put(self, item):
+        size = len(self._items)
+        if self._count == size:
+            self._head = (self._head + 1) % size
+            self._count -= 1
+            self.dropped += 1
+        self._items[(self._head + self._count) % size] = item
+        self._count += 1
+        self._flag.set()
+
+    async def get(self):
+        while not self._count:
+            await self._flag.wait()
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._count -= 1
+        return item
+
+
+async def _publish(mqtt_client, frames, hub_telemetry):
+    while True:
+        device_id, data, start = await frames.get()
+        # Dequeue ticks of the frame for latency histograms.
+        mqtt_client.latency.start = start
+        hub_telemetry.loop_start()
+        try:
+            mqtt_client.send(device_id, data)
+            if not frames:
+                # Write the burst at once.
+                mqtt_client.flush()
+        except Exception as exc:
+            mqtt_client.reset(exc)
+        hub_telemetry.loop_end()
+        # Let other tasks run between publishes.
+        await asyncio.sleep(0)
+
+
+async def _receive_mqtt(mqtt_client, poll):
+    while True:
+        events = poll.poll(0)
+        try:
+            for event in events:
+                if mqtt_client.wants(event[0]):
+                    mqtt_client.receive(event[1])
+            if events:
+                mqtt_client.flush()
+        except Exception as exc:
+            mqtt_client.reset(exc)
+        await asyncio.sleep(_MQTT_POLL_INTERVAL)
+
+
+async def _keepalive(mqtt_client):
+    while True:
+        # Until the next broker ping or device offline deadline.
+        try:
+            timeout = mqtt_client.ping()
+            mqtt_client.flush()
+        except Exception as exc:
+            mqtt_client.reset(exc)
+            timeout = 0
+        await asyncio.sleep(min(timeout, _KEEPALIVE_MAX_WAIT) / 1000)
+
+
+async def _wifi(wlan):
+    while True:
+        try:
+            timeout = wlan.check()
+        except Exception as exc:
+            wlan.reset(exc)
+            timeout = 0
+        await asyncio.sleep(timeout / 1000)
+
+
+async def _telemetry(mqtt_client, hub_telemetry, sources):
+    while True:
+        try:
+            mqtt_client.send_telemetry(hub_telemetry.collect(*sources))
+            mqtt_client.flush()
+        except Exception as exc:
+            mqtt_client.reset(exc)
+        await asyncio.sleep(hub_telemetry.timeout() / 1000)
+
+
+async def serve(
+    poll, mqtt_client, esp_now_client, queue_size=64, telemetry_interval=60, wlan=None
+):
+    """Run the hub tasks.
+    ESP-Now frames are received from the driver IRQ, so they keep being accepted
+    while MQTT calls block, and are passed to the publishing task
+    through a bounded queue.
+    Loop latency is the time spent publishing a frame.
+    An error in a task resets its layer only, the other tasks keep running.
+    The WiFi connection is checked if wlan is given.
+    """
+    frames = Queue(queue_size)
+    hub_telemetry = telemetry.Telemetry(telemetry_interval)
+    esp_now_client.irq(
+        lambda device_id, data: frames.put(
+            (device_id, data, esp_now_client.latency.start)
+        )
+    )
+    sources = (esp_now_client, mqtt_client)
+    tasks = [
+        _publish(mqtt_client, frames, hub_telemetry),
+        _receive_mqtt(mqtt_client, poll),
+        _keepalive(mqtt_client),
+    ]
+    if wlan is not None:
+        sources += (wlan,)
+        tasks.append(_wifi(wlan))
+    tasks.append(_telemetry(mqtt_client, hub_telemetry, sources))
+    await asyncio.gather(*tasks)
+
+
+def run(
+    poll, mqtt_client, esp_now_client, queue_size=64, telemetry_interval=60, wlan=None
+):
+    asyncio.run(
+        serve(poll, mqtt_client, esp_now_client, queue_size, telemetry_interval, wlan)
+    )
@@ -0,0 +1,23 @@
+import random
+
+
+class Backoff:
+    """Exponential delays between connection attempts, in ms.
+    Half of each delay is random so hubs recovering from the same outage
+    do not retry in lockstep.
+    """
+
+    def __init__(self, initial=1000, maximum=60000):
+        self._initial = initial
+        self._maximum = maximum
+        # Failed attempts since the last reset.
+        self.failures = 0
+
+    def reset(self):
+        self.failures = 0
+
+    def next(self):
+        """Return the delay before the next attempt, after a failed one."""
+        delay = min(self._maximum, self._initial << min(self.failures, 16))
+        self.failures += 1
+        return delay // 2 + random.randint(0, delay // 2)
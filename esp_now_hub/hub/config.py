@@ -2,22 +2,104 @@ from collections.abc import Collection
 from typing import NotRequired, TypedDict
 
 
+class Backoff(TypedDict):
+    # Delay in ms before retrying a failed connection, doubled on each failure
+    # up to maximum (default 1000 and 60000), half of it is random.
+    initial: NotRequired[int]
+    maximum: NotRequired[int]
+
+
 class Wifi(TypedDict):
     ssid: str
     password: str
     # ip, subnet, gateway, dns
     ifconfig: NotRequired[tuple[str, str, str, str]]
+    backoff: NotRequired[Backoff]
 
 
-class MQTT(TypedDict):
+class Buffer(TypedDict):
+    # Number of state publishes held while MQTT is unavailable.
+    capacity: NotRequired[int]
+    # When full, "oldest" drops the oldest publish.
+    # "latest" keeps one publish per device with its latest data.
+    policy: NotRequired[str]
+
+
+class Spool(TypedDict):
+    # Directory on the flash filesystem.
+    path: NotRequired[str]
+    # Bytes per segment file and for all segments, oldest segments are dropped.
+    segment_size: NotRequired[int]
+    max_size: NotRequired[int]
+    # Records are written in chunks of up to this size (flash page),
+    # or after flush_interval seconds.
+    page_size: NotRequired[int]
+    flush_interval: NotRequired[int]
+    # Records published per second once connected back, and at once.
+    drain_rate: NotRequired[int]
+    drain_burst: NotRequired[int]
+
+
+class Writer(TypedDict):
+    # Bytes of packets queued for writing, states are buffered when full,
+    # and dropped if larger.
+    size: NotRequired[int]
+    # Write queued packets after this many ms during bursts.
+    max_delay: NotRequired[int]
+
+
+class Broker(TypedDict):
     server: str
     port: NotRequired[int]
+
+
+class MQTT(TypedDict):
+    # Preferred broker, before brokers.
+    server: NotRequired[str]
+    port: NotRequired[int]
+    # Brokers in order of preference. The hub fails over to the next one when
+    # the active broker stops answering, and back to the first one once it
+    # accepted connections for failback seconds (default 300).
+    brokers: NotRequired[Collection[Broker]]
+    failback: NotRequired[int]
     user: NotRequired[str]
     password: NotRequired[str]
+    buffer: NotRequired[Buffer]
+    # Spill publishes evicted from the buffer to flash.
+    spool: NotRequired[Spool]
+    writer: NotRequired[Writer]
+    # Home Assistant birth topic, discovery configs are sent again when it is online.
+    # Otherwise only changed configs are sent on start (default homeassistant/status).
+    ha_status_topic: NotRequired[str]
+    # QoS of state publishes (0 or 1, default 0). With QoS 1, up to in_flight
+    # publishes wait for their acknowledgement (default 8), others are buffered.
+    qos: NotRequired[int]
+    in_flight: NotRequired[int]
+    backoff: NotRequired[Backoff]
+    # MQTT version (4 for 3.1.1, default, or 5). MQTT 5 shortens status and
+    # state publishes with topic aliases and expires states of offline devices,
+    # brokers without MQTT 5 support are connected to with 3.1.1.
+    # Queued QoS 0 publishes are dropped on reconnect, use QoS 1 to keep them.
+    protocol: NotRequired[int]
+
+
+class ESPNow(TypedDict):
+    # Maximum number of frames drained from the driver on each poll wakeup.
+    max_batch: NotRequired[int]
+    # Number of recent sequence numbers remembered per device to drop duplicate frames.
+    dedup_window: NotRequired[int]
+    # Driver receive buffer size in bytes (default 526), frames are dropped when full.
+    # Check rx_dropped in the hub telemetry to size it.
+    rxbuf: NotRequired[int]
+    # Transmission rate, see network.WLAN rate constants.
+    rate: NotRequired[int]
 
 
 class Device(TypedDict):
-    # Mac address, eg. 00:00:00:00:00:00
+    # Mac address, eg. 00:00:00:00:00:00, in topics lowercase without colons.
+    # Settings published as JSON to {topic_prefix}/set/{address}, eg.
+    # {"interval": 60, "send_configs": {"sensor1": {"pressure": {"diff": 0.01}}}},
+    # are sent to the device in reply to its next frame and stored on it.
     address: str
     local_master_key: NotRequired[str]
     manufacturer: NotRequired[str]
@@ -29,6 +111,9 @@ class Device(TypedDict):
     send_signal_strength_threshold: NotRequired[int]
     # sensor_id -> included components (temperature, pressure, etc...).
     components: dict[str, Collection[str]]
+    # All sensor ids of the device, needed to decode binary frames
+    # if some sensors are not included in components.
+    sensors: NotRequired[Collection[str]]
 
 
 class Config(TypedDict):
@@ -36,8 +121,18 @@ class Config(TypedDict):
     primary_master_key: NotRequired[str]
     # The hub will ping MQTT every interval, so this will be the keepalive of the connection.
     interval: int
+    # Publish hub telemetry every telemetry_interval seconds (default 60).
+    telemetry_interval: NotRequired[int]
+    # Add receive to publish latency histograms to the hub telemetry,
+    # can be switched by publishing {"latency": true/false} to {topic_prefix}/set/hub.
+    latency_histograms: NotRequired[bool]
     wifi: Wifi
     mqtt: MQTT
+    esp_now: NotRequired[ESPNow]
+    # Run the hub on asyncio, receiving ESP-Now frames from the driver IRQ.
+    asyncio: NotRequired[bool]
+    # Frames held while waiting to be published in asyncio mode.
+    queue_size: NotRequired[int]
     devices: Collection[Device]
 
 
@@ -0,0 +1,88 @@
+import heapq
+import time
+
+from micropython import const
+
+# Offsets are rebased before ticks_diff overflows (ticks wrap after 2**30 ms).
+_REBASE = const(1 << 28)
+
+
+class Deadlines:
+    """Named deadlines in a min-heap, so the next one is found without scanning.
+    Deadlines are ms offsets from a base tick, as ticks wrap.
+    Each name has a single heap entry: moving a deadline later only updates
+    the dict, the entry is pushed again at its new offset when reached.
+    """
+
+    def __init__(self):
+        # Set on first use.
+        self._base = None
+        # Offset, name.
+        self._heap = []
+        # Name -> current offset.
+        self._offsets = {}
+
+    def __contains__(self, name):
+        return name in self._offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def set(self, name, delay):
+        """Set the deadline of name delay ms from now."""
+        offset = self._now() + delay
+        current = self._offsets.get(name)
+        self._offsets[name] = offset
+        if current is None or offset < current:
+            heapq.heappush(self._heap, (offset, name))
+
+    def cancel(self, name):
+        self._offsets.pop(name, None)
+
+    def timeout(self, default):
+        """Return ms until the next deadline, at most default."""
+        # Before the offset, as it can rebase.
+        now = self._now()
+        offset = self._next()
+        if offset is None:
+            return default
+        return max(0, min(default, offset - now))
+
+    def pop(self):
+        """Remove and return the name of a passed deadline, None if there is none."""
+        # Before the offset, as it can rebase.
+        now = self._now()
+        offset = self._next()
+        if offset is None or offset > now:
+            return None
+        name = heapq.heappop(self._heap)[1]
+        del self._offsets[name]
+        return name
+
+    def _next(self):
+        """Return the offset of the next deadline, dropping outdated entries."""
+        heap = self._heap
+        while heap:
+            offset, name = heap[0]
+            current = self._offsets.get(name)
+            if current == offset:
+                return offset
+            heapq.heappop(heap)
+            if current is not None and current > offset:
+                # Moved later.
+                heapq.heappush(heap, (current, name))
+        return None
+
+    def _now(self):
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        if self._base is None:
+            self._base = now
+        elapsed = time.ticks_diff(now, self._base)  # ty: ignore[unresolved-attribute]
+        if elapsed < _REBASE:
+            return elapsed
+        # Shifting every offset keeps the heap order.
+        self._base = now
+        self._heap = [(offset - elapsed, name) for offset, name in self._heap]
+        for name in self._offsets:
+            self._offsets[name] -= elapsed
+        return 0
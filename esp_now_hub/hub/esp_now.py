@@ -1,64 +1,303 @@
+import array
 import binascii
 import json
 import select
 
 import espnow
+import latency  # ty: ignore[unresolved-import]
+import wire  # ty: ignore[unresolved-import]
 
 
 class ESPNow:
-    def __init__(self, poll, devices, pmk=None):
+    def __init__(
+        self,
+        poll,
+        devices,
+        pmk=None,
+        max_batch=16,
+        dedup_window=8,
+        rxbuf=None,
+        rate=None,
+        latency_histograms=None,
+        downlink=None,
+    ):
         self._poll = poll
         self._devices = devices
         self._pmk = pmk
+        self._max_batch = max_batch
+        self._dedup_window = dedup_window
         self._esp_now = espnow.ESPNow()
-        self._included_components = {}
-        self._signal_thresholds = {}
+        # Shared with the MQTT client to follow frames up to their publish.
+        self.latency = latency_histograms or latency.Latency()
+        # Driver options, the receive buffer is allocated when activated.
+        self._driver_config = {}
+        if rxbuf:
+            self._driver_config["rxbuf"] = rxbuf
+        if rate:
+            self._driver_config["rate"] = rate
+        # Device id -> settings sent in reply to its next frame,
+        # while it listens, and kept until it acknowledges them.
+        self.downlink = {} if downlink is None else downlink
+        # Addresses added as peers, needed to send.
+        self._peers = set()
+        self.downlinks = 0
+        self.downlink_failures = 0
+        # Address -> compiled filter table, see _compile.
+        self._tables = {}
+        # Address -> recently seen sequence numbers and next slot to overwrite.
+        self._windows = {}
+        self._window_slots = {}
+        # Frames drained on the last wakeup and the most drained at once.
+        self.drained = 0
+        self.max_drained = 0
+        # Retransmitted frames dropped.
+        self.duplicates = 0
+        self.frames = 0
+        self.decode_failures = 0
+        self.unknown_devices = 0
+        # Addresses whose frame layout mismatch was logged.
+        self._layout_mismatches = set()
+        # Driver restarts after errors.
+        self.resets = 0
 
     def __enter__(self):
+        # Peers are dropped with the driver.
+        self._peers.clear()
         self._esp_now.active(False)
+        if self._driver_config:
+            self._esp_now.config(**self._driver_config)
         self._esp_now.active(True)
         if self._pmk:
             self._esp_now.set_pmk(self._pmk)
+        # Output keys shared between devices with the same sensor ids.
+        keys = {}
         for device in self._devices:
             address = binascii.unhexlify(
                 device["address"].replace(":", "").encode("utf-8")
             )
             if device.get("local_master_key"):
                 self._esp_now.add_peer(address, lmk=device["local_master_key"])
-            self._included_components[address] = device["components"]
-            self._signal_thresholds[address] = (
-                device.get("send_signal_strength_threshold") or -127
-            )
-        self._poll.register(self._esp_now, select.POLLIN)
+                self._peers.add(address)
+            if device["components"]:
+                self._tables[address] = _compile(address, device, keys)
+                self._windows[address] = array.array("i", [-1] * self._dedup_window)
+                self._window_slots[address] = 0
+        if self._poll:
+            self._poll.register(self._esp_now, select.POLLIN)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._poll.unregister(self._esp_now)
+        if self._poll:
+            self._poll.unregister(self._esp_now)
+        else:
+            self._esp_now.irq(None)
         self._esp_now.active(False)
 
+    def reset(self, exc):
+        """Restart the polled driver after an error, without stopping other layers."""
+        print(f"resetting ESP-Now after error: {exc!r}")
+        self.resets += 1
+        self.__exit__(None, None, None)
+        self.__enter__()
+
     def wants(self, obj):
         return obj is self._esp_now
 
+    def telemetry(self):
+        """Return driver and receive counters."""
+        tx_packets, tx_responses, tx_failures, rx_packets, rx_dropped = (
+            self._esp_now.stats()
+        )
+        return {
+            "tx_packets": tx_packets,
+            "tx_responses": tx_responses,
+            "tx_failures": tx_failures,
+            "rx_packets": rx_packets,
+            "rx_dropped": rx_dropped,
+            "max_drained": self.max_drained,
+            "duplicates": self.duplicates,
+            "frames": self.frames,
+            "decode_failures": self.decode_failures,
+            "unknown_devices": self.unknown_devices,
+            "downlinks": self.downlinks,
+            "downlink_failures": self.downlink_failures,
+            "esp_now_resets": self.resets,
+        }
+
+    def irq(self, callback):
+        """Receive from the driver IRQ instead of polling (client created without poll).
+        Call callback with device id and data for each frame,
+        latency.start is the frame dequeue ticks during the call.
+        """
+
+        def _irq(_):
+            # May run while a previous frame is being published.
+            start = self.latency.start
+            for device_id, data in self.receive(select.POLLIN):
+                callback(device_id, data)
+            self.latency.start = start
+
+        self._esp_now.irq(_irq)
+
     def receive(self, event):
+        """Drain frames queued in the driver, up to max_batch per wakeup.
+        Yield device id and filtered data for each frame from a known device.
+        """
         if event & select.POLLERR or event & select.POLLHUP:
             raise RuntimeError("error event received for ESP-Now")
-        if event & select.POLLIN:
-            address, payload = self._esp_now.recv(0)
-            if address and payload:
-                components = self._included_components.get(address)
-                if components:
-                    data = {}
-                    for sensor_id, sensor_data in json.loads(
-                        payload.decode("utf-8")
-                    ).items():
-                        if sensor_id not in components:
-                            continue
-                        for prop, datum in sensor_data.items():
-                            if prop in components[sensor_id]:
-                                data[f"{sensor_id}_{prop}"] = datum
-                    # Send the signal strength if below threshold.
-                    peer_stats = self._esp_now.peers_table.get(address)
-                    if peer_stats and peer_stats[0] <= self._signal_thresholds[address]:
-                        data["_signal"] = peer_stats[0]
-                    return address.hex(), data
-        return None, None
+        if not event & select.POLLIN:
+            return
+        histograms = self.latency
+        self.drained = 0
+        while self.drained < self._max_batch:
+            # Buffers are reused by the driver, payload is only valid until next call.
+            address, payload = self._esp_now.irecv(0)
+            if not address:
+                break
+            if histograms.enabled:
+                histograms.frame()
+            self.drained += 1
+            self.frames += 1
+            table = self._tables.get(address)
+            if not table:
+                self.unknown_devices += 1
+                continue
+            if self.downlink:
+                # Before decoding, the device listens shortly.
+                self._reply(address, table[0])
+            sequence = wire.sequence(payload) if payload else None
+            if sequence is not None and self._is_duplicate(address, sequence):
+                self.duplicates += 1
+                continue
+            if histograms.start is not None:
+                histograms.checkpoint(latency.DECODE)
+            data = self._filter(address, payload, table)
+            if data is None:
+                self.decode_failures += 1
+            else:
+                if histograms.start is not None:
+                    histograms.checkpoint(latency.FILTER)
+                yield table[0], data
+        if self.drained > self.max_drained:
+            self.max_drained = self.drained
+
+    def _reply(self, address, device_id):
+        settings = self.downlink.get(device_id)
+        if settings is None:
+            return
+        # Sent again after the next frame if not acknowledged or failing,
+        # as when the peer table or send queue is full.
+        try:
+            if address not in self._peers:
+                self._esp_now.add_peer(address)
+                self._peers.add(address)
+            sent = self._esp_now.send(address, wire.encode_settings(settings))
+        except OSError:
+            sent = False
+        if sent:
+            del self.downlink[device_id]
+            self.downlinks += 1
+        else:
+            self.downlink_failures += 1
+
+    def _is_duplicate(self, address, sequence):
+        """Check the sequence number against the device window and record it."""
+        window = self._windows[address]
+        for i in range(len(window)):
+            if window[i] == sequence:
+                return True
+        slot = self._window_slots[address]
+        window[slot] = sequence
+        self._window_slots[address] = (slot + 1) % len(window)
+        return False
+
+    def _filter(self, address, payload, table):
+        _, layout_id, sensor_indexes, masks, keys, threshold = table
+        if not payload:
+            return None
+        data = {}
+        if payload[0] == wire.BINARY_V2:
+            if len(payload) < wire.HEADER_SIZE:
+                return None
+            if payload[1] != layout_id:
+                self._layout_mismatch(address, payload[1], table)
+                return None
+            end = len(payload) - wire.DATUM_SIZE + 1
+            for i in range(wire.HEADER_SIZE, end, wire.DATUM_SIZE):
+                sensor_idx = payload[i] >> 3
+                component_idx = payload[i] & 0x07
+                if sensor_idx < len(masks) and masks[sensor_idx] >> component_idx & 1:
+                    data[keys[sensor_idx * _COMPONENTS_COUNT + component_idx]] = (
+                        wire.read_value(payload, i + 1, wire.SCALES[component_idx])
+                    )
+        elif payload[0] == wire.JSON:
+            try:
+                decoded = json.loads(payload.decode("utf-8"))
+            except ValueError:
+                return None
+            if not isinstance(decoded, dict):
+                return None
+            for sensor_id, sensor_data in decoded.items():
+                sensor_idx = sensor_indexes.get(sensor_id)
+                if sensor_idx is None:
+                    continue
+                for prop, datum in sensor_data.items():
+                    component_idx = _COMPONENT_INDEXES.get(prop)
+                    if (
+                        component_idx is not None
+                        and masks[sensor_idx] >> component_idx & 1
+                    ):
+                        data[keys[sensor_idx * _COMPONENTS_COUNT + component_idx]] = (
+                            datum
+                        )
+        else:
+            return None
+        # Send the signal strength if below threshold.
+        peer_stats = self._esp_now.peers_table.get(address)
+        if peer_stats and peer_stats[0] <= threshold:
+            data["_signal"] = peer_stats[0]
+        return data
+
+    def _layout_mismatch(self, address, received, table):
+        """Log once per device, frames are dropped until the config is fixed."""
+        if address in self._layout_mismatches:
+            return
+        self._layout_mismatches.add(address)
+        print(
+            f"device {table[0]}: frame layout {received:02x}, expected {table[1]:02x},"
+            " list all its sensor ids in sensors"
+        )
+
+
+_COMPONENTS_COUNT = len(wire.COMPONENTS)
+_COMPONENT_INDEXES = {component: i for i, component in enumerate(wire.COMPONENTS)}
+
+
+def _compile(address, device, interned_keys):
+    """Compile the filter table of a device:
+    device id, layout id, sensor id -> index for included sensors,
+    bitmask of included components and output key per sensor index/component index,
+    signal strength threshold.
+    """
+    sensor_ids, layout_id = wire.layout(device.get("sensors") or device["components"])
+    sensor_indexes = {}
+    masks = bytearray(len(sensor_ids))
+    keys = [None] * (len(sensor_ids) * _COMPONENTS_COUNT)
+    for sensor_id, components in device["components"].items():
+        sensor_idx = sensor_ids.index(sensor_id)
+        sensor_indexes[sensor_id] = sensor_idx
+        for component in components:
+            component_idx = _COMPONENT_INDEXES[component]
+            masks[sensor_idx] |= 1 << component_idx
+            key = f"{sensor_id}_{component}"
+            keys[sensor_idx * _COMPONENTS_COUNT + component_idx] = (
+                interned_keys.setdefault(key, key)
+            )
+    return (
+        address.hex(),
+        layout_id,
+        sensor_indexes,
+        bytes(masks),
+        tuple(keys),
+        device.get("send_signal_strength_threshold") or -127,
+    )
@@ -0,0 +1,101 @@
+from micropython import const
+
+_MAX_DECIMALS = const(6)
+# Larger floats are left to json.
+_MAX_FLOAT = const(1e12)
+_MAX_KEYS = const(128)
+
+
+class FlatJSON:
+    """Serialize flat {key: number} dicts in a reusable buffer,
+    as json.dumps does, without allocating strings per call.
+    Encoded keys are cached, floats are written with the fewest decimals
+    representing them exactly.
+    """
+
+    def __init__(self, size=256):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        # Key -> encoded key with its separator.
+        self._keys = {}
+
+    def encode(self, data):
+        """Return a view on the encoded data, valid until the next call,
+        or None if data has other values or does not fit.
+        """
+        buffer = self._buffer
+        i = 0
+        buffer[i] = 0x7B  # {
+        i += 1
+        for key, value in data.items():
+            if i > 1:
+                if i + 2 > len(buffer):
+                    return None
+                buffer[i] = 0x2C  # ,
+                buffer[i + 1] = 0x20
+                i += 2
+            encoded = self._keys.get(key)
+            if encoded is None:
+                encoded = f'"{key}": '.encode()
+                if len(self._keys) < _MAX_KEYS:
+                    self._keys[key] = encoded
+            if i + len(encoded) > len(buffer):
+                return None
+            buffer[i : i + len(encoded)] = encoded
+            i += len(encoded)
+            if type(value) is int:
+                i = self._write_int(i, value, 0)
+            elif type(value) is float:
+                i = self._write_float(i, value)
+            else:
+                return None
+            if i < 0:
+                return None
+        if i >= len(buffer):
+            return None
+        buffer[i] = 0x7D  # }
+        return self._view[: i + 1]
+
+    def _write_float(self, i, value):
+        if not -_MAX_FLOAT < value < _MAX_FLOAT:
+            # Also nan.
+            return -1
+        scale = 1
+        for decimals in range(1, _MAX_DECIMALS + 1):
+            scale *= 10
+            scaled = round(value * scale)
+            if scaled / scale == value:
+                return self._write_int(i, scaled, decimals)
+        return -1
+
+    def _write_int(self, i, value, decimals):
+        """Write value with a decimal point before the last decimals digits,
+        return the next index or -1 if it does not fit.
+        """
+        buffer = self._buffer
+        if value < 0:
+            if i >= len(buffer):
+                return -1
+            buffer[i] = 0x2D  # -
+            i += 1
+            value = -value
+        # Digits are written backwards then reversed.
+        start = i
+        while True:
+            if i >= len(buffer):
+                return -1
+            if decimals and i - start == decimals:
+                buffer[i] = 0x2E  # .
+            else:
+                buffer[i] = 0x30 + value % 10
+                value //= 10
+                if not value and i - start >= decimals:
+                    break
+            i += 1
+        i += 1
+        end = i - 1
+        while start < end:
+            buffer[start], buffer[end] = buffer[end], buffer[start]
+            start += 1
+            end -= 1
+        return i
@@ -0,0 +1,56 @@
+import array
+import time
+
+from micropython import const
+
+# Checkpoints after the frame is dequeued from the driver:
+# header decoded and checked for duplicates, data filtered, state published.
+DECODE = const(0)
+FILTER = const(1)
+PUBLISH = const(2)
+_NAMES = ("latency_decode", "latency_filter", "latency_publish")
+# Bucket upper bounds in us, the last bucket counts anything above.
+BOUNDS = (250, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000)
+_BUCKETS = const(11)
+
+
+class Latency:
+    """Histograms of the time from a frame dequeue to each checkpoint,
+    in fixed buckets so recording never allocates.
+    Callers check enabled before frame and start before checkpoint,
+    so instrumentation costs an attribute lookup when disabled.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # Dequeue ticks of the frame in flight.
+        self.start = None
+        self._counts = array.array("I", [0] * (len(_NAMES) * _BUCKETS))
+
+    def enable(self, enabled):
+        self.enabled = enabled
+        self.start = None
+
+    def frame(self):
+        self.start = time.ticks_us()  # ty: ignore[unresolved-attribute]
+
+    def checkpoint(self, stage):
+        elapsed = time.ticks_diff(time.ticks_us(), self.start)  # ty: ignore[unresolved-attribute]
+        i = 0
+        while i < len(BOUNDS) and elapsed > BOUNDS[i]:
+            i += 1
+        self._counts[stage * _BUCKETS + i] += 1
+        if stage == PUBLISH:
+            self.start = None
+
+    def telemetry(self):
+        """Return bucket counts per checkpoint since the last call, empty if disabled."""
+        if not self.enabled:
+            return {}
+        data = {}
+        for stage, name in enumerate(_NAMES):
+            i = stage * _BUCKETS
+            data[name] = list(self._counts[i : i + _BUCKETS])
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        return data
@@ -3,40 +3,111 @@ import sys
 import time
 
 import esp_now  # ty: ignore[unresolved-import]
+import latency  # ty: ignore[unresolved-import]
 import mqtt  # ty: ignore[unresolved-import]
+import telemetry  # ty: ignore[unresolved-import]
 import wifi  # ty: ignore[unresolved-import]
 from config import CONFIG  # ty: ignore[unresolved-import]
 
 
 def run():
     interval = CONFIG["interval"]
+    telemetry_interval = CONFIG.get("telemetry_interval", 60)
+    use_asyncio = CONFIG.get("asyncio")
     poll = select.poll()
-    with wifi.WLan(**CONFIG["wifi"]):
-        with mqtt.MQTTClient(
-            poll,
-            CONFIG["topic_prefix"],
+    # Shared by both clients, can be switched from MQTT.
+    latency_histograms = latency.Latency(CONFIG.get("latency_histograms", False))
+    # Device settings received from MQTT, sent to devices over ESP-Now.
+    downlink = {}
+    # Layers are entered separately and recover from their own errors,
+    # ESP-Now keeps receiving while WiFi or MQTT reconnect.
+    with wifi.WLan(**CONFIG["wifi"]) as wlan:
+        with esp_now.ESPNow(
+            None if use_asyncio else poll,
             CONFIG["devices"],
-            interval,
-            **CONFIG["mqtt"]
-        ) as mqtt_client:  # fmt: skip
-            with esp_now.ESPNow(
+            CONFIG.get("primary_master_key"),
+            latency_histograms=latency_histograms,
+            downlink=downlink,
+            **CONFIG.get("esp_now", {}),
+        ) as esp_now_client:
+            with mqtt.MQTTClient(
                 poll,
+                CONFIG["topic_prefix"],
                 CONFIG["devices"],
-                CONFIG.get("primary_master_key"),
-            ) as esp_now_client:
+                interval,
+                latency_histograms=latency_histograms,
+                downlink=downlink,
+                **CONFIG["mqtt"]
+            ) as mqtt_client:  # fmt: skip
                 print("waiting for messages...")
-                next_ping = interval * 1000
-                while True:
-                    for event in poll.poll(next_ping):
-                        if mqtt_client.wants(event[0]):
-                            mqtt_client.receive(event[1])
-                        elif esp_now_client.wants(event[0]):
-                            device_id, data = esp_now_client.receive(event[1])
-                            if device_id and data is not None:
-                                mqtt_client.send(device_id, data)
-                        else:
-                            raise RuntimeError(f"unknown poll event {event}")
-                    next_ping = mqtt_client.ping()
+                if use_asyncio:
+                    # Only load asyncio when used.
+                    import aio  # ty: ignore[unresolved-import]
+
+                    aio.run(
+                        poll,
+                        mqtt_client,
+                        esp_now_client,
+                        CONFIG.get("queue_size", 64),
+                        telemetry_interval,
+                        wlan,
+                    )
+                    return
+                _serve(
+                    poll,
+                    wlan,
+                    esp_now_client,
+                    mqtt_client,
+                    interval,
+                    telemetry_interval,
+                )
+
+
+def _serve(poll, wlan, esp_now_client, mqtt_client, interval, telemetry_interval):
+    """Poll loop. An error in a layer resets it only, states are held by
+    the MQTT client while it reconnects.
+    """
+    # Until the next MQTT deadline.
+    next_deadline = interval * 1000
+    next_wifi_check = 0
+    hub_telemetry = telemetry.Telemetry(telemetry_interval)
+    while True:
+        events = poll.poll(min(next_deadline, next_wifi_check, hub_telemetry.timeout()))
+        hub_telemetry.loop_start()
+        for event in events:
+            if mqtt_client.wants(event[0]):
+                try:
+                    mqtt_client.receive(event[1])
+                except Exception as exc:
+                    mqtt_client.reset(exc)
+            elif esp_now_client.wants(event[0]):
+                try:
+                    for device_id, data in esp_now_client.receive(event[1]):
+                        try:
+                            mqtt_client.send(device_id, data)
+                        except Exception as exc:
+                            mqtt_client.reset(exc)
+                except Exception as exc:
+                    esp_now_client.reset(exc)
+            else:
+                raise RuntimeError(f"unknown poll event {event}")
+        # Reconnections advance from here, frames keep being received.
+        try:
+            next_wifi_check = wlan.check()
+        except Exception as exc:
+            wlan.reset(exc)
+            next_wifi_check = 0
+        try:
+            next_deadline = mqtt_client.ping()
+            if hub_telemetry.due():
+                mqtt_client.send_telemetry(
+                    hub_telemetry.collect(esp_now_client, mqtt_client, wlan)
+                )
+            mqtt_client.flush()
+        except Exception as exc:
+            mqtt_client.reset(exc)
+            next_deadline = 0
+        hub_telemetry.loop_end()
 
 
 while True:
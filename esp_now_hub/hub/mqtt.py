@@ -1,8 +1,22 @@
+import binascii
+import errno
 import json
 import select
+import socket
 import time
 
+import esp32
+import latency  # ty: ignore[unresolved-import]
+import mqtt5  # ty: ignore[unresolved-import]
+import ring_buffer  # ty: ignore[unresolved-import]
 import umqtt.simple
+import wire  # ty: ignore[unresolved-import]
+from backoff import Backoff  # ty: ignore[unresolved-import]
+from deadlines import Deadlines  # ty: ignore[unresolved-import]
+from flat_json import FlatJSON  # ty: ignore[unresolved-import]
+from micropython import const
+from packet_writer import PacketWriter  # ty: ignore[unresolved-import]
+from spool import Spool  # ty: ignore[unresolved-import]
 
 
 class MQTTClient:
@@ -12,186 +26,758 @@ class MQTTClient:
         topic_prefix,
         devices,
         keepalive,
-        server,
+        server=None,
         port=1883,
         user=None,
         password=None,
+        buffer=None,
+        spool=None,
+        writer=None,
+        latency_histograms=None,
+        ha_status_topic="homeassistant/status",
+        qos=0,
+        in_flight=8,
+        backoff=None,
+        brokers=None,
+        failback=300,
+        protocol=4,
+        downlink=None,
     ):
         self._poll = poll
         self._topic_prefix = topic_prefix
         self._devices = devices
+        self._keepalive = keepalive * 1000
         self._device_keepalive = {}
-        self._last_receive_ticks = {}
+        # Broker ping, broker silence and device offline deadlines,
+        # devices have one while online.
+        self._deadlines = Deadlines()
         self._last_broker_tick = None
+        self._last_write_tick = None
         self._last_ping_tick = None
+        # State publishes held while MQTT is unavailable.
+        self.pending = ring_buffer.RingBuffer(**(buffer or {}))
+        # Publishes evicted from RAM, older than pending ones.
+        self.spool = Spool(**spool) if spool else None
+        # Publishes are coalesced into few socket writes.
+        self._writer = PacketWriter(**(writer or {}))
+        # NVS keys of discovery hashes stored while their configs may be queued.
+        self._queued_configs = []
+        # State publishes with QoS 1 not acknowledged yet, oldest first:
+        # packet id, topic, payload. At most in_flight, others are held.
+        self._qos = qos
+        self._window = in_flight
+        self._in_flight = []
+        self._next_pid = 1
+        # State payloads are serialized in a reused buffer.
+        self._json = FlatJSON()
+        self._connected = False
+        # Server, port in order of preference.
+        self._brokers = [(b["server"], b.get("port", 1883)) for b in brokers or ()]
+        if server is not None:
+            self._brokers.insert(0, (server, port))
+        # Active broker, and the one holding the session.
+        self._broker = 0
+        self._session_broker = None
+        # Per broker: consecutive failures, last connect latency in ms.
+        self._failures = [0] * len(self._brokers)
+        self._connect_latency = [0] * len(self._brokers)
+        # Failed attempts since the last connection.
+        self._failed_attempts = 0
+        # Ms the preferred broker must answer probes before failing back.
+        self._failback = failback * 1000
+        self._healthy_tick = None
+        # Preferred broker address, resolved once, and pending probe connection.
+        self._probe_address = None
+        self._probe_socket = None
+        # Connections to another broker than the previous one.
+        self.failovers = 0
+        # Reconnection attempts are scheduled from ping.
+        self._backoff = Backoff(**(backoff or {}))
+        self._disconnect_tick = None
+        self._poll_mask = 0
+        # Set on Home Assistant birth, handled on the next flush.
+        self._discovery_requested = False
+        self.latency = latency_histograms or latency.Latency()
+        self.published = 0
+        self.publish_failures = 0
+        self.reconnects = 0
+        self.reconnect_attempts = 0
+        # Time spent disconnected in ms.
+        self.reconnect_time = 0
+        self.retransmitted = 0
+        # Unexpected errors recovered from.
+        self.resets = 0
+        # Device id -> status and state topics, built once.
+        self._topics = {}
+        for device_id in ["hub"] + [_device_id(d) for d in devices]:
+            self._topics[device_id] = (
+                self._get_status_topic(device_id),
+                self._get_state_topic(device_id),
+            )
+        # MQTT 5: status and state topic -> message expiry in s, 0 for none.
+        # They get topic aliases, topic -> properties once established.
+        self._expiry = {}
+        for status_topic, state_topic in self._topics.values():
+            self._expiry[status_topic] = self._expiry[state_topic] = 0
+        self._aliases = {}
         self._status_topic = self._get_status_topic("hub")
-        self._client = umqtt.simple.MQTTClient(
+        # Settings of the hub and devices are published to {prefix}/set/{device_id}.
+        self._set_prefix = f"{topic_prefix}/set/".encode()
+        # Device id -> settings waiting for the next frame of the device,
+        # sent by the ESP-Now client.
+        self.downlink = {} if downlink is None else downlink
+        # Home Assistant birth messages, discovery is sent again on them.
+        self._ha_status_topic = ha_status_topic.encode()
+        # Hashes of the last discovery configs sent per broker and device.
+        self._nvs = esp32.NVS(_NVS_NAMESPACE)
+        for device in devices:
+            # Store in ms and allow a bit more.
+            device_id = _device_id(device)
+            self._device_keepalive[device_id] = device["keepalive"] * 1500
+            # States are stale once the device is offline.
+            self._expiry[self._get_state_topic(device_id)] = (
+                self._device_keepalive[device_id] + 999
+            ) // 1000
+        # umqtt only speaks 3.1.1, mqtt5 falls back to it when needed.
+        self._protocol = protocol
+        client = mqtt5 if protocol == 5 else umqtt.simple
+        self._client = client.MQTTClient(
             topic_prefix,
-            server,
-            port=port,
+            self._brokers[0][0],
+            port=self._brokers[0][1],
             user=user,
             password=password,
             keepalive=keepalive,
         )
         self._client.set_last_will(self._status_topic, b"offline", retain=True)
+        self._client.set_callback(self._on_message)
 
     def __enter__(self):
-        while True:
-            try:
-                self._connect()
-                break
-            except OSError:
-                time.sleep(1)
-        self._send_discovery()
+        # Retried from ping on failure.
+        self._attempt()
+        self.flush()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._poll.unregister(self._client.sock)
-        self._client.publish(self._status_topic, b"offline", retain=True)
+        if self.spool is not None:
+            self.spool.flush()
+        if self._probe_socket is not None:
+            self._probe_socket.close()
+        if self._connected:
+            self._leave()
+
+    def _leave(self):
+        """Disconnect, putting the hub offline as the last will is not sent then."""
+        self._connected = False
+        if self._poll_mask:
+            self._poll.unregister(self._client.sock)
+            self._poll_mask = 0
+        self._queue(self._status_topic, b"offline", True)
+        self._writer.flush(self._client.sock)
         self._client.disconnect()
 
     def _get_status_topic(self, device_id):
+        topics = self._topics.get(device_id)
+        if topics:
+            return topics[0]
         return f"{self._topic_prefix}/status/{device_id}".encode()
 
     def _get_state_topic(self, device_id):
+        topics = self._topics.get(device_id)
+        if topics:
+            return topics[1]
         return f"{self._topic_prefix}/get/{device_id}".encode()
 
     def _connect(self, clean_session=True):
-        self._client.connect(clean_session)
-        self._last_broker_tick = self._last_ping_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
-        self._client.publish(self._status_topic, b"online", retain=True)
+        self._client.server, self._client.port = self._brokers[self._broker]
+        start = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        self._client.connect(clean_session, _CONNECT_TIMEOUT)
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        self._connect_latency[self._broker] = time.ticks_diff(now, start)  # ty: ignore[unresolved-attribute]
+        self._last_broker_tick = self._last_write_tick = self._last_ping_tick = now
+        self._schedule_ping()
+        self._client.subscribe(self._set_prefix + b"+")
+        self._client.subscribe(self._ha_status_topic)
+        if len(self._writer):
+            # Configs may not have reached the broker, sent again by discovery.
+            for key in self._queued_configs:
+                try:
+                    self._nvs.erase_key(key)
+                except OSError:
+                    pass
+            self._nvs.commit()
+        self._queued_configs = []
+        if self._protocol == 5:
+            # Queued packets may use aliases of the previous connection,
+            # or properties a 3.1.1 broker rejects. QoS 1 ones are retransmitted.
+            self._writer.clear()
+        else:
+            # Publishes queued before a reconnect are written before the status,
+            # QoS 1 ones are dropped as all in flight are retransmitted.
+            self._writer.rewind()
+            self._writer.drop_qos_1()
+        self._aliases = {}
+        self._queue(self._status_topic, b"online", True)
+        for pid, topic, payload in self._in_flight:
+            self._queue(topic, payload, False, pid, True)
+            self.retransmitted += 1
         self._poll.register(self._client.sock, select.POLLIN)
-        print("connected to MQTT")
-
-    def _reconnect(self, attempts=None):
-        self._poll.unregister(self._client.sock)
-        i = 0
-        while attempts is None or i < attempts:
-            if i:
-                time.sleep(min(i, 30))
+        self._poll_mask = select.POLLIN
+        self._write()
+        self._connected = True
+        print(f"connected to MQTT {self._client.server}")
+
+    def _attempt(self):
+        """Try to connect once, schedule the next attempt on failure,
+        to the next broker at once until all were tried, then after a backoff.
+        Once connected, discovery configs changed since sent to that broker,
+        device statuses and held states are published as they may have been missed.
+        """
+        self.reconnect_attempts += 1
+        broker = self._broker
+        try:
+            # Sessions are resumed on the same broker.
+            self._connect(broker != self._session_broker)
+        except Exception as exc:
+            # OSError, or MQTTException if refused.
+            print(f"could not connect to MQTT {self._brokers[broker][0]}: {exc}")
+            self._close()
+            self._failures[broker] += 1
+            self._failed_attempts += 1
+            self._select()
+            if self._failed_attempts % len(self._brokers):
+                self._deadlines.set(_RECONNECT, 0)
+            else:
+                self._deadlines.set(_RECONNECT, self._backoff.next())
+            return
+        if self._session_broker not in (None, broker):
+            self.failovers += 1
+        self._session_broker = broker
+        self._failures[broker] = 0
+        self._failed_attempts = 0
+        self._backoff.reset()
+        if self._disconnect_tick is not None:
+            now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+            self.reconnect_time += time.ticks_diff(now, self._disconnect_tick)  # ty: ignore[unresolved-attribute]
+            self._disconnect_tick = None
+        if broker:
+            self._healthy_tick = None
+            self._deadlines.set(_FAILBACK, _PROBE_INTERVAL)
+        else:
+            self._deadlines.cancel(_FAILBACK)
+        self._send_discovery()
+        for device_id in self._device_keepalive:
+            self._publish(
+                self._get_status_topic(device_id),
+                b"online" if device_id in self._deadlines else b"offline",
+                retain=True,
+            )
+        self._flush_pending()
+
+    def _select(self):
+        """Switch to the broker with the fewest consecutive failures,
+        preferring the first ones.
+        """
+        best = None
+        for i, failures in enumerate(self._failures):
+            if len(self._brokers) > 1 and i == self._broker:
+                continue
+            if best is None or failures < self._failures[best]:
+                best = i
+        self._broker = best
+
+    def _failback_check(self):
+        """Probe the preferred broker, switch to it once it answered
+        for the failback period. Probes connect without blocking,
+        they are checked after the probe timeout.
+        """
+        self._deadlines.set(_FAILBACK, _PROBE_INTERVAL)
+        probing = self._probe_socket is not None
+        answered = probing and self._probe_answered()
+        if not self._connected or not self._broker:
+            return
+        if not probing and self._probe():
+            self._deadlines.set(_FAILBACK, _PROBE_TIMEOUT)
+            return
+        if not answered:
+            self._failures[0] += 1
+            self._healthy_tick = None
+            return
+        self._failures[0] = 0
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        if self._healthy_tick is None:
+            self._healthy_tick = now
+        elif time.ticks_diff(now, self._healthy_tick) >= self._failback:  # ty: ignore[unresolved-attribute]
+            print("failing back to the preferred MQTT broker")
+            try:
+                self._leave()
+            except OSError:
+                self._close()
+            self._broker = 0
+            self._deadlines.cancel(_PING)
+            self._deadlines.cancel(_BROKER)
+            self._attempt()
+
+    def _probe(self):
+        """Start a TCP connection to the preferred broker, return False if it failed."""
+        try:
+            if self._probe_address is None:
+                self._probe_address = socket.getaddrinfo(*self._brokers[0])[0][-1]
+            sock = socket.socket()
+        except OSError:
+            return False
+        sock.setblocking(False)
+        try:
+            sock.connect(self._probe_address)
+        except OSError as exc:
+            if exc.errno != errno.EINPROGRESS:
+                sock.close()
+                return False
+        self._probe_socket = sock
+        return True
+
+    def _probe_answered(self):
+        """Return whether the probe connection succeeded, closing it."""
+        sock = self._probe_socket
+        self._probe_socket = None
+        poll = select.poll()
+        poll.register(sock, select.POLLOUT)
+        events = poll.poll(0)
+        sock.close()
+        return bool(events) and events[0][1] == select.POLLOUT
+
+    def _disconnect(self):
+        """Close the connection after an error, reconnect from ping."""
+        if not self._connected:
+            return
+        print("disconnected from MQTT")
+        self._connected = False
+        self.reconnects += 1
+        self._disconnect_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        self._close()
+        self._deadlines.cancel(_PING)
+        self._deadlines.cancel(_BROKER)
+        self._deadlines.set(_RECONNECT, 0)
+
+    def reset(self, exc):
+        """Recover from an unexpected error, without stopping other layers:
+        drop the connection, reconnect from ping after a backoff. Held states are kept.
+        """
+        print(f"resetting MQTT after error: {exc!r}")
+        self.resets += 1
+        if self._connected:
+            self._disconnect()
+        else:
+            self._close()
+        self._deadlines.set(_RECONNECT, self._backoff.next())
+
+    def _close(self):
+        if self._poll_mask:
+            self._poll.unregister(self._client.sock)
+            self._poll_mask = 0
+        sock = self._client.sock
+        if sock is not None:
             try:
-                self._connect(False)
-                return True
+                sock.close()
             except OSError:
-                i += 1
-        return False
+                pass
 
     def wants(self, obj):
         return obj is self._client.sock
 
     def receive(self, event):
         if event & select.POLLERR or event & select.POLLHUP:
-            self._reconnect()
-        elif event & select.POLLIN:
-            # Consume messages.
-            self._client.check_msg()
-            self._last_broker_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+            self._disconnect()
+            return
+        try:
+            if event & select.POLLOUT:
+                self._write()
+            if event & select.POLLIN:
+                # Consume messages, other packets than PUBLISH are left to read.
+                if self._client.check_msg() == _PUBACK:
+                    # Short enough for a single byte length, with MQTT 5 properties.
+                    sock = self._client.sock
+                    self._acknowledge(sock.read(sock.read(1)[0]))
+                self._last_broker_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+                self._schedule_ping()
+        except OSError:
+            self._disconnect()
 
-    def ping(self):
-        keepalive = self._client.keepalive * 1000
-        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
-        # Check if we need to ping.
-        next_ping = max(
-            0,
-            keepalive - time.ticks_diff(now, self._last_ping_tick),  # ty: ignore[unresolved-attribute]
+    def _acknowledge(self, packet):
+        pid = packet[0] << 8 | packet[1]
+        for i, in_flight in enumerate(self._in_flight):
+            if in_flight[0] == pid:
+                self._in_flight.pop(i)
+                break
+        # Publish states held while the window was full.
+        self._flush_pending()
+
+    def _on_message(self, topic, msg):
+        if topic == self._ha_status_topic:
+            # Not sent from here as it can be received while connecting.
+            if msg == b"online":
+                self._discovery_requested = True
+        elif topic.startswith(self._set_prefix):
+            try:
+                settings = json.loads(msg)
+            except ValueError:
+                return
+            if not isinstance(settings, dict):
+                return
+            device_id = topic[len(self._set_prefix) :].decode("utf-8")
+            if device_id == "hub":
+                if "latency" in settings:
+                    self.latency.enable(bool(settings["latency"]))
+            elif device_id in self._device_keepalive:
+                self._queue_settings(device_id, settings)
+
+    def _queue_settings(self, device_id, settings):
+        """Merge settings with those waiting for the device, unless too large."""
+        queued = {}
+        wire.merge_settings(queued, self.downlink.get(device_id, {}))
+        wire.merge_settings(
+            queued, {k: v for k, v in settings.items() if k in wire.SETTINGS_KEYS}
         )
-        if next_ping > 0:
-            return next_ping
-        # Check last message received from broker (at least ping responses).
-        if (
-            self._last_broker_tick is not None
-            and time.ticks_diff(now, self._last_broker_tick) > keepalive  # ty: ignore[unresolved-attribute]
-        ):
-            self._reconnect()
-        # Ping broker.
         try:
-            self._client.ping()
-            self._last_ping_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+            wire.encode_settings(queued)
+        except ValueError as exc:
+            print(f"dropping settings of {device_id}: {exc}")
+            return
+        self.downlink[device_id] = queued
+
+    def ping(self):
+        """Handle passed deadlines: ping the broker, disconnect if it stayed silent,
+        try to reconnect, put devices offline if nothing was received
+        within their keepalive. Return the time in ms until the next deadline.
+        """
+        keepalive = self._keepalive
+        while True:
+            name = self._deadlines.pop()
+            if name is None:
+                break
+            if name == _PING:
+                try:
+                    self._last_ping_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+                    self._writer.ping(self._client.sock)
+                    self._write()
+                except OSError:
+                    self._disconnect()
+                    continue
+                self._flush_pending()
+            elif name == _BROKER:
+                # Not answering pings, fail over.
+                self._failures[self._broker] += 1
+                self._disconnect()
+                self._select()
+            elif name == _FAILBACK:
+                self._failback_check()
+            elif name == _RECONNECT:
+                self._attempt()
+            else:
+                self._publish(self._get_status_topic(name), b"offline", retain=True)
+        return self._drain(self._deadlines.timeout(keepalive))
+
+    def flush(self):
+        """Write queued packets without blocking, call once per loop iteration."""
+        if not self._connected:
+            return
+        if self._discovery_requested:
+            self._discovery_requested = False
+            self._send_discovery(force=True)
+        try:
+            self._write()
         except OSError:
-            self._reconnect()
-        # Check if wee need to put some devices offline.
-        for device_id, dev_keepalive in self._device_keepalive.items():
-            ticks = self._last_receive_ticks.get(device_id)
-            if (
-                ticks is not None
-                and time.ticks_diff(time.ticks_ms(), ticks) > dev_keepalive  # ty: ignore[unresolved-attribute]
-            ):
-                self._publish(
-                    self._get_status_topic(device_id),
-                    b"offline",
-                    retain=True,
-                )
-                del self._last_receive_ticks[device_id]
-        return keepalive
+            # Written on reconnect.
+            self._disconnect()
+
+    def _write(self):
+        """Write queued packets, poll for writability while some are left."""
+        queued = len(self._writer)
+        if self._writer.write(self._client.sock):
+            mask = select.POLLIN
+        else:
+            mask = select.POLLIN | select.POLLOUT
+        if mask != self._poll_mask:
+            self._poll.modify(self._client.sock, mask)
+            self._poll_mask = mask
+        if not len(self._writer):
+            self._queued_configs = []
+        if len(self._writer) < queued:
+            # Sent packets reset the broker keepalive.
+            self._last_write_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+            self._schedule_ping()
+
+    def _schedule_ping(self):
+        """Ping keepalive after the last packet sent or received, whichever is older,
+        so pings are skipped while both happen, and at most once per keepalive.
+        The broker is considered gone if silent for another keepalive.
+        """
+        keepalive = self._keepalive
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        since_broker = time.ticks_diff(now, self._last_broker_tick)  # ty: ignore[unresolved-attribute]
+        since_write = time.ticks_diff(now, self._last_write_tick)  # ty: ignore[unresolved-attribute]
+        since_ping = time.ticks_diff(now, self._last_ping_tick)  # ty: ignore[unresolved-attribute]
+        self._deadlines.set(
+            _PING, keepalive - min(max(since_broker, since_write), since_ping)
+        )
+        self._deadlines.set(_BROKER, 2 * keepalive - since_broker)
+
+    def _drain(self, timeout):
+        """Drain the spool in the background while connected,
+        return the timeout shortened to the next drain.
+        """
+        if self.spool is None:
+            return timeout
+        self.spool.sync()
+        if not self._connected or not len(self.spool):
+            return timeout
+        self._flush_pending()
+        wait = self.spool.wait()
+        return timeout if wait is None else min(timeout, wait)
 
-    def _send_discovery(self):
+    def _send_discovery(self, force=False):
+        """Publish discovery configs of devices whose configs changed since last sent
+        to the broker, per hashes stored in NVS, or all configs if force.
+        """
+        # Hashes are kept per broker, each retains the configs sent to it.
+        prefix = f"{self._broker}/" if self._broker else ""
+        changed = False
         for device in self._devices:
-            device_id = device["address"].replace(":", "")
-            # Store in ms and allow a bit more.
-            self._device_keepalive[device_id] = device["keepalive"] * 1500
-            status_topic = self._get_status_topic(device_id)
-            state_topic = self._get_state_topic(device_id)
-            device_discovery = {
-                "identifiers": [f"{self._topic_prefix}-{device_id}"],
-                "manufacturer": device.get("manufacturer", ""),
-                "model": device.get("model", ""),
-                "name": device["name"],
+            device_id = _device_id(device)
+            changed |= self._send_configs(
+                prefix + device_id, self._device_configs(device_id, device), force
+            )
+        changed |= self._send_configs(prefix + "hub", self._hub_configs(), force)
+        if changed:
+            self._nvs.commit()
+
+    def _send_configs(self, key, configs, force):
+        crc = 0
+        payloads = []
+        for topic, config in configs:
+            payload = json.dumps(config).encode("utf-8")
+            crc = binascii.crc32(payload, binascii.crc32(topic, crc))
+            payloads.append((topic, payload))
+        # Stored as signed 32 bits.
+        crc &= 0x7FFFFFFF
+        if not force:
+            try:
+                if self._nvs.get_i32(key) == crc:
+                    return False
+            except OSError:
+                pass
+        for topic, payload in payloads:
+            if not self._publish(topic, payload, retain=True):
+                # Sent again once reconnected.
+                return False
+        self._nvs.set_i32(key, crc)
+        self._queued_configs.append(key)
+        return True
+
+    def _device_configs(self, device_id, device):
+        state_topic = self._get_state_topic(device_id)
+        device_discovery = {
+            "identifiers": [f"{self._topic_prefix}-{device_id}"],
+            "manufacturer": device.get("manufacturer", ""),
+            "model": device.get("model", ""),
+            "name": device["name"],
+        }
+        availability = [
+            {"topic": self._get_status_topic(device_id).decode("utf-8")},
+            {"topic": self._status_topic.decode("utf-8")},
+        ]
+        for sensor_id, components in device["components"].items():
+            for component in components:
+                yield (
+                    f"{self._topic_prefix}/sensor/{device_id}/{sensor_id}-{component}/config".encode(),
+                    {
+                        "state_topic": state_topic.decode("utf-8"),
+                        "value_template": "{{ value_json.%s_%s }}"  # noqa: UP031
+                        % (sensor_id, component),
+                        "state_class": "measurement",
+                        "device": device_discovery,
+                        "availability": availability,
+                        "availability_mode": "all",
+                        "unique_id": f"{self._topic_prefix}-{device_id}-{sensor_id}-{component}",
+                        "name": f"{sensor_id} {component}",
+                        "unit_of_measurement": _UNITS[component],
+                        "device_class": component,
+                        "icon": _ICONS[component],
+                    },
+                )
+
+    def _hub_configs(self):
+        device_discovery = {
+            "identifiers": [f"{self._topic_prefix}-hub"],
+            "name": "ESP-Now hub",
+        }
+        state_topic = self._get_state_topic("hub").decode("utf-8")
+        availability = [{"topic": self._status_topic.decode("utf-8")}]
+        for field, (unit, state_class) in _HUB_SENSORS.items():
+            if field.startswith("spool_") and self.spool is None:
+                continue
+            discovery = {
+                "state_topic": state_topic,
+                "value_template": "{{ value_json.%s }}" % field,  # noqa: UP031
+                "state_class": state_class,
+                "entity_category": "diagnostic",
+                "device": device_discovery,
+                "availability": availability,
+                "unique_id": f"{self._topic_prefix}-hub-{field}",
+                "name": field.replace("_", " "),
             }
-            availability = [
-                {"topic": status_topic.decode("utf-8")},
-                {"topic": self._status_topic.decode("utf-8")},
-            ]
-            for sensor_id, components in device["components"].items():
-                for component in components:
-                    self._publish(
-                        f"{self._topic_prefix}/sensor/{device_id}/{sensor_id}-{component}/config",
-                        {
-                            "state_topic": state_topic.decode("utf-8"),
-                            "value_template": "{{ value_json.%s_%s }}"  # noqa: UP031
-                            % (sensor_id, component),
-                            "state_class": "measurement",
-                            "device": device_discovery,
-                            "availability": availability,
-                            "availability_mode": "all",
-                            "unique_id": f"{self._topic_prefix}-{device_id}-{sensor_id}-{component}",
-                            "name": f"{sensor_id} {component}",
-                            "unit_of_measurement": _UNITS[component],
-                            "device_class": component,
-                            "icon": _ICONS[component],
-                        },
-                        retain=True,
-                        keep_trying=True,
-                        encode=True,
-                    )
-            self._publish(status_topic, b"offline", retain=True)
+            if unit:
+                discovery["unit_of_measurement"] = unit
+            yield f"{self._topic_prefix}/sensor/hub/{field}/config".encode(), discovery
 
     def send(self, device_id, data):
-        if device_id not in self._last_receive_ticks:
+        if device_id not in self._deadlines:
             self._publish(self._get_status_topic(device_id), b"online", retain=True)
-        self._last_receive_ticks[device_id] = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        self._deadlines.set(device_id, self._device_keepalive[device_id])
         if data:
-            self._publish(self._get_state_topic(device_id), data, encode=True)
+            # Keep the order, publish after what is pending.
+            if not self._flush_pending() or not self._publish_state(device_id, data):
+                self._hold(device_id, data)
+            elif self.latency.start is not None:
+                self.latency.checkpoint(latency.PUBLISH)
 
-    def _publish(self, topic, data, retain=False, keep_trying=False, encode=False):
-        """Retry indefinitely if keep_trying or just once otherwise."""
-        retried = False
-        while True:
-            try:
-                self._client.publish(
-                    topic,
-                    json.dumps(data).encode("utf-8") if encode else data,
-                    retain=retain,
-                )
-                return True
-            except OSError:
-                if keep_trying:
-                    self._reconnect()
-                elif retried:
-                    return False
-                else:
-                    retried = True
-                    if not self._reconnect(1):
-                        return False
+    def telemetry(self):
+        data = {
+            "published": self.published,
+            "publish_failures": self.publish_failures,
+            "reconnects": self.reconnects,
+            "reconnect_attempts": self.reconnect_attempts,
+            "reconnect_time": self.reconnect_time,
+            "broker": self._broker,
+            "failovers": self.failovers,
+            "connect_latency": self._connect_latency[self._broker],
+            "retransmitted": self.retransmitted,
+            "mqtt_resets": self.resets,
+            "in_flight": len(self._in_flight),
+            "socket_writes": self._writer.writes,
+            "write_queue_full": self._writer.full,
+            "buffered": self.pending.buffered,
+            "flushed": self.pending.flushed,
+            "evicted": self.pending.evicted,
+        }
+        if self.spool is not None:
+            data["spool_spooled"] = self.spool.spooled
+            data["spool_drained"] = self.spool.drained
+            data["spool_dropped"] = self.spool.dropped
+        data.update(self.latency.telemetry())
+        return data
+
+    def send_telemetry(self, data):
+        self._publish(self._get_state_topic("hub"), data, retain=True, encode=True)
+
+    def _hold(self, device_id, data):
+        evicted = self.pending.push(device_id, data)
+        if evicted and self.spool is not None:
+            self.spool.append(evicted[0], json.dumps(evicted[1]).encode("utf-8"))
+
+    def _flush_pending(self):
+        """Publish spooled then pending states in order,
+        return whether all were published.
+        """
+        if self.spool is not None and not self.spool.drain(self._publish_spooled):
+            return False
+        while self.pending:
+            device_id, data = self.pending.peek()
+            if not self._publish_state(device_id, data):
+                return False
+            self.pending.pop()
+        return True
+
+    def _publish_spooled(self, device_id, payload):
+        return self._publish_state(device_id, payload, encode=False)
+
+    def _publish_state(self, device_id, data, encode=True):
+        """Return False if not connected, the in-flight window or queue is full."""
+        return self._publish(
+            self._get_state_topic(device_id),
+            data,
+            encode=encode,
+            qos=self._qos,
+            block=False,
+        )
+
+    def _publish(
+        self,
+        topic,
+        data,
+        retain=False,
+        encode=False,
+        qos=0,
+        block=True,
+    ):
+        """Return False if not connected or writing failed, disconnecting.
+        With QoS 1, return False without trying while the in-flight window is full.
+        If not block, return False when the outgoing queue is full,
+        drop the publish if larger than the queue as it would never fit.
+        """
+        if qos and len(self._in_flight) >= self._window:
+            return False
+        if not self._connected:
+            # Would be queued without noticing the connection is down.
+            self.publish_failures += 1
+            return False
+        if encode:
+            payload = self._json.encode(data)
+            # Nested or non-numeric data.
+            data = json.dumps(data).encode("utf-8") if payload is None else payload
+        pid = self._next_pid if qos else 0
+        try:
+            if not self._queue(topic, data, retain, pid, block=block):
+                return False
+        except ValueError as exc:
+            print(f"dropped publish to {topic.decode()}: {exc}")
+            self.publish_failures += 1
+            return True
+        except OSError:
+            self._disconnect()
+            self.publish_failures += 1
+            return False
+        if pid:
+            # Kept for retransmission, the encoding buffer is reused.
+            self._in_flight.append((pid, topic, bytes(data)))
+            self._next_pid = pid % 0xFFFF + 1
+        self.published += 1
+        return True
+
+    def _queue(self, topic, data, retain=False, pid=0, dup=False, block=True):
+        """Queue a PUBLISH, with MQTT 5 the topic is replaced by its alias
+        once established on the connection.
+        """
+        sock = self._client.sock
+        if self._protocol != 5 or self._client.protocol != 5:
+            return self._writer.publish(sock, topic, data, retain, pid, dup, block)
+        props = self._aliases.get(topic)
+        if props is not None:
+            return self._writer.publish(sock, b"", data, retain, pid, dup, block, props)
+        props = self._properties(topic)
+        if not self._writer.publish(sock, topic, data, retain, pid, dup, block, props):
+            return False
+        if props and props[0] == _TOPIC_ALIAS:
+            self._aliases[topic] = props
+        return True
+
+    def _properties(self, topic):
+        """Return MQTT 5 properties of a topic without established alias:
+        the next alias if the broker accepts more, and message expiry.
+        """
+        expiry = self._expiry.get(topic)
+        if expiry is None:
+            return b""
+        props = bytearray()
+        alias = len(self._aliases) + 1
+        if alias <= self._client.topic_alias_maximum:
+            props.append(_TOPIC_ALIAS)
+            props.append(alias >> 8)
+            props.append(alias & 0xFF)
+        if expiry:
+            props.append(_MESSAGE_EXPIRY)
+            props.extend(expiry.to_bytes(4, "big"))
+        return props
 
 
 _UNITS = {
@@ -204,3 +790,69 @@ _ICONS = {
     "humidity": "mdi:water-percent",
     "pressure": "mdi:speedometer",
 }
+_PUBACK = const(0x40)
+# MQTT 5 property identifiers.
+_MESSAGE_EXPIRY = const(0x02)
+_TOPIC_ALIAS = const(0x23)
+# Deadline names, others are device ids.
+_PING = const("ping")
+_BROKER = const("broker")
+_RECONNECT = const("reconnect")
+_FAILBACK = const("failback")
+# Preferred broker probes, interval and timeout in ms.
+_PROBE_INTERVAL = const(30000)
+_PROBE_TIMEOUT = const(1000)
+# Seconds for the TCP connection and CONNACK, the main loop is blocked meanwhile.
+_CONNECT_TIMEOUT = const(2)
+_NVS_NAMESPACE = const("discovery")
+_COUNTER = const("total_increasing")
+_GAUGE = const("measurement")
+# Hub telemetry field -> unit, state class.
+_HUB_SENSORS = {
+    "uptime": ("s", _GAUGE),
+    "loop_iterations": (None, _COUNTER),
+    "max_loop_latency": ("ms", _GAUGE),
+    "mem_free_low": ("B", _GAUGE),
+    "frames": (None, _COUNTER),
+    "decode_failures": (None, _COUNTER),
+    "unknown_devices": (None, _COUNTER),
+    "duplicates": (None, _COUNTER),
+    "max_drained": (None, _GAUGE),
+    "tx_packets": (None, _COUNTER),
+    "tx_responses": (None, _COUNTER),
+    "tx_failures": (None, _COUNTER),
+    "rx_packets": (None, _COUNTER),
+    "rx_dropped": (None, _COUNTER),
+    "downlinks": (None, _COUNTER),
+    "downlink_failures": (None, _COUNTER),
+    "published": (None, _COUNTER),
+    "publish_failures": (None, _COUNTER),
+    "reconnects": (None, _COUNTER),
+    "reconnect_attempts": (None, _COUNTER),
+    "reconnect_time": ("ms", _COUNTER),
+    "broker": (None, _GAUGE),
+    "failovers": (None, _COUNTER),
+    "connect_latency": ("ms", _GAUGE),
+    "retransmitted": (None, _COUNTER),
+    "mqtt_resets": (None, _COUNTER),
+    "esp_now_resets": (None, _COUNTER),
+    "wifi_resets": (None, _COUNTER),
+    "wifi_reconnects": (None, _COUNTER),
+    "wifi_reconnect_attempts": (None, _COUNTER),
+    "wifi_reconnect_time": ("ms", _COUNTER),
+    "wifi_connect_time": ("ms", _GAUGE),
+    "in_flight": (None, _GAUGE),
+    "socket_writes": (None, _COUNTER),
+    "write_queue_full": (None, _COUNTER),
+    "buffered": (None, _COUNTER),
+    "flushed": (None, _COUNTER),
+    "evicted": (None, _COUNTER),
+    "spool_spooled": (None, _COUNTER),
+    "spool_drained": (None, _COUNTER),
+    "spool_dropped": (None, _COUNTER),
+}
+
+
+def _device_id(device):
+    """Hex address of a device, lowercase as ESP-Now frames are identified by."""
+    return device["address"].replace(":", "").lower()
@@ -0,0 +1,285 @@
+import socket
+
+from micropython import const
+
+_CONNECT = const(0x10)
+_CONNACK = const(0x20)
+_PUBACK = const(0x40)
+_SUBSCRIBE = const(0x82)
+_SUBACK = const(0x90)
+_PINGRESP = const(0xD0)
+_DISCONNECT = const(0xE0)
+# CONNACK codes of brokers not supporting MQTT 5: 3.1.1 unacceptable protocol
+# version, and MQTT 5 unsupported protocol version.
+_UNACCEPTABLE_VERSION = const(0x01)
+_UNSUPPORTED_VERSION = const(0x84)
+_TOPIC_ALIAS_MAXIMUM = const(0x22)
+# Property identifier -> value size, 0 for length prefixed, -1 for a pair of them,
+# -2 for a variable byte integer.
+_PROPERTY_SIZES = {
+    0x01: 1,
+    0x02: 4,
+    0x03: 0,
+    0x08: 0,
+    0x09: 0,
+    0x0B: -2,
+    0x11: 4,
+    0x12: 0,
+    0x13: 2,
+    0x15: 0,
+    0x16: 0,
+    0x17: 1,
+    0x18: 4,
+    0x19: 1,
+    0x1A: 0,
+    0x1C: 0,
+    0x1F: 0,
+    0x21: 2,
+    0x22: 2,
+    0x23: 2,
+    0x24: 1,
+    0x25: 1,
+    0x26: -1,
+    0x27: 4,
+    0x28: 1,
+    0x29: 1,
+    0x2A: 1,
+}
+
+
+class MQTTClient:
+    """MQTT 5 client, falling back to 3.1.1 with brokers rejecting version 5.
+    Implements what the hub uses of umqtt.simple.MQTTClient, PUBLISH packets
+    are written by the hub with the properties it needs.
+    """
+
+    def __init__(
+        self, client_id, server, port=1883, user=None, password=None, keepalive=0
+    ):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self.sock = None
+        self.cb = None
+        self._will = None
+        self.pid = 0
+        # Protocol level of the connection, 5 or 4 (3.1.1).
+        self.protocol = 5
+        # Topic aliases the broker accepts, 0 if none.
+        self.topic_alias_maximum = 0
+        # Server, port of brokers which rejected MQTT 5.
+        self._legacy = set()
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        self._will = (topic, msg, retain, qos)
+
+    def connect(self, clean_session=True, timeout=None):
+        broker = (self.server, self.port)
+        self.protocol = 4 if broker in self._legacy else 5
+        code = self._handshake(clean_session, timeout)
+        if self.protocol == 5 and code in (
+            _UNACCEPTABLE_VERSION,
+            _UNSUPPORTED_VERSION,
+            None,
+        ):
+            print("MQTT 5 rejected, falling back to 3.1.1")
+            self.sock.close()
+            self._legacy.add(broker)
+            self.protocol = 4
+            code = self._handshake(clean_session, timeout)
+        if code is None or code:
+            self.sock.close()
+            raise OSError(f"connection refused: {code}")
+
+    def _handshake(self, clean_session, timeout):
+        """Open a connection and send CONNECT, return the CONNACK code,
+        or None if the broker closed the connection. Raise OSError
+        if the connection or CONNACK takes more than timeout s.
+        """
+        self.topic_alias_maximum = 0
+        addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+        self.sock = socket.socket()
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        v5 = self.protocol == 5
+        flags = 0x02 if clean_session else 0
+        body = bytearray(b"\x00\x04MQTT")
+        body.append(self.protocol)
+        body.append(0)
+        body.append(self.keepalive >> 8)
+        body.append(self.keepalive & 0xFF)
+        if v5:
+            # No properties.
+            body.append(0)
+        _append_str(body, self.client_id)
+        if self._will:
+            topic, msg, retain, qos = self._will
+            flags |= 0x04 | qos << 3 | (0x20 if retain else 0)
+            if v5:
+                body.append(0)
+            _append_str(body, topic)
+            _append_str(body, msg)
+        if self.user:
+            flags |= 0x80
+            _append_str(body, self.user)
+        if self.password:
+            flags |= 0x40
+            _append_str(body, self.password)
+        body[7] = flags
+        self._write_packet(_CONNECT, body)
+        op = self.sock.read(1)
+        if not op:
+            return None
+        if op[0] != _CONNACK:
+            raise OSError("unexpected packet")
+        resp = self.sock.read(self._recv_len())
+        code = resp[1]
+        if v5 and not code:
+            self._read_connack_properties(resp)
+        return code
+
+    def _read_connack_properties(self, resp):
+        size, i = _read_varint(resp, 2)
+        end = i + size
+        while i < end:
+            identifier = resp[i]
+            i += 1
+            if identifier == _TOPIC_ALIAS_MAXIMUM:
+                self.topic_alias_maximum = resp[i] << 8 | resp[i + 1]
+            value_size = _PROPERTY_SIZES.get(identifier)
+            if value_size is None:
+                # Unknown, the rest can not be parsed.
+                return
+            if value_size > 0:
+                i += value_size
+            elif value_size == -2:
+                i = _read_varint(resp, i)[1]
+            else:
+                for _ in range(1 if value_size == 0 else 2):
+                    i += 2 + (resp[i] << 8 | resp[i + 1])
+
+    def disconnect(self):
+        self.sock.write(b"\xe0\x00")
+        self.sock.close()
+
+    def subscribe(self, topic, qos=0):
+        self.pid = self.pid % 0xFFFF + 1
+        pid = self.pid
+        body = bytearray()
+        body.append(pid >> 8)
+        body.append(pid & 0xFF)
+        if self.protocol == 5:
+            body.append(0)
+        _append_str(body, topic)
+        body.append(qos)
+        self._write_packet(_SUBSCRIBE, body)
+        while True:
+            if self.wait_msg() == _SUBACK:
+                resp = self.sock.read(self._recv_len())
+                if resp[0] << 8 | resp[1] != pid:
+                    raise OSError("unexpected SUBACK")
+                if resp[-1] & 0x80:
+                    raise OSError(f"subscription refused: {resp[-1]}")
+                return
+
+    def wait_msg(self):
+        """Handle a PUBLISH, return the packet type, others are left to read."""
+        res = self.sock.read(1)
+        self.sock.setblocking(True)
+        if res is None:
+            return None
+        if res == b"":
+            raise OSError(-1)
+        op = res[0]
+        if op == _PINGRESP:
+            self.sock.read(1)
+            return None
+        if op == _DISCONNECT:
+            raise OSError("disconnected by the broker")
+        if op & 0xF0 != 0x30:
+            return op
+        size = self._recv_len()
+        topic_size = self.sock.read(2)
+        topic_size = topic_size[0] << 8 | topic_size[1]
+        topic = self.sock.read(topic_size)
+        size -= topic_size + 2
+        pid = 0
+        if op & 6:
+            pid = self.sock.read(2)
+            pid = pid[0] << 8 | pid[1]
+            size -= 2
+        if self.protocol == 5:
+            properties = self._recv_len()
+            size -= _varint_size(properties) + properties
+            if properties:
+                self.sock.read(properties)
+        msg = self.sock.read(size)
+        self.cb(topic, msg)
+        if op & 6 == 2:
+            self.sock.write(bytes((_PUBACK, 2, pid >> 8, pid & 0xFF)))
+        elif op & 6 == 4:
+            raise OSError("QoS 2 not supported")
+        return op
+
+    def check_msg(self):
+        self.sock.setblocking(False)
+        return self.wait_msg()
+
+    def _recv_len(self):
+        n = 0
+        shift = 0
+        while True:
+            b = self.sock.read(1)[0]
+            n |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return n
+            shift += 7
+
+    def _write_packet(self, op, body):
+        header = bytearray()
+        header.append(op)
+        _append_varint(header, len(body))
+        self.sock.write(header)
+        self.sock.write(body)
+
+
+def _append_str(buffer, s):
+    if isinstance(s, str):
+        s = s.encode()
+    buffer.append(len(s) >> 8)
+    buffer.append(len(s) & 0xFF)
+    buffer.extend(s)
+
+
+def _append_varint(buffer, value):
+    while value > 0x7F:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(buffer, i):
+    """Return the value at i and the index after it."""
+    value = 0
+    shift = 0
+    while True:
+        b = buffer[i]
+        i += 1
+        value |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return value, i
+        shift += 7
+
+
+def _varint_size(value):
+    size = 1
+    while value > 0x7F:
+        value >>= 7
+        size += 1
+    return size
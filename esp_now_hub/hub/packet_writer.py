@@ -0,0 +1,241 @@
+import time
+
+from micropython import const
+
+_PUBLISH = const(0x30)
+_DUP = const(0x08)
+_QOS_1 = const(0x02)
+_RETAIN = const(0x01)
+_PINGREQ = const(0xC0)
+
+
+class PacketWriter:
+    """Outgoing queue of MQTT packets in a preallocated buffer.
+    Packets are written without blocking on write, when the socket is writable,
+    or after max_delay ms during bursts, resuming after partial writes.
+    Unsent packets are kept on write errors, rewind before writing them
+    on a new connection so a partially written packet is sent again whole.
+    """
+
+    def __init__(self, size=1024, max_delay=50):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        # Packets from _start to _end are not fully written,
+        # the first one has _sent bytes written.
+        self._start = 0
+        self._sent = 0
+        self._end = 0
+        self._max_delay = max_delay
+        # Ticks of the oldest packet not written yet.
+        self._tick = None
+        self.packets = 0
+        self.writes = 0
+        # Publishes refused or waiting for room as the queue was full.
+        self.full = 0
+
+    def __len__(self):
+        """Bytes left to write."""
+        return self._end - self._start - self._sent
+
+    def publish(
+        self, sock, topic, msg, retain=False, pid=0, dup=False, block=True, props=None
+    ):
+        """Queue a PUBLISH packet, with QoS 1 if a packet id is given,
+        in MQTT 5 format if properties are given (encoded, maybe empty).
+        When the queue is full, write it blocking if block,
+        otherwise return False. Packets larger than the queue are written
+        as is once it is flushed, so only if block, raise ValueError otherwise.
+        """
+        remaining = 2 + len(topic) + len(msg) + (2 if pid else 0)
+        if props is not None:
+            remaining += _varint_size(len(props)) + len(props)
+        size = 1 + _varint_size(remaining) + remaining
+        if not self._reserve(sock, size, block):
+            return False
+        if size > len(self._buffer):
+            # Too large to be queued, written as is once the queue is empty.
+            header = bytearray(size - len(topic) - len(msg))
+            i = self._write_header(header, 0, topic, retain, pid, dup, remaining)
+            sock.write(header[:i])
+            sock.write(topic)
+            end = self._write_variable(header, i, pid, props)
+            if end > i:
+                sock.write(header[i:end])
+                self.writes += 1
+            sock.write(msg)
+            self.writes += 3
+            self.packets += 1
+            return True
+        i = self._write_header(
+            self._buffer, self._end, topic, retain, pid, dup, remaining
+        )
+        self._buffer[i : i + len(topic)] = topic
+        i = self._write_variable(self._buffer, i + len(topic), pid, props)
+        self._buffer[i : i + len(msg)] = msg
+        self._end = i + len(msg)
+        self._queued(sock)
+        return True
+
+    def ping(self, sock):
+        """Queue a PINGREQ, behind pending packets."""
+        self._reserve(sock, 2, True)
+        self._buffer[self._end] = _PINGREQ
+        self._buffer[self._end + 1] = 0
+        self._end += 2
+        self._queued(sock)
+
+    def _reserve(self, sock, size, block):
+        """Make room for size bytes, return whether there is."""
+        if self._end + size <= len(self._buffer):
+            return True
+        if size > len(self._buffer):
+            if not block:
+                raise ValueError("packet larger than the write queue")
+            self.flush(sock)
+            return True
+        self._compact()
+        if self._end + size <= len(self._buffer):
+            return True
+        self.full += 1
+        if block:
+            self.flush(sock)
+            return True
+        self.write(sock)
+        self._compact()
+        return self._end + size <= len(self._buffer)
+
+    def _queued(self, sock):
+        self.packets += 1
+        if self._tick is None:
+            self._tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        elif time.ticks_diff(time.ticks_ms(), self._tick) >= self._max_delay:  # ty: ignore[unresolved-attribute]
+            try:
+                self.write(sock)
+            except OSError:
+                # The packet is queued, the error is raised on the next write.
+                pass
+
+    @staticmethod
+    def _write_header(buffer, i, topic, retain, pid, dup, remaining):
+        """Write the fixed header and topic length at i, return the topic index.
+        The packet id and properties are written after the topic by the caller.
+        """
+        buffer[i] = (
+            _PUBLISH
+            | (_RETAIN if retain else 0)
+            | (_QOS_1 if pid else 0)
+            | (_DUP if dup else 0)
+        )
+        i += 1
+        while remaining > 0x7F:
+            buffer[i] = remaining & 0x7F | 0x80
+            remaining >>= 7
+            i += 1
+        buffer[i] = remaining
+        buffer[i + 1] = len(topic) >> 8
+        buffer[i + 2] = len(topic) & 0xFF
+        return i + 3
+
+    @staticmethod
+    def _write_variable(buffer, i, pid, props):
+        """Write the packet id and properties at i, return the payload index."""
+        if pid:
+            buffer[i] = pid >> 8
+            buffer[i + 1] = pid & 0xFF
+            i += 2
+        if props is not None:
+            size = len(props)
+            while size > 0x7F:
+                buffer[i] = size & 0x7F | 0x80
+                size >>= 7
+                i += 1
+            buffer[i] = size
+            buffer[i + 1 : i + 1 + len(props)] = props
+            i += 1 + len(props)
+        return i
+
+    def write(self, sock):
+        """Write what the socket accepts without blocking, return whether all was."""
+        if not len(self):
+            return True
+        sock.setblocking(False)
+        try:
+            written = sock.write(self._view[self._start + self._sent : self._end])
+        finally:
+            sock.setblocking(True)
+        self.writes += 1
+        if written:
+            self._advance(written)
+        return not len(self)
+
+    def flush(self, sock):
+        """Write all packets, blocking."""
+        while len(self):
+            written = sock.write(self._view[self._start + self._sent : self._end])
+            self.writes += 1
+            if written:
+                self._advance(written)
+
+    def rewind(self):
+        """Write the partially written packet from its start, for a new connection."""
+        self._sent = 0
+
+    def drop_qos_1(self):
+        """Drop unsent QoS 1 publishes after a rewind, retransmitted by the caller."""
+        i = j = self._start
+        while i < self._end:
+            size = _packet_size(self._buffer, i)
+            if self._buffer[i] & 0xF6 != _PUBLISH | _QOS_1:
+                self._view[j : j + size] = self._view[i : i + size]
+                j += size
+            i += size
+        self._end = j
+        if self._start == self._end:
+            self._start = self._end = 0
+            self._tick = None
+
+    def clear(self):
+        """Drop unsent packets, for a new connection they are not valid on."""
+        self._start = self._sent = self._end = 0
+        self._tick = None
+
+    def _advance(self, written):
+        self._sent += written
+        while self._start < self._end:
+            size = _packet_size(self._buffer, self._start)
+            if self._sent < size:
+                break
+            self._start += size
+            self._sent -= size
+        if self._start == self._end:
+            self._start = self._sent = self._end = 0
+            self._tick = None
+
+    def _compact(self):
+        if self._start:
+            size = self._end - self._start
+            self._view[:size] = self._view[self._start : self._end]
+            self._start = 0
+            self._end = size
+
+
+def _varint_size(value):
+    size = 1
+    while value > 0x7F:
+        value >>= 7
+        size += 1
+    return size
+
+
+def _packet_size(buffer, i):
+    """Return the size of the packet at i, from its remaining length."""
+    remaining = 0
+    shift = 0
+    size = 1
+    while True:
+        byte = buffer[i + size]
+        remaining |= (byte & 0x7F) << shift
+        size += 1
+        if not byte & 0x80:
+            return size + remaining
+        shift += 7
@@ -0,0 +1,64 @@
+from micropython import const
+
+DROP_OLDEST = const("oldest")
+LATEST_PER_DEVICE = const("latest")
+
+
+class RingBuffer:
+    """Preallocated FIFO of pending state publishes.
+    When full, the oldest publish is evicted.
+    With the latest per device policy, a device has at most one pending publish,
+    new data is merged into it.
+    """
+
+    def __init__(self, capacity=32, policy=DROP_OLDEST):
+        if policy not in {DROP_OLDEST, LATEST_PER_DEVICE}:
+            raise ValueError(f"unknown buffer policy {policy}")
+        self._device_ids = [None] * capacity
+        self._data = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self._latest = policy == LATEST_PER_DEVICE
+        self.buffered = 0
+        self.flushed = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, device_id, data):
+        """Return the evicted device id and data if any."""
+        self.buffered += 1
+        capacity = len(self._data)
+        if self._latest:
+            for i in range(self._count):
+                idx = (self._head + i) % capacity
+                if self._device_ids[idx] == device_id:
+                    self._data[idx].update(data)
+                    self.evicted += 1
+                    return None
+        evicted = None
+        if self._count == capacity:
+            evicted = self.peek()
+            self._drop()
+            self.evicted += 1
+        idx = (self._head + self._count) % capacity
+        self._device_ids[idx] = device_id
+        self._data[idx] = data
+        self._count += 1
+        return evicted
+
+    def peek(self):
+        """Return the oldest device id and data."""
+        return self._device_ids[self._head], self._data[self._head]
+
+    def pop(self):
+        """Remove the oldest publish once flushed."""
+        self._drop()
+        self.flushed += 1
+
+    def _drop(self):
+        self._device_ids[self._head] = None
+        self._data[self._head] = None
+        self._head = (self._head + 1) % len(self._data)
+        self._count -= 1
@@ -0,0 +1,187 @@
+import os
+import struct
+import time
+
+from micropython import const
+
+_RECORD_HEADER = const("<BH")  # device id length, data length
+_RECORD_HEADER_SIZE = const(3)
+
+
+class Spool:
+    """Append-only spool of state publishes on flash, for long MQTT outages.
+    Records are written in segment files, oldest segments are dropped
+    once the total size is reached.
+    To limit flash wear, records are batched in a page sized buffer,
+    written when full or after flush_interval seconds.
+    Records are drained at drain_rate per second so draining never blocks for long.
+    Segments are read from the start after a restart,
+    records already drained from the first segment are then sent again.
+    """
+
+    def __init__(
+        self,
+        path="spool",
+        segment_size=16384,
+        max_size=131072,
+        page_size=4096,
+        flush_interval=60,
+        drain_rate=10,
+        drain_burst=10,
+    ):
+        self._path = path
+        self._segment_size = segment_size
+        self._max_size = max_size
+        self._flush_interval = flush_interval * 1000
+        self._drain_cost = 1000 // drain_rate
+        self._max_credit = self._drain_cost * drain_burst
+        self._credit = self._max_credit
+        self._credit_tick = None
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+        # Segment numbers, oldest first, and their sizes.
+        self._segments = sorted(int(name) for name in os.listdir(path))
+        self._sizes = [os.stat(self._segment_path(n))[6] for n in self._segments]
+        self._next_segment = self._segments[-1] + 1 if self._segments else 0
+        # Read position in the oldest segment.
+        self._offset = 0
+        # Write buffer, records from _buffer_start to _buffer_end not written yet.
+        self._buffer = bytearray(page_size)
+        self._buffer_start = 0
+        self._buffer_end = 0
+        self._buffer_tick = None
+        self.spooled = 0
+        self.drained = 0
+        # Segments dropped because the spool was full.
+        self.dropped = 0
+
+    def __len__(self):
+        """Pending bytes."""
+        return sum(self._sizes) - self._offset + self._buffer_end - self._buffer_start
+
+    def _segment_path(self, number):
+        return f"{self._path}/{number:08d}"
+
+    def append(self, device_id, data):
+        device_id = device_id.encode()
+        size = _RECORD_HEADER_SIZE + len(device_id) + len(data)
+        if size > len(self._buffer):
+            raise ValueError("record larger than spool page")
+        if self._buffer_end + size > len(self._buffer):
+            self.flush()
+        if self._buffer_tick is None:
+            self._buffer_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        struct.pack_into(
+            _RECORD_HEADER, self._buffer, self._buffer_end, len(device_id), len(data)
+        )
+        i = self._buffer_end + _RECORD_HEADER_SIZE
+        self._buffer[i : i + len(device_id)] = device_id
+        i += len(device_id)
+        self._buffer[i : i + len(data)] = data
+        self._buffer_end += size
+        self.spooled += 1
+
+    def sync(self):
+        """Write buffered records if they have waited for flush_interval."""
+        if (
+            self._buffer_tick is not None
+            and time.ticks_diff(time.ticks_ms(), self._buffer_tick)  # ty: ignore[unresolved-attribute]
+            >= self._flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write buffered records to the last segment."""
+        size = self._buffer_end - self._buffer_start
+        if not size:
+            return
+        if not self._segments or self._sizes[-1] + size > self._segment_size:
+            self._segments.append(self._next_segment)
+            self._sizes.append(0)
+            self._next_segment += 1
+            while len(self._segments) > 1 and sum(self._sizes) + size > self._max_size:
+                self._drop_segment()
+                self.dropped += 1
+        with open(self._segment_path(self._segments[-1]), "ab") as f:
+            f.write(memoryview(self._buffer)[self._buffer_start : self._buffer_end])
+        self._sizes[-1] += size
+        self._buffer_start = self._buffer_end = 0
+        self._buffer_tick = None
+
+    def _drop_segment(self):
+        os.remove(self._segment_path(self._segments.pop(0)))
+        self._sizes.pop(0)
+        self._offset = 0
+
+    def drain(self, publish):
+        """Pass spooled records to publish(device_id, data) in order,
+        as allowed by the drain rate, stop if publish returns False.
+        Return whether the spool is empty.
+        """
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        if self._credit_tick is not None:
+            self._credit = min(
+                self._max_credit,
+                self._credit + time.ticks_diff(now, self._credit_tick),  # ty: ignore[unresolved-attribute]
+            )
+        self._credit_tick = now
+        while self._credit >= self._drain_cost:
+            record = self._read()
+            if record is None:
+                return True
+            if not publish(*record[:2]):
+                return False
+            self._advance(record[2])
+            self._credit -= self._drain_cost
+            self.drained += 1
+        return not len(self)
+
+    def wait(self):
+        """Return ms until the next record can be drained, None if empty."""
+        if not len(self):
+            return None
+        return max(0, self._drain_cost - self._credit)
+
+    def _read(self):
+        """Return device id, data and size of the oldest record."""
+        while self._segments:
+            if self._offset < self._sizes[0]:
+                with open(self._segment_path(self._segments[0]), "rb") as f:
+                    f.seek(self._offset)
+                    header = f.read(_RECORD_HEADER_SIZE)
+                    if len(header) == _RECORD_HEADER_SIZE:
+                        id_size, data_size = struct.unpack(_RECORD_HEADER, header)
+                        device_id = f.read(id_size)
+                        data = f.read(data_size)
+                        if len(data) == data_size:
+                            return (
+                                device_id.decode(),
+                                data,
+                                _RECORD_HEADER_SIZE + id_size + data_size,
+                            )
+            # Fully drained or truncated by a restart while writing.
+            self._drop_segment()
+        if self._buffer_end > self._buffer_start:
+            id_size, data_size = struct.unpack_from(
+                _RECORD_HEADER, self._buffer, self._buffer_start
+            )
+            i = self._buffer_start + _RECORD_HEADER_SIZE
+            device_id = bytes(self._buffer[i : i + id_size]).decode()
+            i += id_size
+            return (
+                device_id,
+                bytes(self._buffer[i : i + data_size]),
+                _RECORD_HEADER_SIZE + id_size + data_size,
+            )
+        return None
+
+    def _advance(self, size):
+        if self._segments and self._offset < self._sizes[0]:
+            self._offset += size
+        else:
+            self._buffer_start += size
+            if self._buffer_start == self._buffer_end:
+                self._buffer_start = self._buffer_end = 0
+                self._buffer_tick = None
@@ -0,0 +1,64 @@
+import gc
+import time
+
+from micropython import const
+
+# Free memory is sampled every few iterations as it scans the heap.
+_MEM_SAMPLE_ITERATIONS = const(16)
+
+
+class Telemetry:
+    """Hub counters, published every interval seconds along with
+    ESP-Now and MQTT ones.
+    Max loop latency is the longest time spent handling events,
+    since the previous publish.
+    """
+
+    def __init__(self, interval=60):
+        self._interval = interval * 1000
+        self._start = time.time()
+        self._next_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        self._loop_tick = None
+        self.iterations = 0
+        self.max_latency = 0
+        self.mem_free_low = gc.mem_free()  # ty: ignore[unresolved-attribute]
+
+    def loop_start(self):
+        self._loop_tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+
+    def loop_end(self):
+        self.iterations += 1
+        latency = time.ticks_diff(time.ticks_ms(), self._loop_tick)  # ty: ignore[unresolved-attribute]
+        if latency > self.max_latency:
+            self.max_latency = latency
+        if not self.iterations % _MEM_SAMPLE_ITERATIONS:
+            self._sample_memory()
+
+    def _sample_memory(self):
+        mem_free = gc.mem_free()  # ty: ignore[unresolved-attribute]
+        if mem_free < self.mem_free_low:
+            self.mem_free_low = mem_free
+
+    def timeout(self):
+        """Return ms until the next publish."""
+        return max(0, time.ticks_diff(self._next_tick, time.ticks_ms()))  # ty: ignore[unresolved-attribute]
+
+    def due(self):
+        return time.ticks_diff(time.ticks_ms(), self._next_tick) >= 0  # ty: ignore[unresolved-attribute]
+
+    def collect(self, *sources):
+        """Return counters of the hub and sources (having a telemetry method),
+        schedule the next publish.
+        """
+        self._sample_memory()
+        data = {
+            "loop_iterations": self.iterations,
+            "max_loop_latency": self.max_latency,
+            "mem_free_low": self.mem_free_low,
+            "uptime": time.time() - self._start,
+        }
+        for source in sources:
+            data.update(source.telemetry())
+        self.max_latency = 0
+        self._next_tick = time.ticks_add(time.ticks_ms(), self._interval)  # ty: ignore[unresolved-attribute]
+        return data
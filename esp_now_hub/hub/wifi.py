@@ -1,7 +1,9 @@
 import time
 
-import machine
+import esp32
 import network
+from backoff import Backoff  # ty: ignore[unresolved-import]
+from micropython import const
 
 STATUSES = {
     network.STAT_IDLE: "idle",
@@ -11,44 +13,211 @@ STATUSES = {
     network.STAT_CONNECT_FAIL: "connect failed",
     network.STAT_GOT_IP: "got ip",
 }
+_CONNECTED = const(0)
+_CONNECTING = const(1)
+_WAITING = const(2)
+# Connection attempts fail after this many ms.
+_CONNECT_TIMEOUT = const(10000)
+# Check intervals in ms.
+_CONNECTING_INTERVAL = const(100)
+_CONNECTED_INTERVAL = const(5000)
+_NVS_NAMESPACE = const("wifi")
+_NVS_KEY = const("ap")
+# Failed fast joins before the access point is found by connect.
+_FAST_JOIN_ATTEMPTS = const(3)
 
 
 class WLan:
-    def __init__(self, ssid, password, ifconfig):
+    """Station connection, kept up by calling check from the main loop,
+    retrying with backoff without blocking.
+    The access point BSSID and channel are stored in NVS for a fast join
+    on restart. Connect finds the access point when they are unknown
+    or repeated fast joins failed, its BSSID is then found by a full scan.
+    """
+
+    def __init__(self, ssid, password, ifconfig=None, backoff=None):
         self._ssid = ssid
         self._password = password
         self._ifconfig = ifconfig
         self._wlan = network.WLAN(network.STA_IF)
+        self._nvs = esp32.NVS(_NVS_NAMESPACE)
+        # BSSID, channel to join, None to let connect find the access point.
+        self._ap = self._stored = self._load()
+        self._fast_join_failures = 0
+        self._backoff = Backoff(**(backoff or {}))
+        self._state = _WAITING
+        # Ticks of the attempt start when connecting, of the next one when waiting.
+        self._tick = None
+        self._disconnect_tick = None
+        self.reconnects = 0
+        self.reconnect_attempts = 0
+        # Time spent disconnected in ms.
+        self.reconnect_time = 0
+        # Duration of the last successful attempt in ms.
+        self.connect_time = 0
+        # Unexpected errors recovered from.
+        self.resets = 0
 
     def __enter__(self):
-        while True:
-            self._disconnect()
-            self._wlan.active(True)
-            self._wlan.config(pm=self._wlan.PM_NONE)
-            if self._ifconfig:
-                self._wlan.ifconfig(self._ifconfig)
-            self._wlan.connect(self._ssid, self._password)
-            i = 0
-            while i < 100 and self._wlan.status() in {
-                network.STAT_CONNECTING,
-                network.STAT_IDLE,
-            }:
-                time.sleep(0.1)
-                i += 1
-            if self._wlan.status() == network.STAT_GOT_IP and self._wlan.isconnected():
-                print("connected to wifi")
-                return self
-            self._disconnect()
-            print(
-                f"could not connect to wifi! status: {STATUSES.get(self._wlan.status())}, wait for 10s"
-            )
-            self._disconnect()
-            machine.lightsleep(10000)
+        self._wlan.active(True)
+        self._wlan.config(pm=self._wlan.PM_NONE)
+        if self._ifconfig:
+            self._wlan.ifconfig(self._ifconfig)
+        if self._ap is None:
+            self._ap = self._scan()
+        self._connect()
+        # Wait for the first attempt, nothing else runs yet.
+        while self._state == _CONNECTING:
+            wait = self.check()
+            if self._state == _CONNECTING:
+                time.sleep_ms(wait)  # ty: ignore[unresolved-attribute]
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._disconnect()
-
-    def _disconnect(self):
         if self._wlan.isconnected():
             self._wlan.disconnect()
         self._wlan.active(False)
+
+    def isconnected(self):
+        return self._state == _CONNECTED
+
+    def check(self):
+        """Advance the connection, return ms until the next check."""
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        if self._state == _CONNECTED:
+            if self._wlan.isconnected():
+                return _CONNECTED_INTERVAL
+            print("disconnected from wifi")
+            self.reconnects += 1
+            self._disconnect_tick = now
+            self._connect()
+            return _CONNECTING_INTERVAL
+        if self._state == _WAITING:
+            wait = time.ticks_diff(self._tick, now)  # ty: ignore[unresolved-attribute]
+            if wait > 0:
+                return wait
+            self._connect()
+            return _CONNECTING_INTERVAL
+        status = self._wlan.status()
+        if status == network.STAT_GOT_IP and self._wlan.isconnected():
+            print("connected to wifi")
+            self._state = _CONNECTED
+            self._backoff.reset()
+            self.connect_time = time.ticks_diff(now, self._tick)  # ty: ignore[unresolved-attribute]
+            self._joined()
+            if self._disconnect_tick is not None:
+                self.reconnect_time += time.ticks_diff(now, self._disconnect_tick)  # ty: ignore[unresolved-attribute]
+                self._disconnect_tick = None
+            return _CONNECTED_INTERVAL
+        if (
+            status in {network.STAT_CONNECTING, network.STAT_IDLE}
+            and time.ticks_diff(now, self._tick) < _CONNECT_TIMEOUT  # ty: ignore[unresolved-attribute]
+        ):
+            return _CONNECTING_INTERVAL
+        self._fail(now, STATUSES.get(status))
+        return time.ticks_diff(self._tick, now)  # ty: ignore[unresolved-attribute]
+
+    def reset(self, exc):
+        """Recover from an unexpected error, without stopping other layers:
+        reconnect after a backoff.
+        """
+        self.resets += 1
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        if self._state == _CONNECTED:
+            self.reconnects += 1
+            self._disconnect_tick = now
+        self._fail(now, repr(exc))
+
+    def _connect(self):
+        self.reconnect_attempts += 1
+        self._state = _CONNECTING
+        self._tick = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        try:
+            if self._ap is None:
+                self._wlan.connect(self._ssid, self._password)
+            else:
+                bssid, channel = self._ap
+                self._wlan.config(channel=channel)
+                self._wlan.connect(self._ssid, self._password, bssid=bssid)
+        except OSError as exc:
+            self._fail(self._tick, exc)
+
+    def _joined(self):
+        """Store the access point joined for the next fast join, with the channel
+        of the interface. After a fast join the known BSSID is kept without
+        scanning. If connect found the access point, its BSSID is not known:
+        it is the strongest one on the channel in a full scan.
+        """
+        self._fast_join_failures = 0
+        channel = self._wlan.config("channel")
+        if self._ap is None:
+            ap = self._scan(channel)
+            if ap is None:
+                return
+            self._ap = ap
+        else:
+            self._ap = (self._ap[0], channel)
+        if self._ap != self._stored:
+            self._save()
+
+    def _fail(self, now, reason):
+        # The interface stays active for ESP-Now.
+        if self._wlan.isconnected():
+            self._wlan.disconnect()
+        if self._state == _CONNECTING and self._ap is not None:
+            self._fast_join_failures += 1
+        if self._fast_join_failures >= _FAST_JOIN_ATTEMPTS:
+            # The access point may have changed, found by connect from now on.
+            self._fast_join_failures = 0
+            self._ap = None
+            if self._stored is not None:
+                self._stored = None
+                try:
+                    self._nvs.erase_key(_NVS_KEY)
+                    self._nvs.commit()
+                except OSError:
+                    pass
+        delay = self._backoff.next()
+        print(f"could not connect to wifi! status: {reason}, retry in {delay}ms")
+        self._state = _WAITING
+        self._tick = time.ticks_add(now, delay)  # ty: ignore[unresolved-attribute]
+
+    def _scan(self, channel=None):
+        """Return BSSID, channel of the strongest access point of the network,
+        on channel if given, None if not found. All channels are scanned.
+        """
+        best = None
+        try:
+            networks = self._wlan.scan()
+        except OSError:
+            return None
+        ssid = self._ssid.encode()
+        for network_ssid, bssid, ap_channel, rssi, *_ in networks:
+            if network_ssid != ssid or channel not in (None, ap_channel):
+                continue
+            if best is None or rssi > best[2]:
+                best = (bssid, ap_channel, rssi)
+        return None if best is None else best[:2]
+
+    def _load(self):
+        buf = bytearray(7)
+        try:
+            self._nvs.get_blob(_NVS_KEY, buf)
+        except OSError:
+            return None
+        return bytes(buf[:6]), buf[6]
+
+    def _save(self):
+        bssid, channel = self._ap
+        self._nvs.set_blob(_NVS_KEY, bssid + bytes((channel,)))
+        self._nvs.commit()
+        self._stored = self._ap
+
+    def telemetry(self):
+        return {
+            "wifi_reconnects": self.reconnects,
+            "wifi_reconnect_attempts": self.reconnect_attempts,
+            "wifi_reconnect_time": self.reconnect_time,
+            "wifi_connect_time": self.connect_time,
+            "wifi_resets": self.resets,
+        }
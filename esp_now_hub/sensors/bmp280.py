@@ -1,7 +1,7 @@
 import struct
 import time
 
-import esp32
+import calibration  # ty: ignore[unresolved-import]
 import machine
 from micropython import const
 
@@ -34,7 +34,6 @@ _CONV_TIMES = [
 ]
 _CALIB_REG = const(0x88)  # 24 bytes.
 _CALIB_STRUCT = const("<H2hH8h")  # dig_T1 -> dig_T3, dig_P1 -> dig_P9
-_CALIB_CACHE = const("calibration")
 
 
 class BMP280:
@@ -50,35 +49,29 @@ class BMP280:
         address=0x77,
         mode="ultra-low-power",
         initialize=True,
+        fixed_point=False,
     ):
         self._i2c = machine.SoftI2C(scl=machine.Pin(scl), sda=machine.Pin(sda))
         self._address = address
         self._mode_idx = _MODES.index(mode)
         if initialize:
             self._i2c.writeto_mem(self._address, _CONFIG_REG, _CONFIG_VAL)
-        self._calibration_coefficients = self._get_calibration_coefficients(
-            calibration_cache_namespace
+        # Integer compensation, without float allocations.
+        self._compute = _compute_fixed if fixed_point else _compute
+        self._constants = calibration.load(
+            calibration_cache_namespace,
+            _CALIB_STRUCT,
+            self._read_calibration_coefficients,
+            _derive_fixed if fixed_point else _derive,
         )
 
-    def _get_calibration_coefficients(self, namespace):
-        nvs = esp32.NVS(namespace)
-        try:
-            buf = bytearray(100)
-            nvs.get_blob(_CALIB_CACHE, buf)
-            return tuple(
-                map(int, buf.replace(b"\x00", b"").decode("utf-8").strip().split(","))
-            )
-        except OSError:
-            pass
+    def _read_calibration_coefficients(self):
         data = self._i2c.readfrom_mem(
             self._address,
             _CALIB_REG,
             struct.calcsize(_CALIB_STRUCT),
         )
-        coefficients = struct.unpack(_CALIB_STRUCT, data)
-        nvs.set_blob(_CALIB_CACHE, ",".join(map(str, coefficients)).encode("utf-8"))
-        nvs.commit()
-        return coefficients
+        return struct.unpack(_CALIB_STRUCT, data)
 
     def get_measure(self):
         """Return pressure (bar), temperature (Celsius)."""
@@ -95,13 +88,11 @@ class BMP280:
         t = (data[3] << 16 | data[4] << 8 | data[5]) >> 4
         if not p or not t:
             raise ValueError("could not fetch value from sensor")
-        pres, temp = _compute(t, p, *self._calibration_coefficients)
+        pres, temp = self._compute(t, p, *self._constants)
         return {"pressure": pres, "temperature": temp}
 
 
-def _compute(
-    adc_t,
-    adc_p,
+def _derive(
     dig_t1,
     dig_t2,
     dig_t3,
@@ -114,26 +105,197 @@ def _compute(
     dig_p7,
     dig_p8,
     dig_p9,
+):
+    """Constants of _compute. Only scaled by powers of 2, so results are unchanged."""
+    return (
+        dig_t1 / 1024.0,
+        dig_t2,
+        dig_t1 / 8192.0,
+        dig_t3,
+        dig_p1,
+        dig_p2,
+        dig_p3 / 524288,
+        dig_p4 * 65536.0,
+        dig_p5 * 2,
+        dig_p6 / 32768.0,
+        dig_p7,
+        dig_p8 / 32768,
+        dig_p9 / 2147483648,
+    )
+
+
+def _compute(
+    adc_t,
+    adc_p,
+    t1_1024,
+    dig_t2,
+    t1_8192,
+    dig_t3,
+    dig_p1,
+    dig_p2,
+    p3_524288,
+    p4_65536,
+    p5_2,
+    p6_32768,
+    dig_p7,
+    p8_32768,
+    p9_2147483648,
 ):
     # Temperature.
-    var1 = (adc_t / 16384.0 - dig_t1 / 1024.0) * dig_t2
-    var2 = (adc_t / 131072.0 - dig_t1 / 8192.0) ** 2 * dig_t3
+    var1 = (adc_t / 16384.0 - t1_1024) * dig_t2
+    var2 = (adc_t / 131072.0 - t1_8192) ** 2 * dig_t3
     t_fine = var1 + var2
     t = t_fine / 5120
     # Pressure.
     var1 = t_fine / 2 - 64000
-    var2 = var1**2 * dig_p6 / 32768.0
-    var2 = var2 + var1 * dig_p5 * 2
-    var2 = var2 / 4 + dig_p4 * 65536.0
-    var1 = (dig_p3 * var1**2 / 524288 + dig_p2 * var1) / 524288
+    var2 = var1**2 * p6_32768
+    var2 = var2 + var1 * p5_2
+    var2 = var2 / 4 + p4_65536
+    var1 = (p3_524288 * var1**2 + dig_p2 * var1) / 524288
     var1 = (1.0 + var1 / 32768) * dig_p1
     p = (1048576.0 - adc_p - var2 / 4096) * 6250 / var1
-    var1 = dig_p9 * p**2 / 2147483648
-    var2 = p * dig_p8 / 32768
+    var1 = p9_2147483648 * p**2
+    var2 = p * p8_32768
     p = p + (var1 + var2 + dig_p7) / 16
     return round(p / 100000, 4), round(t, 1)
 
 
+def _derive_fixed(
+    dig_t1,
+    dig_t2,
+    dig_t3,
+    dig_p1,
+    dig_p2,
+    dig_p3,
+    dig_p4,
+    dig_p5,
+    dig_p6,
+    dig_p7,
+    dig_p8,
+    dig_p9,
+):
+    """Constants of _compute_fixed."""
+    return (
+        dig_t1,
+        dig_t1 << 1,
+        dig_t2,
+        dig_t3,
+        dig_p1,
+        dig_p2,
+        dig_p3,
+        dig_p4 << 7,
+        dig_p5,
+        dig_p6,
+        dig_p7 << 4,
+        dig_p8,
+        dig_p9,
+    )
+
+
+def _compute_fixed(
+    adc_t,
+    adc_p,
+    dig_t1,
+    t1_2,
+    dig_t2,
+    dig_t3,
+    dig_p1,
+    dig_p2,
+    dig_p3,
+    p4_128,
+    dig_p5,
+    dig_p6,
+    p7_16,
+    dig_p8,
+    dig_p9,
+):
+    """Datasheet 64 bits integer compensation. 64 bits values are held in 14 bits
+    digits, so that intermediates stay MicroPython small ints (31 bits) over the
+    operating range.
+    """
+    # Temperature, t_fine in 1/5120 Celsius.
+    var1 = (((adc_t >> 3) - t1_2) * dig_t2) >> 11
+    var2 = (adc_t >> 4) - dig_t1
+    var2 = (((var2 * var2) >> 12) * dig_t3) >> 14
+    t_fine = var1 + var2
+    # Pressure, in 1/256 Pa.
+    var1 = t_fine - 128000
+    high = var1 >> 14
+    low = var1 & 0x3FFF
+    # var1 * var1.
+    s0 = low * low
+    s1 = (high * low << 1) + (s0 >> 14)
+    s0 &= 0x3FFF
+    s2 = high * high + (s1 >> 14)
+    s1 &= 0x3FFF
+    # ((var1 * var1 * dig_p3) >> 8) + ((var1 * dig_p2) << 12), shifted left 8.
+    product = low * dig_p2
+    x0 = s0 * dig_p3
+    x1 = s1 * dig_p3 + ((product & 0xFF) << 6) + (x0 >> 14)
+    x0 &= 0x3FFF
+    x2 = s2 * dig_p3 + (product >> 8) + (high * dig_p2 << 6) + (x1 >> 14)
+    x1 &= 0x3FFF
+    x0 = (x0 >> 8) | ((x1 & 0xFF) << 6)
+    x1 = (x1 >> 8) | ((x2 & 0xFF) << 6)
+    x2 >>= 8
+    # (((1 << 47) + x) * dig_p1) >> 33.
+    x1 = (x1 * dig_p1 + (x0 * dig_p1 >> 14)) >> 14
+    divisor = (dig_p1 << 14) + (x2 >> 5) * dig_p1 + (((x2 & 0x1F) * dig_p1 + x1) >> 5)
+    # ((1048576 - adc_p) << 31) - var1 * var1 * dig_p6 - ((var1 * dig_p5) << 17)
+    # - (dig_p4 << 35), times 3125.
+    product = low * dig_p5
+    a0 = -s0 * dig_p6
+    a1 = -s1 * dig_p6 - ((product & 0x7FF) << 3) + (a0 >> 14)
+    a0 &= 0x3FFF
+    a2 = ((1048576 - adc_p) << 3) - s2 * dig_p6 - (product >> 11)
+    a2 += (a1 >> 14) - (high * dig_p5 << 3) - p4_128
+    a1 &= 0x3FFF
+    n0 = a0 * 3125
+    n1 = a1 * 3125 + (n0 >> 14)
+    n0 &= 0x3FFF
+    n2 = (a2 & 0x3FFF) * 3125 + (n1 >> 14)
+    n1 &= 0x3FFF
+    n3 = (a2 >> 14) * 3125 + (n2 >> 14)
+    n2 &= 0x3FFF
+    # Long division by digits, quotient digit estimated from the divisor high part.
+    divisor_high = divisor >> 14
+    divisor_low = divisor & 0x3FFF
+    q2 = n3 // divisor
+    r = n3 - q2 * divisor
+    q1 = r // divisor_high
+    r = ((r - q1 * divisor_high) << 14) + n2 - q1 * divisor_low
+    while r < 0:
+        q1 -= 1
+        r += divisor
+    q2 = (q2 << 14) + q1
+    q1 = r // divisor_high
+    r = ((r - q1 * divisor_high) << 14) + n1 - q1 * divisor_low
+    while r < 0:
+        q1 -= 1
+        r += divisor
+    q0 = r // divisor_high
+    r = ((r - q0 * divisor_high) << 14) + n0 - q0 * divisor_low
+    while r < 0:
+        q0 -= 1
+        r += divisor
+    # (dig_p9 * (p >> 13) * (p >> 13)) >> 25.
+    var1 = (q2 << 15) + (q1 << 1) + (q0 >> 13)
+    high = var1 >> 14
+    low = var1 & 0x3FFF
+    s0 = low * low
+    s1 = (high * low << 1) + (s0 >> 14)
+    s0 &= 0x3FFF
+    s2 = high * high + (s1 >> 14)
+    s1 &= 0x3FFF
+    var1 = (dig_p9 * s2 << 3) + ((dig_p9 * s1 + (dig_p9 * s0 >> 14)) >> 11)
+    # (dig_p8 * p) >> 19.
+    var2 = (dig_p8 * q2 << 9) + ((dig_p8 * q1 + (dig_p8 * q0 >> 14)) >> 5)
+    # ((p + var1 + var2) >> 8) + (dig_p7 << 4).
+    p = (q2 << 20) + (q1 << 6) + ((q0 + var1 + var2) >> 8) + p7_16
+    # Rounded to 1 / 10000 bar and 1 / 10 Celsius.
+    return ((p + 1280) // 2560) / 10000, ((t_fine + 256) >> 9) / 10
+
+
 def setup(sensor_id, initialize, **kwargs):
     return BMP280(
         calibration_cache_namespace=sensor_id,
@@ -0,0 +1,39 @@
+import binascii
+import struct
+
+import esp32
+from micropython import const
+
+_NVS_KEY = const("calibration")
+_CRC = const("<I")
+_CRC_SIZE = const(4)
+
+
+def load(namespace, fmt, read, derive):
+    """Return derive(*coefficients), coefficients packed as fmt with a CRC
+    in NVS namespace, or from read() if not stored or corrupted.
+    Derived constants are computed once here rather than on every measure.
+    """
+    nvs = esp32.NVS(namespace)
+    size = struct.calcsize(fmt)
+    buf = bytearray(size + _CRC_SIZE)
+    coefficients = None
+    try:
+        if nvs.get_blob(_NVS_KEY, buf) == len(buf):
+            coefficients = _unpack(fmt, buf, size)
+    except OSError:
+        # Not stored, or previous text format larger than buf.
+        pass
+    if coefficients is None:
+        coefficients = tuple(read())
+        struct.pack_into(fmt, buf, 0, *coefficients)
+        struct.pack_into(_CRC, buf, size, binascii.crc32(buf[:size]))
+        nvs.set_blob(_NVS_KEY, buf)
+        nvs.commit()
+    return derive(*coefficients)
+
+
+def _unpack(fmt, buf, size):
+    if struct.unpack_from(_CRC, buf, size)[0] != binascii.crc32(buf[:size]):
+        return None
+    return struct.unpack_from(fmt, buf)
@@ -0,0 +1,64 @@
+import esp32
+from micropython import const
+
+_NVS_NAMESPACE = const("wifi")
+_NVS_KEY = const("channel")
+_CHANNELS = range(1, 14)
+# Channels are probed on the first failed send, then every this many,
+# dividing 256 as the failure count wraps.
+_PROBE_FAILURES = const(8)
+
+
+class Channel:
+    """Wi-Fi channel the hub is reached on, cached in RTC memory across deepsleep
+    and in NVS across power loss, so a normal wake takes a single send.
+    Other channels are probed when the hub does not acknowledge a send,
+    eg. after its access point changed channel. While the hub is down,
+    they are only probed every few failed sends, counted in RTC memory.
+    """
+
+    def __init__(self, wlan, rtc_memory, default=None):
+        self._wlan = wlan
+        self._rtc_memory = rtc_memory
+        self._nvs = esp32.NVS(_NVS_NAMESPACE)
+        channel = rtc_memory.channel
+        if not channel:
+            try:
+                channel = self._nvs.get_i32(_NVS_KEY)
+            except OSError:
+                channel = default or _CHANNELS[0]
+            rtc_memory.channel = channel
+        self.channel = channel
+        wlan.config(channel=channel)
+
+    def send(self, e, peer, msg):
+        """Send msg, on other channels if not acknowledged on the current one,
+        see _PROBE_FAILURES. Return whether it was acknowledged.
+        """
+        rtc_memory = self._rtc_memory
+        if e.send(peer, msg):
+            if rtc_memory.failures:
+                rtc_memory.failures = 0
+            return True
+        failures = rtc_memory.failures
+        rtc_memory.failures = (failures + 1) & 0xFF
+        if failures % _PROBE_FAILURES:
+            return False
+        for channel in _CHANNELS:
+            if channel == self.channel:
+                continue
+            self._wlan.config(channel=channel)
+            if e.send(peer, msg):
+                print(f"hub found on channel {channel}")
+                self._save(channel)
+                return True
+        # The hub may be down rather than moved.
+        self._wlan.config(channel=self.channel)
+        return False
+
+    def _save(self, channel):
+        self.channel = channel
+        self._rtc_memory.channel = channel
+        self._rtc_memory.failures = 0
+        self._nvs.set_i32(_NVS_KEY, channel)
+        self._nvs.commit()
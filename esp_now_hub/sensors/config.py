@@ -21,12 +21,19 @@ class Config(TypedDict):
     deepsleep: NotRequired[bool]
     # Get a measure every interval.
     interval: float
-    # This should be the WI-FI channel of the access point the hub is connected to.
-    wifi_channel: int
+    # WI-FI channel of the access point the hub is connected to, tried first
+    # (default 1). Others are probed if the hub does not answer on it,
+    # the one it answered on is remembered.
+    wifi_channel: NotRequired[int]
     # Mac address of the hub, eg. 00:00:00:00:00:00
     hub_address: str
     primary_master_key: NotRequired[str]
     local_master_key: NotRequired[str]
+    # Listen this many ms for settings from the hub after each frame (default 50).
+    # Received interval and send_configs are stored and override these.
+    downlink_timeout: NotRequired[int]
+    # Send legacy JSON frames instead of compact binary ones.
+    json_frames: NotRequired[bool]
     sensors: Collection[Sensor]
 
 
@@ -5,23 +5,30 @@ import time
 import espnow
 import machine
 import network
+import settings  # ty: ignore[unresolved-import]
+import wire  # ty: ignore[unresolved-import]
+from channel import Channel  # ty: ignore[unresolved-import]
 from config import CONFIG  # ty: ignore[unresolved-import]
+from rtc_memory import RTCMemory  # ty: ignore[unresolved-import]
 from setup import setup_sensors  # ty: ignore[unresolved-import]
-from value_cache import (  # ty: ignore[unresolved-import]
-    process_sensor_data,
-    store_sensor_data,
-)
+from value_cache import ValueCache, size  # ty: ignore[unresolved-import]
 
 
 def run():
+    # Settings received from the hub override the deployed ones.
+    settings.load(CONFIG)
     data_getters, send_configs = setup_sensors(
         CONFIG,
         initialize=machine.reset_cause() == machine.PWRON_RESET,
     )
 
+    sensor_ids, layout_id = wire.layout(sensor["id"] for sensor in CONFIG["sensors"])
+    rtc_memory = RTCMemory(size(sensor_ids), layout_id)
+    value_cache = ValueCache(rtc_memory, sensor_ids, layout_id)
+
     wlan = network.WLAN(network.WLAN.IF_STA)
     wlan.active(True)
-    wlan.config(channel=CONFIG["wifi_channel"])
+    channel = Channel(wlan, rtc_memory, CONFIG.get("wifi_channel"))
     try:
         e = espnow.ESPNow()
         e.active(False)
@@ -36,16 +43,27 @@ def run():
             while True:
                 data = {}
                 for sensor_id, getter in data_getters.items():
-                    sensor_data = process_sensor_data(
+                    sensor_data = value_cache.process(
                         sensor_id, getter(), send_configs[sensor_id]
                     )
                     if sensor_data:
                         data[sensor_id] = sensor_data
-                if e.send(hub_address, json.dumps(data)):
+                if CONFIG.get("json_frames"):
+                    frame = json.dumps(data)
+                else:
+                    frame = wire.encode(
+                        data, sensor_ids, layout_id, rtc_memory.next_sequence()
+                    )
+                if channel.send(e, hub_address, frame):
                     for sensor_id, sensor_data in data.items():
-                        store_sensor_data(
+                        value_cache.store(
                             sensor_id, sensor_data, send_configs[sensor_id]
                         )
+                    value_cache.commit()
+                    # The hub replies with new settings, if any, while listening.
+                    host, msg = e.recv(CONFIG.get("downlink_timeout", 50))
+                    if host == hub_address and settings.receive(CONFIG, msg):
+                        print("settings updated")
                 if CONFIG.get("deepsleep"):
                     break
                 else:
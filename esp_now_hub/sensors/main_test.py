@@ -1,23 +1,27 @@
 import sys
 import time
 
+import wire  # ty: ignore[unresolved-import]
 from config import CONFIG  # ty: ignore[unresolved-import]
+from rtc_memory import RTCMemory  # ty: ignore[unresolved-import]
 from setup import setup_sensors  # ty: ignore[unresolved-import]
-from value_cache import (  # ty: ignore[unresolved-import]
-    process_sensor_data,
-    store_sensor_data,
-)
+from value_cache import ValueCache, size  # ty: ignore[unresolved-import]
 
 
 def run():
     data_getters, send_configs = setup_sensors(CONFIG, initialize=True)
+    sensor_ids, layout_id = wire.layout(sensor["id"] for sensor in CONFIG["sensors"])
+    value_cache = ValueCache(
+        RTCMemory(size(sensor_ids), layout_id), sensor_ids, layout_id
+    )
     while True:
         for sensor_id, getter in data_getters.items():
-            sensor_data = process_sensor_data(
+            sensor_data = value_cache.process(
                 sensor_id, getter(), send_configs[sensor_id]
             )
             print(sensor_id, sensor_data)
-            store_sensor_data(sensor_id, sensor_data, send_configs[sensor_id])
+            value_cache.store(sensor_id, sensor_data, send_configs[sensor_id])
+        value_cache.commit()
         time.sleep(CONFIG["interval"])
 
 
@@ -1,6 +1,6 @@
 import time
 
-import esp32
+import calibration  # ty: ignore[unresolved-import]
 import machine
 from micropython import const
 
@@ -18,7 +18,7 @@ _READ_WORD2_CMD = const(b"\x1d\x60")  # 111 010110 000 0
 _READ_WORD3_CMD = const(b"\x1d\x90")  # 111 011001 000 0
 _READ_WORD4_CMD = const(b"\x1d\xa0")  # 111 011010 000 0
 _RESET_CMD = const(b"\x15\x55\x40")  # 101010101010101000000
-_CALIB_CACHE = const("calibration")
+_CALIB_STRUCT = const("<6H")  # C1 -> C6
 
 
 class MS5540C:
@@ -39,8 +39,11 @@ class MS5540C:
             "duty_u16": 32768,
         }
         self._pwm = machine.PWM(machine.Pin(mclk), **self._pwm_params)  # ty: ignore[invalid-argument-type]
-        self._calibration_coefficients = self._get_calibration_coefficients(
-            calibration_cache_namespace
+        self._constants = calibration.load(
+            calibration_cache_namespace,
+            _CALIB_STRUCT,
+            self._read_calibration_coefficients,
+            _derive,
         )
 
     def deinit(self):
@@ -65,16 +68,7 @@ class MS5540C:
         time.sleep(_CONV_TIME)
         return self._read()
 
-    def _get_calibration_coefficients(self, namespace):
-        nvs = esp32.NVS(namespace)
-        try:
-            buf = bytearray(100)
-            nvs.get_blob(_CALIB_CACHE, buf)
-            return tuple(
-                map(int, buf.replace(b"\x00", b"").decode("utf-8").strip().split(","))
-            )
-        except OSError:
-            pass
+    def _read_calibration_coefficients(self):
         self._write(_RESET_CMD)
         coefficients = _get_coefficients(
             self._get_word(_READ_WORD1_CMD),
@@ -82,8 +76,6 @@ class MS5540C:
             self._get_word(_READ_WORD3_CMD),
             self._get_word(_READ_WORD4_CMD),
         )
-        nvs.set_blob(_CALIB_CACHE, ",".join(map(str, coefficients)).encode("utf-8"))
-        nvs.commit()
         self.deinit()
         return coefficients
 
@@ -95,7 +87,7 @@ class MS5540C:
         d2 = self._get_measure(_MEASURE_TEMP_CMD)
         if not d1 or not d2:
             raise ValueError("could not fetch value from sensor")
-        pres, temp = _compute(d1, d2, *self._calibration_coefficients)
+        pres, temp = _compute(d1, d2, *self._constants)
         self.deinit()
         return {"pressure": pres, "temperature": temp}
 
@@ -112,24 +104,37 @@ def _get_coefficients(w1, w2, w3, w4):
     )
 
 
-def _compute(d1, d2, c1, c2, c3, c4, c5, c6):
+def _derive(c1, c2, c3, c4, c5, c6):
+    """Constants of _compute."""
+    return (
+        c1,
+        c2 * 4,
+        c3,
+        c4 - 512,
+        8 * c5 + 20224,
+        c6 + 50,
+        11 * (c6 + 24),
+        3 * (c6 + 24),
+    )
+
+
+def _compute(d1, d2, c1, c2_4, c3, c4_512, ut1, c6_50, c6_24_11, c6_24_3):
     # Temperature.
-    ut1 = 8 * c5 + 20224
     dt = d2 - ut1
-    temp = 200 + dt * (c6 + 50) / 2**10
+    temp = 200 + dt * c6_50 / 2**10
     # Pressure.
-    off = c2 * 4 + ((c4 - 512) * dt) / 2**12
+    off = c2_4 + (c4_512 * dt) / 2**12
     sens = c1 + (c3 * dt) / 2**10 + 24576
     x = (sens * (d1 - 7168)) / 2**14 - off
     p = x * 10 / 2**5 + 250 * 10
     # Second order compensation.
     if temp < 200:
-        t2 = 11 * (c6 + 24) * (200 - temp) * (200 - temp) / 2**20
+        t2 = c6_24_11 * (200 - temp) * (200 - temp) / 2**20
         p2 = 3 * t2 * (p - 3500) / 2**14
         temp -= t2
         p -= p2
     elif temp > 450:
-        t2 = 3 * (c6 + 24) * (450 - temp) * (450 - temp) / 2**20
+        t2 = c6_24_3 * (450 - temp) * (450 - temp) / 2**20
         p2 = t2 * (p - 10000) / 2**13
         temp -= t2
         p -= p2
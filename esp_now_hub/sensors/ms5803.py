@@ -1,6 +1,6 @@
 import time
 
-import esp32
+import calibration  # ty: ignore[unresolved-import]
 import machine
 from micropython import const
 
@@ -12,7 +12,7 @@ _MEASURE_TEMP_CMD = const(0x50)
 _CONV_TIMES = [const(0.004), const(0.006), const(0.007), const(0.010), const(0.015)]
 _READ_MEASURE_CMD = const(b"\x00")
 _READ_CALIB_COEF_CMD = const(0xA2)
-_CALIB_CACHE = const("calibration")
+_CALIB_STRUCT = const("<6H")  # C1 -> C6
 
 
 class MS5803:
@@ -28,34 +28,28 @@ class MS5803:
         address=0x76,
         pressure_resolution=1024,
         temperature_resolution=256,
+        fixed_point=False,
     ):
         self._i2c = machine.SoftI2C(scl=machine.Pin(scl), sda=machine.Pin(sda))
         self._address = address
         self._p_res_idx = _OSRS.index(pressure_resolution)
         self._t_res_idx = _OSRS.index(temperature_resolution)
-        self._calibration_coefficients = self._get_calibration_coefficients(
-            calibration_cache_namespace
+        # Same results, without big int allocations.
+        self._compute = _compute_fixed if fixed_point else _compute
+        self._constants = calibration.load(
+            calibration_cache_namespace,
+            _CALIB_STRUCT,
+            self._read_calibration_coefficients,
+            _derive_fixed if fixed_point else _derive,
         )
 
-    def _get_calibration_coefficients(self, namespace):
-        nvs = esp32.NVS(namespace)
-        try:
-            buf = bytearray(100)
-            nvs.get_blob(_CALIB_CACHE, buf)
-            return tuple(
-                map(int, buf.replace(b"\x00", b"").decode("utf-8").strip().split(","))
-            )
-        except OSError:
-            pass
-        coefficients = tuple(
+    def _read_calibration_coefficients(self):
+        return tuple(
             self._get_calibration_coefficient(
                 (_READ_CALIB_COEF_CMD + 0x02 * i).to_bytes(1),
             )
             for i in range(6)
         )
-        nvs.set_blob(_CALIB_CACHE, ",".join(map(str, coefficients)).encode("utf-8"))
-        nvs.commit()
-        return coefficients
 
     def _get_calibration_coefficient(self, cmd):
         self._i2c.writeto(self._address, cmd)
@@ -79,17 +73,22 @@ class MS5803:
         )
         if not d1 or not d2:
             raise ValueError("could not fetch value from sensor")
-        pres, temp = _compute(d1, d2, *self._calibration_coefficients)
+        pres, temp = self._compute(d1, d2, *self._constants)
         return {"pressure": pres, "temperature": temp}
 
 
-def _compute(d1, d2, c1, c2, c3, c4, c5, c6):
+def _derive(c1, c2, c3, c4, c5, c6):
+    """Constants of _compute."""
+    return c1 * 2**15, c2 * 2**16, c3, c4, c5 * 2**8, c6
+
+
+def _compute(d1, d2, c1_15, c2_16, c3, c4, c5_8, c6):
     # Temperature.
-    dt = d2 - c5 * 2**8
+    dt = d2 - c5_8
     temp = 2000 + (dt * c6) // 2**23
     # Pressure.
-    off = c2 * 2**16 + (c4 * dt) // 2**7
-    sens = c1 * 2**15 + (c3 * dt) // 2**8
+    off = c2_16 + (c4 * dt) // 2**7
+    sens = c1_15 + (c3 * dt) // 2**8
     # Second order compensation.
     if temp < 2000:
         t2 = (3 * dt**2) // 2**33
@@ -109,5 +108,56 @@ def _compute(d1, d2, c1, c2, c3, c4, c5, c6):
     return round(p / 10000, 4), round(temp / 100, 1)
 
 
+def _derive_fixed(c1, c2, c3, c4, c5, c6):
+    """Constants of _compute_fixed."""
+    return c1, c2 << 1, c3, c4, c5 << 8, c6
+
+
+def _compute_fixed(d1, d2, c1, c2_2, c3, c4, c5_8, c6):
+    """_compute without products overflowing MicroPython small ints (31 bits)
+    over the operating range: 64 bits ones are summed from 12 bits halves,
+    low bits first.
+    """
+    # Temperature.
+    dt = d2 - c5_8
+    dt_high = dt >> 12
+    dt_low = dt & 0xFFF
+    temp = 2000 + ((dt_high * c6 + (dt_low * c6 >> 12)) >> 11)
+    # Second order compensation, (3 * dt**2) // 2**33 and (7 * dt**2) // 2**37.
+    t2 = dt_high * dt_high
+    t2_low = dt_high * dt_low << 1
+    if temp < 2000:
+        t2 = (3 * t2 + ((3 * t2_low + (3 * dt_low * dt_low >> 12)) >> 12)) >> 9
+        off2 = (3 * (temp - 2000) ** 2) // 2**1
+        sens2 = (5 * (temp - 2000) ** 2) // 2**3
+        if temp < -1500:
+            off2 += 7 * (temp + 1500) ** 2
+            sens2 += 4 * (temp + 1500) ** 2
+    else:
+        t2 = (7 * t2 + ((7 * t2_low + (7 * dt_low * dt_low >> 12)) >> 12)) >> 13
+        off2 = (temp - 2000) ** 2 // 2**4
+        sens2 = 0
+    temp -= t2
+    # Pressure.
+    # off = c2 * 2**16 + (c4 * dt) // 2**7 - off2
+    #     = (c2_2 + off_high) * 2**15 + off_low - off2
+    off_high = (c4 * dt_high + (c4 * dt_low >> 12)) >> 10
+    off_low = (((((c4 * dt_high) & 0x3FF) << 12) + c4 * dt_low) & 0x3FFFFF) >> 7
+    # sens = c1 * 2**15 + sens_low
+    sens_low = (c3 * dt_high << 4) + (c3 * dt_low >> 8) - sens2
+    sens_high = sens_low >> 12
+    sens_low &= 0xFFF
+    d1_high = d1 >> 12
+    d1_low = d1 & 0xFFF
+    # p = ((d1 * sens) // 2**21 - off) // 2**15 = (d1 * sens - off * 2**21) // 2**36
+    p = d1_high * sens_low + d1_low * sens_high + (d1_low * sens_low >> 12)
+    p = d1_low * c1 + (p >> 3)
+    p = off2 - off_low + (p >> 6)
+    p = d1_high * sens_high + (p >> 3)
+    p = d1_high * c1 + (p >> 3)
+    p = (p >> 9) - c2_2 - off_high
+    return round(p / 10000, 4), round(temp / 100, 1)
+
+
 def setup(sensor_id, initialize, **kwargs):
     return MS5803(calibration_cache_namespace=sensor_id, **kwargs).get_measure
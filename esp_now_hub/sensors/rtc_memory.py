@@ -0,0 +1,78 @@
+import random
+import struct
+
+import machine
+from micropython import const
+
+_MAGIC = const(0xE6)
+# Magic, sequence number, wifi channel (0 if unknown), failed sends,
+# values layout id.
+_FORMAT = const("<BHBBB")
+_HEADER_SIZE = const(6)
+
+
+class RTCMemory:
+    """Sensor state kept in RTC memory, survives deepsleep but not power loss.
+    Values (see value_cache) follow the header, valid if written
+    with the same layout.
+    """
+
+    def __init__(self, values_size=0, layout_id=0):
+        self._rtc = machine.RTC()
+        self._layout_id = layout_id
+        self._data = bytearray(_HEADER_SIZE + values_size)
+        self.values = memoryview(self._data)[_HEADER_SIZE:]
+        data = self._rtc.memory()
+        self.values_valid = False
+        if len(data) >= _HEADER_SIZE and data[0] == _MAGIC:
+            _, self._sequence, self._channel, self._failures, layout_id = (
+                struct.unpack_from(_FORMAT, data)
+            )
+            if len(data) == len(self._data) and layout_id == self._layout_id:
+                self._data[:] = data
+                self.values_valid = True
+        else:
+            # Start from a random sequence number after power loss,
+            # so the hub does not drop the next frames as already seen.
+            self._sequence = random.getrandbits(16)
+            self._channel = 0
+            self._failures = 0
+
+    def next_sequence(self):
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        self.save()
+        return self._sequence
+
+    @property
+    def channel(self):
+        """Wi-Fi channel the hub was last reached on, 0 if unknown."""
+        return self._channel
+
+    @channel.setter
+    def channel(self, channel):
+        self._channel = channel
+        self.save()
+
+    @property
+    def failures(self):
+        """Consecutive sends the hub did not acknowledge, wrapping at 256."""
+        return self._failures
+
+    @failures.setter
+    def failures(self, failures):
+        self._failures = failures
+        self.save()
+
+    def save(self):
+        """Write the header and values."""
+        struct.pack_into(
+            _FORMAT,
+            self._data,
+            0,
+            _MAGIC,
+            self._sequence,
+            self._channel,
+            self._failures,
+            self._layout_id,
+        )
+        self._rtc.memory(self._data)
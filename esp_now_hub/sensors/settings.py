@@ -0,0 +1,84 @@
+import json
+
+import esp32
+import wire  # ty: ignore[unresolved-import]
+from micropython import const
+
+_NVS_NAMESPACE = const("settings")
+_NVS_KEY = const("settings")
+# Stored settings merge all received ones.
+_MAX_SIZE = const(1024)
+
+
+def load(config):
+    """Apply settings received from the hub, stored in NVS, to config."""
+    settings = _get(esp32.NVS(_NVS_NAMESPACE))
+    if settings and _valid(config, settings):
+        _apply(config, settings)
+
+
+def receive(config, payload):
+    """Apply and store settings from a hub frame, return whether they were valid.
+    Invalid ones are ignored so a bad update can not stop the sensor.
+    """
+    settings = wire.decode_settings(payload)
+    if settings is None or not _valid(config, settings):
+        return False
+    nvs = esp32.NVS(_NVS_NAMESPACE)
+    stored = _get(nvs) or {}
+    wire.merge_settings(stored, settings)
+    data = json.dumps(stored).encode()
+    if len(data) > _MAX_SIZE:
+        return False
+    nvs.set_blob(_NVS_KEY, data)
+    nvs.commit()
+    _apply(config, settings)
+    return True
+
+
+def _apply(config, settings):
+    if "interval" in settings:
+        config["interval"] = settings["interval"]
+    for sensor_id, send_configs in settings.get("send_configs", {}).items():
+        for sensor in config["sensors"]:
+            if sensor["id"] == sensor_id:
+                wire.merge_settings(sensor.setdefault("send_configs", {}), send_configs)
+
+
+def _valid(config, settings):
+    """Check values, and that send configs are complete once merged."""
+    interval = settings.get("interval")
+    if interval is not None and (
+        not isinstance(interval, (int, float)) or interval <= 0
+    ):
+        return False
+    send_configs = settings.get("send_configs", {})
+    if not isinstance(send_configs, dict):
+        return False
+    current = {
+        sensor["id"]: sensor.get("send_configs") or {} for sensor in config["sensors"]
+    }
+    for sensor_id, components in send_configs.items():
+        if sensor_id not in current or not isinstance(components, dict):
+            return False
+        for component, send_config in components.items():
+            if not isinstance(send_config, dict):
+                return False
+            merged = dict(current[sensor_id].get(component) or {})
+            merged.update(send_config)
+            for key in ("diff", "time"):
+                if not isinstance(merged.get(key), (int, float)):
+                    return False
+    return True
+
+
+def _get(nvs):
+    buf = bytearray(_MAX_SIZE)
+    try:
+        size = nvs.get_blob(_NVS_KEY, buf)
+    except OSError:
+        return None
+    try:
+        return json.loads(bytes(buf[:size]))
+    except ValueError:
+        return None
@@ -1,51 +1,95 @@
+import math
+import struct
 import time
 
 import esp32
+import wire  # ty: ignore[unresolved-import]
+from micropython import const
 
+_NVS_NAMESPACE = const("values")
+# Last sent value, NaN if none, and its time in ticks.
+_ENTRY = const("<di")
+_ENTRY_SIZE = const(12)
+_NONE = float("nan")
+_COMPONENT_INDEXES = {component: i for i, component in enumerate(wire.COMPONENTS)}
 
-def process_sensor_data(sensor_id, data, send_configs):
-    if not send_configs:
-        return data
-    nvs = esp32.NVS(sensor_id)
-    data_to_send = {}
-    for prop, value in data.items():
-        send_config = send_configs.get(prop)
-        if not send_config:
-            data_to_send[prop] = value
-            continue
-        last_value, last_time = _get(nvs, prop)
-        if (
-            last_value is None
-            or last_time is None
-            or round(abs(value - last_value), 10) >= send_config["diff"]
-            or time.ticks_diff(time.ticks_ms(), last_time) >= send_config["time"] * 1000  # ty: ignore[unresolved-attribute]
-        ):
-            data_to_send[prop] = value
-
-    return data_to_send
-
-
-def store_sensor_data(sensor_id, data, send_configs):
-    if not send_configs:
-        return
-    nvs = esp32.NVS(sensor_id)
-    for prop, value in data.items():
-        send_config = send_configs.get(prop)
-        if not send_config:
-            continue
-        _set(nvs, prop, value)
-
-
-def _get(nvs, prop):
-    buf = bytearray(100)
-    try:
-        nvs.get_blob(prop, buf)
-    except OSError:
-        return None, None
-    val, tm = buf.replace(b"\x00", b"").decode("utf-8").split(",")
-    return float(val), int(tm)
-
-
-def _set(nvs, prop, value):
-    nvs.set_blob(prop, f"{value},{time.ticks_ms()}".encode())  # ty: ignore[unresolved-attribute]
-    nvs.commit()
+
+def size(sensor_ids):
+    """Size of the values of sensor_ids in RTC memory."""
+    return len(sensor_ids) * len(wire.COMPONENTS) * _ENTRY_SIZE
+
+
+class ValueCache:
+    """Last sent value and time per sensor component, packed in RTC memory
+    across deepsleep and in NVS across power loss. Stored values are committed
+    once per cycle.
+    """
+
+    def __init__(self, rtc_memory, sensor_ids, layout_id):
+        self._rtc_memory = rtc_memory
+        self._values = rtc_memory.values
+        self._indexes = {sensor_id: i for i, sensor_id in enumerate(sensor_ids)}
+        self._nvs = esp32.NVS(_NVS_NAMESPACE)
+        # Values of other layouts do not apply.
+        self._key = f"values_{layout_id:02x}"
+        self._stored = False
+        if not rtc_memory.values_valid:
+            self._load()
+
+    def process(self, sensor_id, data, send_configs):
+        """Return the data to send: changed by diff or not sent for time."""
+        if not send_configs:
+            return data
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        data_to_send = {}
+        for prop, value in data.items():
+            send_config = send_configs.get(prop)
+            offset = self._offset(sensor_id, prop)
+            if not send_config or offset is None:
+                data_to_send[prop] = value
+                continue
+            last_value, last_time = struct.unpack_from(_ENTRY, self._values, offset)
+            if (
+                math.isnan(last_value)
+                or round(abs(value - last_value), 10) >= send_config["diff"]
+                or time.ticks_diff(now, last_time) >= send_config["time"] * 1000  # ty: ignore[unresolved-attribute]
+            ):
+                data_to_send[prop] = value
+        return data_to_send
+
+    def store(self, sensor_id, data, send_configs):
+        """Remember sent data, see commit."""
+        if not send_configs:
+            return
+        now = time.ticks_ms()  # ty: ignore[unresolved-attribute]
+        for prop, value in data.items():
+            offset = self._offset(sensor_id, prop)
+            if send_configs.get(prop) and offset is not None:
+                struct.pack_into(_ENTRY, self._values, offset, value, now)
+                self._stored = True
+
+    def commit(self):
+        """Save stored values to RTC memory and NVS, with a single NVS commit."""
+        if not self._stored:
+            return
+        self._rtc_memory.save()
+        self._nvs.set_blob(self._key, self._values)
+        self._nvs.commit()
+        self._stored = False
+
+    def _offset(self, sensor_id, prop):
+        sensor_idx = self._indexes.get(sensor_id)
+        component_idx = _COMPONENT_INDEXES.get(prop)
+        if sensor_idx is None or component_idx is None:
+            return None
+        return (sensor_idx * len(wire.COMPONENTS) + component_idx) * _ENTRY_SIZE
+
+    def _load(self):
+        """Load values from NVS after power loss, none if not stored."""
+        try:
+            loaded = self._nvs.get_blob(self._key, self._values) == len(self._values)
+        except OSError:
+            loaded = False
+        if not loaded:
+            for offset in range(0, len(self._values), _ENTRY_SIZE):
+                struct.pack_into(_ENTRY, self._values, offset, _NONE, 0)
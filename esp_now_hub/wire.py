@@ -0,0 +1,104 @@
+# Sensor to hub frame format, shared by both sides.
+#
+# Binary frame: version byte, layout id, sequence number (uint16),
+# then 4 bytes per datum:
+# sensor index (5 bits) and component index (3 bits), value as fixed-point int24.
+# Sensor indexes are positions in the sorted sensor ids of the device,
+# the layout id is a checksum of these so the hub can reject mismatching frames.
+# The sequence number lets the hub drop retransmitted frames.
+# Legacy frames are JSON objects and start with "{".
+#
+# Hub to sensor settings frame, replying to a frame: version byte,
+# then a JSON object of settings overriding the sensor config.
+
+import binascii
+import json
+
+from micropython import const
+
+BINARY_V2 = const(0xB2)
+JSON = const(0x7B)  # "{"
+SETTINGS = const(0xC1)
+HEADER_SIZE = const(4)
+DATUM_SIZE = const(4)
+COMPONENTS = ("temperature", "humidity", "pressure")
+# Fixed-point scale per component, matching the precision sensors round to.
+SCALES = (10, 1, 10000)
+MAX_SENSORS = const(32)
+MAX_FRAME_SIZE = const(250)
+# Settings sensors accept: interval, sensor id -> component -> send config.
+SETTINGS_KEYS = ("interval", "send_configs")
+
+
+def layout(sensor_ids):
+    """Return sorted sensor ids and the layout id identifying them."""
+    sensor_ids = tuple(sorted(sensor_ids))
+    if len(sensor_ids) > MAX_SENSORS:
+        raise ValueError("too many sensors for binary frames")
+    return sensor_ids, binascii.crc32(",".join(sensor_ids).encode()) & 0xFF
+
+
+def encode(data, sensor_ids, layout_id, sequence):
+    """Pack {sensor_id: {component: value}} in a binary frame."""
+    size = HEADER_SIZE
+    for sensor_data in data.values():
+        size += DATUM_SIZE * len(sensor_data)
+    frame = bytearray(size)
+    frame[0] = BINARY_V2
+    frame[1] = layout_id
+    frame[2] = sequence & 0xFF
+    frame[3] = sequence >> 8 & 0xFF
+    i = HEADER_SIZE
+    for sensor_id, sensor_data in data.items():
+        sensor_idx = sensor_ids.index(sensor_id)
+        for component, value in sensor_data.items():
+            component_idx = COMPONENTS.index(component)
+            value = round(value * SCALES[component_idx])
+            frame[i] = sensor_idx << 3 | component_idx
+            frame[i + 1] = value & 0xFF
+            frame[i + 2] = value >> 8 & 0xFF
+            frame[i + 3] = value >> 16 & 0xFF
+            i += DATUM_SIZE
+    return frame
+
+
+def sequence(payload):
+    """Return the sequence number of a binary frame, None if it has none."""
+    if payload[0] != BINARY_V2 or len(payload) < HEADER_SIZE:
+        return None
+    return payload[2] | payload[3] << 8
+
+
+def read_value(payload, i, scale):
+    """Read a little-endian fixed-point int24 at i."""
+    value = payload[i] | payload[i + 1] << 8 | ((payload[i + 2] ^ 0x80) - 0x80) << 16
+    return value / scale if scale > 1 else value
+
+
+def encode_settings(settings):
+    """Pack settings in a frame, raise ValueError if too large."""
+    frame = bytes((SETTINGS,)) + json.dumps(settings).encode()
+    if len(frame) > MAX_FRAME_SIZE:
+        raise ValueError("settings too large for a frame")
+    return frame
+
+
+def decode_settings(payload):
+    """Return the settings of a frame, None if it is not a valid settings frame."""
+    if not payload or payload[0] != SETTINGS:
+        return None
+    try:
+        settings = json.loads(bytes(payload[1:]).decode("utf-8"))
+    except ValueError:
+        return None
+    return settings if isinstance(settings, dict) else None
+
+
+def merge_settings(target, settings):
+    """Merge settings into target, nested dicts key by key."""
+    for key, value in settings.items():
+        current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            merge_settings(current, value)
+        else:
+            target[key] = value
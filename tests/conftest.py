@@ -1,4 +1,10 @@
+# Import before mocking time.
+import asyncio  # noqa: F401
+import contextlib
+import gc
+import os
 import sys
+import time
 from unittest.mock import Mock
 
 import pytest
@@ -6,10 +12,15 @@ import pytest
 sys.modules["esp32"] = Mock()
 sys.modules["espnow"] = Mock()
 sys.modules["machine"] = Mock()
-sys.modules["micropython"] = Mock()
+sys.modules["micropython"] = Mock(const=lambda e: e)
+sys.modules["network"] = Mock()
 sys.modules["time"] = Mock()
 sys.modules["umqtt"] = Mock()
 sys.modules["umqtt.simple"] = Mock()
+# Modules are deployed flat on devices.
+_ROOT = os.path.join(os.path.dirname(__file__), "..", "esp_now_hub")
+for _path in ("", "hub", "sensors"):
+    sys.path.append(os.path.join(_ROOT, _path))
 
 
 @pytest.fixture
@@ -19,6 +30,35 @@ def nvs(mocker):
     return nvs_
 
 
+@pytest.fixture
+def stored(nvs):
+    """Values stored in NVS by key, i32 or blob."""
+    values = {}
+
+    def _get_i32(key):
+        if key not in values:
+            raise OSError
+        return values[key]
+
+    def _get_blob(key, buf):
+        if key not in values:
+            raise OSError
+        buf[: len(values[key])] = values[key]
+        return len(values[key])
+
+    def _erase_key(key):
+        if key not in values:
+            raise OSError
+        del values[key]
+
+    nvs.get_i32.side_effect = _get_i32
+    nvs.set_i32.side_effect = values.__setitem__
+    nvs.get_blob.side_effect = _get_blob
+    nvs.set_blob.side_effect = lambda key, data: values.__setitem__(key, bytes(data))
+    nvs.erase_key.side_effect = _erase_key
+    return values
+
+
 @pytest.fixture(autouse=True)
 def _const(mocker):
     mocker.patch.object(sys.modules["micropython"], "const", new=lambda e: e)
@@ -32,3 +72,61 @@ def ticks_ms(mocker):
 @pytest.fixture(autouse=True)
 def _ticks_diff(mocker):
     mocker.patch.object(sys.modules["time"], "ticks_diff", new=lambda a, b: a - b)
+
+
+@pytest.fixture(autouse=True)
+def mem_free(mocker):
+    """MicroPython only."""
+    return mocker.patch.object(gc, "mem_free", create=True, return_value=100000)
+
+
+@pytest.fixture(autouse=True)
+def _time(mocker):
+    mocker.patch.object(sys.modules["time"], "time", return_value=1000)
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        help="time benchmarks and report measures after tests",
+    )
+
+
+_MEASURES = []
+
+
+class Benchmark:
+    """Measures reported after tests with --benchmark, timings are not asserted."""
+
+    def __init__(self, enabled, test):
+        self.enabled = enabled
+        self._test = test
+
+    def iterations(self, count):
+        """Iterations of a timed block only run to measure it."""
+        return count if self.enabled else 1
+
+    @contextlib.contextmanager
+    def timed(self, label, count):
+        """Report count iterations of the block per second."""
+        # Real clock, time is mocked.
+        start = time.perf_counter()
+        yield
+        self.report(label, f"{count / (time.perf_counter() - start):.0f}/s")
+
+    def report(self, label, value):
+        if self.enabled:
+            _MEASURES.append(f"{self._test} {label}: {value}")
+
+
+@pytest.fixture
+def benchmark(request):
+    return Benchmark(request.config.getoption("--benchmark"), request.node.name)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if _MEASURES:
+        terminalreporter.section("benchmark")
+        for measure in _MEASURES:
+            terminalreporter.write_line(measure)
@@ -0,0 +1,83 @@
+from unittest.mock import call
+
+import pytest
+
+
+class FakeSocket:
+    """Stand-in MQTT socket recording written bytes."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.writes = 0
+        self.pings = 0
+        self.fail = False
+        # Bytes accepted until writes return None, unlimited if None.
+        self.room = None
+
+    def setblocking(self, blocking):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        if self.fail:
+            raise OSError("write failed")
+        self.writes += 1
+        if self.room is not None:
+            # Non-blocking write to a full socket.
+            data = data[: self.room]
+            self.room -= len(data)
+            if not data:
+                return None
+        self.data += data
+        return len(data)
+
+    def publishes(self):
+        """Return and forget written PUBLISH packets as publish calls,
+        count PINGREQ ones.
+        """
+        calls = []
+        i = 0
+        while i < len(self.data):
+            header = self.data[i]
+            i += 1
+            remaining = shift = 0
+            while True:
+                remaining |= (self.data[i] & 0x7F) << shift
+                shift += 7
+                i += 1
+                if not self.data[i - 1] & 0x80:
+                    break
+            end = i + remaining
+            if header == 0xC0:
+                self.pings += 1
+                continue
+            assert header & 0xF0 == 0x30
+            topic_size = self.data[i] << 8 | self.data[i + 1]
+            i += 2
+            topic = bytes(self.data[i : i + topic_size])
+            i += topic_size
+            if header & 0x06:
+                pid = self.data[i] << 8 | self.data[i + 1]
+                msg = bytes(self.data[i + 2 : end])
+                calls.append(
+                    call(
+                        topic,
+                        msg,
+                        retain=bool(header & 0x01),
+                        pid=pid,
+                        dup=bool(header & 0x08),
+                    )
+                )
+            else:
+                msg = bytes(self.data[i:end])
+                calls.append(call(topic, msg, retain=bool(header & 0x01)))
+            i = end
+        self.data = bytearray()
+        return calls
+
+
+@pytest.fixture
+def mqtt_socket():
+    return FakeSocket()
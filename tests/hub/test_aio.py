@@ -0,0 +1,126 @@
+import asyncio
+from unittest.mock import call
+
+import espnow
+import pytest
+import umqtt.simple
+
+from esp_now_hub.hub.aio import Queue, serve
+from esp_now_hub.hub.esp_now import ESPNow
+from esp_now_hub.hub.mqtt import MQTTClient
+from esp_now_hub.wire import encode, layout
+
+
+class FakeESPNow:
+    def __init__(self):
+        self.peers_table = {}
+        self._frames = []
+        self._irq = None
+
+    def active(self, _):
+        pass
+
+    def irq(self, callback):
+        self._irq = callback
+
+    def stats(self):
+        return 0, 0, 0, 0, 0
+
+    def irecv(self, _):
+        if self._frames:
+            return self._frames.pop(0)
+        return None, None
+
+    def inject(self, *frames):
+        self._frames.extend(frames)
+        self._irq(self)
+
+
+@pytest.fixture
+def esp_now(mocker):
+    e = FakeESPNow()
+    mocker.patch.object(espnow, "ESPNow", return_value=e)
+    return e
+
+
+@pytest.fixture
+def mqtt_client(mocker, mqtt_socket):
+    m = mocker.Mock()
+    m.keepalive = 10
+    m.sock = mqtt_socket
+    mocker.patch.object(umqtt.simple, "MQTTClient", return_value=m)
+    return m
+
+
+@pytest.fixture
+def poll(mocker):
+    p = mocker.Mock()
+    p.poll.return_value = []
+    return p
+
+
+@pytest.fixture
+def devices():
+    return (
+        {
+            "address": "00:00:00:00:00:01",
+            "keepalive": 5,
+            "name": "dev1",
+            "components": {"sensor1": {"temperature"}},
+        },
+    )
+
+
+def test_queue():
+    async def _run():
+        queue = Queue(2)
+        for i in range(3):
+            queue.put(i)
+        assert len(queue) == 2
+        assert queue.dropped == 1
+        assert await queue.get() == 1
+        assert await queue.get() == 2
+        get = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        assert not get.done()
+        queue.put(3)
+        assert await get == 3
+
+    asyncio.run(_run())
+
+
+def test_serve(esp_now, mqtt_client, mqtt_socket, poll, devices, ticks_ms):
+    ticks_ms.return_value = 1000
+    address = b"\x00\x00\x00\x00\x00\x01"
+    sensors = layout(["sensor1"])
+
+    async def _run():
+        with MQTTClient(poll, "topic", devices, 10, "host") as client:
+            with ESPNow(None, devices) as esp_now_client:
+                task = asyncio.create_task(serve(poll, client, esp_now_client, 2))
+                # Let tasks start.
+                await asyncio.sleep(0.001)
+                mqtt_socket.publishes()
+                # Frames keep being accepted while the publishing task waits.
+                esp_now.inject(
+                    (address, encode({"sensor1": {"temperature": 10.1}}, *sensors, 1)),
+                    (address, encode({"sensor1": {"temperature": 10.2}}, *sensors, 2)),
+                    (address, encode({"sensor1": {"temperature": 10.3}}, *sensors, 3)),
+                )
+                await asyncio.sleep(0.01)
+                task.cancel()
+                assert mqtt_socket.publishes() == [
+                    call(b"topic/status/000000000001", b"online", retain=True),
+                    call(
+                        b"topic/get/000000000001",
+                        b'{"sensor1_temperature": 10.2}',
+                        retain=False,
+                    ),
+                    call(
+                        b"topic/get/000000000001",
+                        b'{"sensor1_temperature": 10.3}',
+                        retain=False,
+                    ),
+                ]
+
+    asyncio.run(_run())
@@ -0,0 +1,18 @@
+import random
+
+from esp_now_hub.hub.backoff import Backoff
+
+
+def test_backoff(mocker):
+    mocker.patch.object(random, "randint", side_effect=lambda a, b: b)
+    backoff = Backoff(initial=1000, maximum=5000)
+    assert [backoff.next() for _ in range(5)] == [1000, 2000, 4000, 5000, 5000]
+    backoff.reset()
+    assert backoff.next() == 1000
+
+
+def test_backoff_jitter():
+    backoff = Backoff(initial=1000)
+    for _ in range(20):
+        backoff.reset()
+        assert 500 <= backoff.next() <= 1000
@@ -0,0 +1,49 @@
+from esp_now_hub.hub.deadlines import Deadlines
+
+
+def _pop_all(deadlines):
+    names = []
+    while True:
+        name = deadlines.pop()
+        if name is None:
+            return names
+        names.append(name)
+
+
+def test_deadlines(ticks_ms):
+    ticks_ms.return_value = 1000
+    deadlines = Deadlines()
+    assert deadlines.timeout(10000) == 10000
+    deadlines.set("a", 3000)
+    deadlines.set("b", 1000)
+    deadlines.set("c", 2000)
+    assert deadlines.timeout(10000) == 1000
+    assert deadlines.timeout(500) == 500
+    # Moved later, then earlier.
+    deadlines.set("b", 5000)
+    deadlines.set("c", 4000)
+    deadlines.set("c", 1500)
+    deadlines.cancel("a")
+    assert deadlines.timeout(10000) == 1500
+    assert len(deadlines) == 2
+    ticks_ms.return_value = 5000
+    assert _pop_all(deadlines) == ["c"]
+    assert "c" not in deadlines
+    assert deadlines.timeout(10000) == 1000
+    ticks_ms.return_value = 7000
+    assert deadlines.timeout(10000) == 0
+    assert _pop_all(deadlines) == ["b"]
+    assert not deadlines._heap
+
+
+def test_deadlines_rebase(ticks_ms):
+    ticks_ms.return_value = 1000
+    deadlines = Deadlines()
+    deadlines.set("a", 1 << 29)
+    deadlines.set("b", 1000)
+    ticks_ms.return_value = 1000 + (1 << 28)
+    assert _pop_all(deadlines) == ["b"]
+    assert deadlines._base == 1000 + (1 << 28)
+    assert deadlines.timeout(1 << 30) == 1 << 28
+    ticks_ms.return_value = 1000 + (1 << 29)
+    assert _pop_all(deadlines) == ["a"]
@@ -1,10 +1,13 @@
+import json
 import select
+import tracemalloc
 from unittest.mock import call
 
 import espnow
 import pytest
 
 from esp_now_hub.hub.esp_now import ESPNow
+from esp_now_hub.wire import decode_settings, encode, layout
 
 
 @pytest.fixture
@@ -48,28 +51,327 @@ def test_setup(poll, esp_now, client):
     assert esp_now.active.call_args == call(False)
 
 
+def test_driver_config(poll, esp_now, devices):
+    with ESPNow(poll, devices, rxbuf=2048):
+        esp_now.config.assert_called_once_with(rxbuf=2048)
+        assert esp_now.method_calls.index(
+            call.config(rxbuf=2048)
+        ) < esp_now.method_calls.index(call.active(True))
+
+
+def test_telemetry(esp_now, client):
+    esp_now.stats.return_value = (10, 9, 1, 100, 3)
+    with client:
+        assert client.telemetry() == {
+            "tx_packets": 10,
+            "tx_responses": 9,
+            "tx_failures": 1,
+            "rx_packets": 100,
+            "rx_dropped": 3,
+            "max_drained": 0,
+            "duplicates": 0,
+            "frames": 0,
+            "decode_failures": 0,
+            "unknown_devices": 0,
+            "downlinks": 0,
+            "downlink_failures": 0,
+            "esp_now_resets": 0,
+        }
+
+
 def test_receive(esp_now, client):
     address = b"\x00\x00\x00\x00\x00\x01"
-    esp_now.recv.return_value = (
-        address,
-        b'{"sensor1":{"pressure":1.002,"temperature":10.2}}',
-    )
+    esp_now.irecv.side_effect = [
+        (address, b'{"sensor1":{"pressure":1.002,"temperature":10.2}}'),
+        (None, None),
+    ]
     esp_now.peers_table = {address: [-90, 0]}
 
     with client:
-        assert client.receive(select.POLLIN) == (
-            "000000000001",
-            {"sensor1_pressure": 1.002, "_signal": -90},
+        assert list(client.receive(select.POLLIN)) == [
+            ("000000000001", {"sensor1_pressure": 1.002, "_signal": -90}),
+        ]
+        assert client.drained == 1
+
+
+def test_receive_uppercase_address(esp_now, poll, devices):
+    devices[0]["address"] = "AA:BB:CC:DD:EE:01"
+    address = b"\xaa\xbb\xcc\xdd\xee\x01"
+    esp_now.irecv.side_effect = [
+        (address, b'{"sensor1":{"pressure":1.002}}'),
+        (None, None),
+    ]
+    esp_now.peers_table = {address: [-70, 0]}
+    with ESPNow(poll, devices) as client:
+        assert list(client.receive(select.POLLIN)) == [
+            ("aabbccddee01", {"sensor1_pressure": 1.002}),
+        ]
+
+
+def test_receive_binary(esp_now, client):
+    address = b"\x00\x00\x00\x00\x00\x01"
+    esp_now.irecv.side_effect = [
+        (
+            address,
+            encode(
+                {"sensor1": {"pressure": 1.002, "temperature": 10.2}},
+                *layout(["sensor1"]),
+                1,
+            ),
+        ),
+        (None, None),
+    ]
+    esp_now.peers_table = {}
+
+    with client:
+        assert list(client.receive(select.POLLIN)) == [
+            ("000000000001", {"sensor1_pressure": 1.002}),
+        ]
+
+
+def test_receive_binary_unknown_index(esp_now, client):
+    address = b"\x00\x00\x00\x00\x00\x01"
+    frame = encode(
+        {"sensor1": {"pressure": 1.002}, "sensor2": {"pressure": 1.003}},
+        *layout(["sensor1", "sensor2"]),
+        1,
+    )
+    # Matching layout id, the second sensor index is out of the layout.
+    frame[1] = layout(["sensor1"])[1]
+    esp_now.irecv.side_effect = [(address, frame), (None, None)]
+    esp_now.peers_table = {}
+
+    with client:
+        assert list(client.receive(select.POLLIN)) == [
+            ("000000000001", {"sensor1_pressure": 1.002}),
+        ]
+
+
+def test_receive_binary_layout_mismatch(esp_now, client, capsys):
+    address = b"\x00\x00\x00\x00\x00\x01"
+    sensor_ids, layout_id = layout(["sensor1", "other"])
+    esp_now.irecv.side_effect = [
+        (address, encode({"sensor1": {"pressure": 1.002}}, sensor_ids, layout_id, 1)),
+        (address, encode({"sensor1": {"pressure": 1.002}}, sensor_ids, layout_id, 2)),
+        (None, None),
+    ]
+    esp_now.peers_table = {}
+
+    with client:
+        assert list(client.receive(select.POLLIN)) == []
+    assert client.decode_failures == 2
+    # Logged once.
+    expected = layout(["sensor1"])[1]
+    assert capsys.readouterr().out.splitlines() == [
+        f"device 000000000001: frame layout {layout_id:02x}, expected {expected:02x},"
+        " list all its sensor ids in sensors"
+    ]
+
+
+def test_receive_duplicates(esp_now, poll, devices):
+    address = b"\x00\x00\x00\x00\x00\x02"
+
+    def _frame(sequence, value):
+        return (
+            address,
+            encode({"sensor2": {"temperature": value}}, *layout(["sensor2"]), sequence),
         )
 
+    esp_now.irecv.side_effect = [
+        _frame(1, 10.1),
+        _frame(1, 10.1),
+        _frame(2, 10.2),
+        _frame(3, 10.3),
+        _frame(1, 10.4),
+        (None, None),
+    ]
+    esp_now.peers_table = {}
+
+    with ESPNow(poll, devices, dedup_window=2) as client:
+        assert list(client.receive(select.POLLIN)) == [
+            ("000000000002", {"sensor2_temperature": 10.1}),
+            ("000000000002", {"sensor2_temperature": 10.2}),
+            ("000000000002", {"sensor2_temperature": 10.3}),
+            # Out of the window.
+            ("000000000002", {"sensor2_temperature": 10.4}),
+        ]
+        assert client.duplicates == 1
+
 
 def test_receive_empty(esp_now, client):
     address = b"\x00\x00\x00\x00\x00\x02"
-    esp_now.recv.return_value = (
-        address,
-        b'{"sensor2":{"pressure":1.002}}',
-    )
+    esp_now.irecv.side_effect = [
+        (address, b'{"sensor2":{"pressure":1.002}}'),
+        (None, None),
+    ]
     esp_now.peers_table = {address: [-90, 0]}
 
     with client:
-        assert client.receive(select.POLLIN) == ("000000000002", {})
+        assert list(client.receive(select.POLLIN)) == [("000000000002", {})]
+
+
+def test_receive_invalid(esp_now, client):
+    address = b"\x00\x00\x00\x00\x00\x02"
+    esp_now.irecv.side_effect = [
+        (address, b""),
+        (address, b"\xb2\x00"),
+        (address, b"{not json"),
+        (address, b"[1]"),
+        (b"\x00\x00\x00\x00\x00\x03", b"{}"),
+        (None, None),
+    ]
+    esp_now.peers_table = {address: [-90, 0]}
+
+    with client:
+        assert list(client.receive(select.POLLIN)) == []
+        assert client.frames == 5
+        assert client.decode_failures == 4
+        assert client.unknown_devices == 1
+
+
+def test_receive_batch(esp_now, client):
+    known = b"\x00\x00\x00\x00\x00\x02"
+    unknown = b"\x00\x00\x00\x00\x00\x03"
+    esp_now.irecv.side_effect = [
+        (known, b'{"sensor2":{"temperature":10.2}}'),
+        (unknown, b'{"sensor2":{"temperature":10.3}}'),
+        (known, b'{"sensor2":{"temperature":10.4}}'),
+        (None, None),
+    ]
+    esp_now.peers_table = {}
+
+    with client:
+        assert list(client.receive(select.POLLIN)) == [
+            ("000000000002", {"sensor2_temperature": 10.2}),
+            ("000000000002", {"sensor2_temperature": 10.4}),
+        ]
+        assert client.drained == 3
+        assert client.max_drained == 3
+
+
+def test_receive_batch_cap(esp_now, poll, devices):
+    address = b"\x00\x00\x00\x00\x00\x02"
+    esp_now.irecv.return_value = (address, b'{"sensor2":{"temperature":10.2}}')
+    esp_now.peers_table = {}
+
+    with ESPNow(poll, devices, max_batch=4) as client:
+        assert len(list(client.receive(select.POLLIN))) == 4
+        assert esp_now.irecv.call_count == 4
+        assert client.drained == 4
+
+
+def test_compare_json(poll, esp_now, benchmark):
+    address = b"\x00\x00\x00\x00\x00\x01"
+    devices = (
+        {
+            "address": "00:00:00:00:00:01",
+            "components": {
+                "sensor1": {"pressure", "temperature"},
+                "sensor2": {"humidity"},
+            },
+        },
+    )
+    data = {
+        "sensor1": {"pressure": 1.0065, "temperature": -25.1},
+        "sensor2": {"humidity": 45},
+    }
+    frame = encode(data, *layout(data), 1)
+    json_frame = json.dumps(data).encode("utf-8")
+    assert len(frame) * 3 < len(json_frame)
+    esp_now.peers_table = {}
+    with ESPNow(poll, devices) as client:
+        table = client._tables[address]
+        assert client._filter(address, frame, table) == {
+            "sensor1_pressure": 1.0065,
+            "sensor1_temperature": -25.1,
+            "sensor2_humidity": 45,
+        }
+        assert client._filter(address, json_frame, table) == client._filter(
+            address, frame, table
+        )
+        benchmark.report("frame size", f"binary={len(frame)}B json={len(json_frame)}B")
+        count = benchmark.iterations(10000)
+        for name, payload in (("binary", frame), ("json", json_frame)):
+            with benchmark.timed(f"{name} decodes", count):
+                for _ in range(count):
+                    client._filter(address, payload, table)
+
+
+def test_table_memory(poll, esp_now, benchmark):
+    devices = [
+        {
+            "address": f"00:00:00:00:{i // 256:02x}:{i % 256:02x}",
+            "components": {
+                "sensor1": {"pressure", "temperature"},
+                "sensor2": {"humidity", "temperature"},
+            },
+        }
+        for i in range(200)
+    ]
+    client = ESPNow(poll, devices)
+    tracemalloc.start()
+    try:
+        client.__enter__()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    per_device = size / len(devices)
+    benchmark.report("filter table memory per device", f"{per_device:.0f}B")
+    assert per_device < 1024
+
+
+def test_downlink(esp_now, poll, devices):
+    address = b"\x00\x00\x00\x00\x00\x01"
+    downlink = {"000000000001": {"interval": 60}}
+    esp_now.peers_table = {}
+    esp_now.send.side_effect = [False, True]
+    with ESPNow(poll, devices, downlink=downlink) as client:
+        for sequence in range(3):
+            frame = encode(
+                {"sensor1": {"pressure": 1.002}}, *layout(["sensor1"]), sequence
+            )
+            esp_now.irecv.side_effect = [(address, frame), (None, None)]
+            assert list(client.receive(select.POLLIN)) == [
+                ("000000000001", {"sensor1_pressure": 1.002}),
+            ]
+        # Kept until acknowledged, then not sent again.
+        assert esp_now.send.call_count == 2
+        esp_now.add_peer.assert_called_once_with(address)
+        assert decode_settings(esp_now.send.call_args.args[1]) == {"interval": 60}
+        assert downlink == {}
+        assert client.downlinks == 1
+        assert client.downlink_failures == 1
+
+
+def test_downlink_error(esp_now, poll, devices):
+    address = b"\x00\x00\x00\x00\x00\x01"
+    downlink = {"000000000001": {"interval": 60}}
+    esp_now.peers_table = {}
+    esp_now.send.side_effect = OSError("ESP_ERR_ESPNOW_NO_MEM")
+    frame = encode({"sensor1": {"pressure": 1.002}}, *layout(["sensor1"]), 1)
+    esp_now.irecv.side_effect = [(address, frame), (None, None)]
+    with ESPNow(poll, devices, downlink=downlink) as client:
+        # Frames are still received.
+        assert list(client.receive(select.POLLIN)) == [
+            ("000000000001", {"sensor1_pressure": 1.002}),
+        ]
+        assert downlink == {"000000000001": {"interval": 60}}
+        assert client.downlinks == 0
+        assert client.downlink_failures == 1
+
+
+def test_reset(esp_now, poll, devices):
+    devices[0]["local_master_key"] = "key"
+    with ESPNow(poll, devices) as client:
+        esp_now.reset_mock()
+        poll.reset_mock()
+        try:
+            list(client.receive(select.POLLERR))
+        except Exception as exc:
+            client.reset(exc)
+        # Restarted with its peers.
+        assert esp_now.active.call_args_list == [call(False), call(False), call(True)]
+        esp_now.add_peer.assert_called_once_with(b"\x00\x00\x00\x00\x00\x01", lmk="key")
+        poll.unregister.assert_called_once_with(esp_now)
+        poll.register.assert_called_once_with(esp_now, select.POLLIN)
+        assert client.resets == 1
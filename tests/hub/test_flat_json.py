@@ -0,0 +1,64 @@
+import json
+import tracemalloc
+
+import pytest
+
+from esp_now_hub.hub.flat_json import FlatJSON
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {},
+        {"sensor1_temperature": 10.2},
+        {"sensor1_temperature": -25.1, "sensor1_pressure": 1.0065, "_signal": -80},
+        {"a": 0, "b": 0.0, "c": -0.5, "d": 10.0, "e": 0.05, "f": 123456, "g": -7},
+        {"sensor1_pressure": 0.0001, "sensor1_humidity": 100},
+    ],
+)
+def test_encode(data):
+    assert bytes(FlatJSON().encode(data)) == json.dumps(data).encode()
+
+
+def test_encode_values():
+    encoder = FlatJSON()
+    for i in range(-100000, 100000, 7):
+        for scale in (10, 10000):
+            data = {"value": i / scale}
+            assert bytes(encoder.encode(data)) == json.dumps(data).encode()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"some": "data"},
+        {"nested": {"a": 1}},
+        {"flag": True},
+        {"nan": float("nan")},
+        {"small": 1e-9},
+        {"large": 1e20},
+        {"long": 1 / 3},
+    ],
+)
+def test_encode_unsupported(data):
+    assert FlatJSON().encode(data) is None
+
+
+def test_encode_full():
+    encoder = FlatJSON(16)
+    assert encoder.encode({"a": 1.5}) is not None
+    assert encoder.encode({"a": 1.5, "b": 2.5}) is None
+    assert encoder.encode({"abcdefghij": 12345}) is None
+
+
+def test_encode_allocations():
+    encoder = FlatJSON()
+    data = {"sensor1_temperature": 21.5, "sensor1_humidity": 40, "_signal": -80}
+    encoder.encode(data)
+    tracemalloc.start()
+    try:
+        encoder.encode(data)
+        # The returned view only.
+        assert tracemalloc.get_traced_memory()[1] < 256
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,74 @@
+import select
+import sys
+
+import pytest
+import umqtt.simple
+
+from esp_now_hub.hub.esp_now import ESPNow
+from esp_now_hub.hub.latency import DECODE, FILTER, PUBLISH, Latency
+from esp_now_hub.hub.mqtt import MQTTClient
+from esp_now_hub.wire import encode, layout
+
+
+@pytest.fixture
+def ticks_us(mocker):
+    return mocker.patch.object(sys.modules["time"], "ticks_us")
+
+
+def test_histograms(ticks_us):
+    latency = Latency()
+    assert latency.telemetry() == {}
+    latency.enable(True)
+    ticks_us.return_value = 1000
+    latency.frame()
+    ticks_us.return_value = 1100
+    latency.checkpoint(DECODE)
+    ticks_us.return_value = 1600
+    latency.checkpoint(FILTER)
+    ticks_us.return_value = 301000
+    latency.checkpoint(PUBLISH)
+    assert latency.start is None
+    assert latency.telemetry() == {
+        "latency_decode": [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+        "latency_filter": [0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+        "latency_publish": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
+    }
+    assert latency.telemetry()["latency_publish"] == [0] * 11
+
+
+def test_receive_to_publish(mocker, mqtt_socket, ticks_us, ticks_ms):
+    esp_now = mocker.Mock()
+    esp_now.peers_table = {}
+    mocker.patch.object(sys.modules["espnow"], "ESPNow", return_value=esp_now)
+    mqtt_client = mocker.Mock()
+    mqtt_client.sock = mqtt_socket
+    mocker.patch.object(umqtt.simple, "MQTTClient", return_value=mqtt_client)
+    ticks_ms.return_value = 1000
+    ticks_us.side_effect = [0, 300, 700, 3000]
+    devices = (
+        {
+            "address": "00:00:00:00:00:01",
+            "keepalive": 5,
+            "name": "dev1",
+            "components": {"sensor1": {"temperature"}},
+        },
+    )
+    address = b"\x00\x00\x00\x00\x00\x01"
+    esp_now.irecv.side_effect = [
+        (address, encode({"sensor1": {"temperature": 1}}, *layout(["sensor1"]), 1)),
+        (None, None),
+    ]
+    latency = Latency()
+    poll = mocker.Mock()
+    with MQTTClient(
+        poll, "topic", devices, 10, "host", latency_histograms=latency
+    ) as m:
+        with ESPNow(poll, devices, latency_histograms=latency) as e:
+            # Switched on from MQTT.
+            m._on_message(b"topic/set/hub", b'{"latency": true}')
+            for device_id, data in e.receive(select.POLLIN):
+                m.send(device_id, data)
+            telemetry = m.telemetry()
+    assert telemetry["latency_decode"][1] == 1
+    assert telemetry["latency_filter"][2] == 1
+    assert telemetry["latency_publish"][4] == 1
@@ -1,19 +1,22 @@
 import select
+import socket
+import sys
+import tracemalloc
 from unittest.mock import call
 
+import network
 import pytest
 import umqtt.simple
 
-from esp_now_hub.hub.mqtt import MQTTClient
+from esp_now_hub.hub.mqtt import _HUB_SENSORS, MQTTClient
+from esp_now_hub.hub.wifi import WLan
 
-
-@pytest.fixture
-def poll(mocker):
-    return mocker.Mock()
+# Discovery hashes are kept.
+pytestmark = pytest.mark.usefixtures("stored")
 
 
 @pytest.fixture
-def mqtt_socket(mocker):
+def poll(mocker):
     return mocker.Mock()
 
 
@@ -48,17 +51,20 @@ def client(poll, mqtt_client, devices):
     return MQTTClient(poll, "topic", devices, 10, "host")
 
 
-def test_setup(client, poll, mqtt_client, mqtt_socket):
+def test_setup(client, poll, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
     with client:
         poll.register.assert_called_once_with(mqtt_socket, select.POLLIN)
-        # 2 discovery, 2 dev statuses, 1 hub status
-        assert mqtt_client.publish.call_count == 5
-        mqtt_client.publish.reset_mock()
+        # 2 discovery, 2 dev statuses, hub diagnostics without spool, 1 hub status
+        assert len(mqtt_socket.publishes()) == 5 + len(_HUB_SENSORS) - 3
     poll.unregister.assert_called_once_with(mqtt_socket)
-    assert mqtt_client.publish.call_count == 1
+    assert mqtt_socket.publishes() == [
+        call(b"topic/status/hub", b"offline", retain=True),
+    ]
 
 
-def test_receive(client, mqtt_client):
+def test_receive(client, mqtt_client, ticks_ms):
+    ticks_ms.return_value = 1000
     with client:
         client.receive(select.POLLIN)
     mqtt_client.check_msg.assert_called_once()
@@ -72,45 +78,692 @@ def test_ping_wait(client, mqtt_client, ticks_ms):
         assert client.ping() == 9000
 
 
-def test_ping_reconnect(client, mqtt_client, ticks_ms):
+def test_ping_reconnect(client, mqtt_client, mqtt_socket, ticks_ms):
     ticks_ms.return_value = 1000
-    mqtt_client.keepalive = 10
     with client:
-        ticks_ms.return_value = 12000
+        mqtt_socket.publishes()
+        ticks_ms.return_value = 11000
+        assert client.ping() == 10000
+        assert mqtt_socket.publishes() == []
+        assert mqtt_socket.pings == 1
         mqtt_client.connect.reset_mock()
-        mqtt_client.publish.reset_mock()
+        # No response.
+        ticks_ms.return_value = 21000
         assert client.ping() == 10000
-        assert mqtt_client.publish.call_args_list == [
+        assert mqtt_socket.publishes() == [
             call(b"topic/status/hub", b"online", retain=True),
         ]
+        assert mqtt_socket.pings == 1
     mqtt_client.connect.assert_called_once()
 
 
-def test_ping_devices(client, mqtt_client, ticks_ms):
+def test_reset(client, mqtt_client, mqtt_socket, ticks_ms, mocker):
+    """Simulated broker restart breaking the client, as run by the main loop."""
     ticks_ms.return_value = 1000
-    mqtt_client.keepalive = 10
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
     with client:
-        ticks_ms.return_value = 12000
-        client._last_receive_ticks = {
-            "000000000001": 1000,
-        }
-        mqtt_client.publish.reset_mock()
+        client.send("000000000001", {})
+        mqtt_socket.publishes()
+        mqtt_client.check_msg.side_effect = IndexError("truncated packet")
+        try:
+            client.receive(select.POLLIN)
+        except Exception as exc:
+            client.reset(exc)
+        mqtt_client.check_msg.side_effect = None
+        mqtt_client.connect.reset_mock()
+        # Held until reconnected after the backoff.
+        ticks_ms.return_value = 1500
+        client.send("000000000001", {"sensor1_pressure": 1})
+        assert client.ping() == 500
+        mqtt_client.connect.assert_not_called()
+        ticks_ms.return_value = 2000
+        client.ping()
+        client.flush()
+        mqtt_client.connect.assert_called_once()
+        assert mqtt_socket.publishes()[-1] == call(
+            b"topic/get/000000000001", b'{"sensor1_pressure": 1}', retain=False
+        )
+        telemetry = client.telemetry()
+        assert telemetry["mqtt_resets"] == 1
+        # Recovered in 1s, the first backoff delay.
+        assert telemetry["reconnect_time"] == 1000
+
+
+def test_reset_restart_baseline(
+    poll, mqtt_client, mqtt_socket, devices, ticks_ms, mocker, benchmark
+):
+    """The test_reset error recovered by resetting the client, against recovering
+    as before layers were reset: the error stops the hub, restarted after
+    interval / 10, joining Wi-Fi and connecting MQTT again.
+    ESP-Now is also down meanwhile, frames are lost.
+    """
+    wlan = mocker.Mock()
+    wlan.scan.return_value = []
+    mocker.patch.object(network, "WLAN", return_value=wlan)
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
+
+    def _sleep_ms(ms):
+        ticks_ms.return_value += ms
+        # Wi-Fi joined after a check interval.
+        wlan.status.return_value = network.STAT_GOT_IP
+        wlan.isconnected.return_value = True
+
+    time = sys.modules["time"]
+    mocker.patch.object(time, "sleep_ms", side_effect=_sleep_ms)
+    mocker.patch.object(time, "sleep", side_effect=lambda s: _sleep_ms(int(s * 1000)))
+    interval = 10
+    recovered = call(
+        b"topic/get/000000000001", b'{"sensor1_pressure": 1}', retain=False
+    )
+
+    def _run(reset):
+        """Run until the error, return the time it took to publish again on reset."""
+        wlan.status.return_value = network.STAT_CONNECTING
+        wlan.isconnected.return_value = False
+        with WLan("ssid", "password"):
+            with MQTTClient(poll, "topic", devices, interval, "host") as client:
+                mqtt_client.check_msg.side_effect = None
+                client.send("000000000001", {"sensor1_pressure": 1})
+                client.flush()
+                mqtt_client.check_msg.side_effect = IndexError("truncated packet")
+                try:
+                    client.receive(select.POLLIN)
+                except IndexError as exc:
+                    if not reset:
+                        raise
+                    client.reset(exc)
+                failed = ticks_ms.return_value
+                mqtt_client.check_msg.side_effect = None
+                mqtt_socket.publishes()
+                client.send("000000000001", {"sensor1_pressure": 1})
+                wait = client.ping()
+                while True:
+                    ticks_ms.return_value += wait
+                    wait = client.ping()
+                    client.flush()
+                    if recovered in mqtt_socket.publishes():
+                        return ticks_ms.return_value - failed
+
+    ticks_ms.return_value = 1000
+    reset = _run(True)
+    ticks_ms.return_value = 1000
+    with pytest.raises(IndexError):
+        _run(False)
+    failed = ticks_ms.return_value
+    mqtt_socket.publishes()
+    mqtt_client.connect.reset_mock()
+    time.sleep(interval / 10)
+    with pytest.raises(IndexError):
+        _run(False)
+    mqtt_client.connect.assert_called_once()
+    assert recovered in mqtt_socket.publishes()
+    restart = ticks_ms.return_value - failed
+    # The first backoff delay, against the restart delay and a Wi-Fi join.
+    assert reset == 1000
+    assert restart == 1100
+    benchmark.report("reset recovery ms", reset)
+    benchmark.report("restart recovery ms", restart)
+
+
+def test_ping_skipped(client, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        ticks_ms.return_value = 6000
+        client.send_telemetry({"some": 1})
+        client.flush()
+        client.receive(select.POLLIN)
+        # Packets were exchanged 5s ago.
+        ticks_ms.return_value = 11000
+        assert client.ping() == 5000
+        mqtt_socket.publishes()
+        assert mqtt_socket.pings == 0
+        ticks_ms.return_value = 16000
         assert client.ping() == 10000
-        assert mqtt_client.publish.call_args_list == [
-            call(b"topic/status/hub", b"online", retain=True),
+        mqtt_socket.publishes()
+        assert mqtt_socket.pings == 1
+
+
+def test_device_offline(client, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        client.send("000000000001", {})
+        ticks_ms.return_value = 3000
+        client.send("000000000002", {})
+        ticks_ms.return_value = 5000
+        mqtt_socket.publishes()
+        # Device 1 expires after 7500ms.
+        assert client.ping() == 3500
+        client.flush()
+        assert mqtt_socket.publishes() == []
+        ticks_ms.return_value = 9000
+        assert client.ping() == 1500
+        client.flush()
+        assert mqtt_socket.publishes() == [
             call(b"topic/status/000000000001", b"offline", retain=True),
         ]
-    assert client._last_receive_ticks == {}
+        assert "000000000001" not in client._deadlines
+        assert "000000000002" in client._deadlines
 
 
-def test_send(client, mqtt_client, ticks_ms):
+def test_send(client, mqtt_socket, ticks_ms):
     ticks_ms.return_value = 1000
     with client:
-        assert client._last_receive_ticks == {}
-        mqtt_client.publish.reset_mock()
+        assert "000000000001" not in client._deadlines
+        mqtt_socket.publishes()
         client.send("000000000001", {"some": "data"})
-        assert mqtt_client.publish.call_args_list == [
+        client.flush()
+        assert mqtt_socket.publishes() == [
             call(b"topic/status/000000000001", b"online", retain=True),
             call(b"topic/get/000000000001", b'{"some": "data"}', retain=False),
         ]
-        assert client._last_receive_ticks == {"000000000001": 1000}
+        assert "000000000001" in client._deadlines
+
+
+def test_send_uppercase_address(poll, mqtt_client, mqtt_socket, devices, ticks_ms):
+    ticks_ms.return_value = 1000
+    devices[0]["address"] = "AA:BB:CC:DD:EE:01"
+    with MQTTClient(poll, "topic", devices, 10, "host") as client:
+        mqtt_socket.publishes()
+        # As identified by ESP-Now.
+        client.send("aabbccddee01", {"some": "data"})
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(b"topic/status/aabbccddee01", b"online", retain=True),
+            call(b"topic/get/aabbccddee01", b'{"some": "data"}', retain=False),
+        ]
+
+
+def test_send_buffered(client, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        client._deadlines.set("000000000001", 7500)
+        mqtt_socket.publishes()
+        mqtt_socket.fail = True
+        mqtt_client.connect.side_effect = OSError
+        client.send("000000000001", {"some": 1})
+        # Coalesced publishes are kept when writing fails.
+        client.flush()
+        client.send("000000000001", {"some": 2})
+        # Reconnection is retried after a backoff.
+        assert client.ping() <= 1000
+        client.send("000000000001", {"some": 3})
+        assert len(client.pending) == 2
+        mqtt_socket.fail = False
+        mqtt_client.connect.side_effect = None
+        ticks_ms.return_value = 2000
+        client.ping()
+        client.send("000000000001", {"some": 4})
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(b"topic/get/000000000001", b'{"some": 1}', retain=False),
+            call(b"topic/status/hub", b"online", retain=True),
+            call(b"topic/status/000000000001", b"online", retain=True),
+            call(b"topic/status/000000000002", b"offline", retain=True),
+            call(b"topic/get/000000000001", b'{"some": 2}', retain=False),
+            call(b"topic/get/000000000001", b'{"some": 3}', retain=False),
+            call(b"topic/get/000000000001", b'{"some": 4}', retain=False),
+        ]
+        assert len(client.pending) == 0
+        assert client.pending.flushed == 2
+        assert client.reconnects == 1
+        assert client.reconnect_attempts == 3
+        assert client.reconnect_time == 1000
+
+
+def test_send_spooled(poll, mqtt_client, mqtt_socket, devices, ticks_ms, tmp_path):
+    ticks_ms.return_value = 1000
+    client = MQTTClient(
+        poll,
+        "topic",
+        devices,
+        10,
+        "host",
+        buffer={"capacity": 1},
+        spool={"path": str(tmp_path)},
+    )
+    with client:
+        client._deadlines.set("000000000001", 7500)
+        mqtt_socket.fail = True
+        mqtt_client.connect.side_effect = OSError
+        client.flush()
+        for i in range(3):
+            client.send("000000000001", {"some": i})
+            client.flush()
+        assert len(client.pending) == 1
+        assert client.spool.spooled == 1
+        mqtt_socket.fail = False
+        mqtt_client.connect.side_effect = None
+        mqtt_socket.publishes()
+        client.ping()
+        client.send("000000000001", {"some": 3})
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(b"topic/get/000000000001", b'{"some": 0}', retain=False),
+            call(b"topic/status/hub", b"online", retain=True),
+            call(b"topic/status/000000000001", b"online", retain=True),
+            call(b"topic/status/000000000002", b"offline", retain=True),
+            call(b"topic/get/000000000001", b'{"some": 1}', retain=False),
+            call(b"topic/get/000000000001", b'{"some": 2}', retain=False),
+            call(b"topic/get/000000000001", b'{"some": 3}', retain=False),
+        ]
+
+
+def test_hub_discovery(client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        assert (
+            call(
+                b"topic/sensor/hub/max_loop_latency/config",
+                b'{"state_topic": "topic/get/hub", '
+                b'"value_template": "{{ value_json.max_loop_latency }}", '
+                b'"state_class": "measurement", "entity_category": "diagnostic", '
+                b'"device": {"identifiers": ["topic-hub"], "name": "ESP-Now hub"}, '
+                b'"availability": [{"topic": "topic/status/hub"}], '
+                b'"unique_id": "topic-hub-max_loop_latency", "name": "max loop latency", '
+                b'"unit_of_measurement": "ms"}',
+                retain=True,
+            )
+            in mqtt_socket.publishes()
+        )
+
+
+def test_telemetry(client, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        mqtt_socket.fail = True
+        mqtt_client.connect.side_effect = OSError
+        assert client._publish(b"topic/get/hub", b"{}")
+        client.flush()
+        client.ping()
+        # Disconnected until a reconnect attempt succeeds.
+        assert not client._publish(b"topic/get/hub", b"{}")
+        assert client.telemetry()["publish_failures"] == 1
+        mqtt_socket.fail = False
+        mqtt_client.connect.side_effect = None
+        ticks_ms.return_value = 3000
+        client.ping()
+        assert client._publish(b"topic/get/hub", b"{}")
+        telemetry = client.telemetry()
+        assert telemetry["reconnects"] == 1
+        assert telemetry["reconnect_attempts"] == 3
+        assert telemetry["reconnect_time"] == 2000
+        # Discovery and statuses, then statuses again after reconnecting.
+        assert telemetry["published"] == 4 + len(_HUB_SENSORS) - 3 + 1 + 2 + 1
+        assert "spool_spooled" not in telemetry
+
+
+class _NullSocket:
+    def setblocking(self, blocking):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+
+def _publish_peak(client):
+    """Return the peak bytes allocated by a state publish."""
+    data = {"sensor1_pressure": 1.0065, "_signal": -80}
+    client.send("000000000001", data)
+    client.flush()
+    tracemalloc.start()
+    try:
+        client.send("000000000001", data)
+        client.flush()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _ticks_ms():
+    return 1000
+
+
+def test_send_allocations(client, mqtt_client, mocker, benchmark):
+    # Mock calls would allocate.
+    mocker.patch.object(sys.modules["time"], "ticks_ms", new=_ticks_ms)
+    mqtt_client.sock = _NullSocket()
+    with client:
+        flat = _publish_peak(client)
+        mocker.patch.object(client._json, "encode", return_value=None)
+        dumps = _publish_peak(client)
+    benchmark.report("bytes allocated per publish", f"flat={flat} json.dumps={dumps}")
+    # Memoryviews on the reused buffers only.
+    assert flat < 600
+    assert flat < dumps
+
+
+def test_discovery_unchanged(
+    poll, mqtt_client, mqtt_socket, devices, nvs, stored, ticks_ms
+):
+    ticks_ms.return_value = 1000
+    with MQTTClient(poll, "topic", devices, 10, "host"):
+        pass
+    assert set(stored) == {"000000000001", "000000000002", "hub"}
+    nvs.commit.assert_called_once()
+    mqtt_socket.publishes()
+    devices[1]["name"] = "renamed"
+    with MQTTClient(poll, "topic", devices, 10, "host"):
+        topics = [c.args[0] for c in mqtt_socket.publishes()]
+    assert topics == [
+        b"topic/status/hub",
+        b"topic/sensor/000000000002/sensor2-temperature/config",
+        b"topic/status/000000000001",
+        b"topic/status/000000000002",
+    ]
+
+
+def test_discovery_ha_birth(client, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        mqtt_client.subscribe.assert_any_call(b"homeassistant/status")
+        mqtt_socket.publishes()
+        client._on_message(b"homeassistant/status", b"offline")
+        client.flush()
+        assert mqtt_socket.publishes() == []
+        client._on_message(b"homeassistant/status", b"online")
+        client.flush()
+        # Configs only, statuses are kept.
+        assert len(mqtt_socket.publishes()) == 2 + len(_HUB_SENSORS) - 3
+
+
+def test_downlink(client, mqtt_client, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        mqtt_client.subscribe.assert_any_call(b"topic/set/+")
+        client._on_message(b"topic/set/000000000001", b'{"interval": 60, "x": 1}')
+        client._on_message(
+            b"topic/set/000000000001",
+            b'{"send_configs": {"sensor1": {"pressure": {"diff": 1}}}}',
+        )
+        client._on_message(
+            b"topic/set/000000000001", b'{"interval": "%s"}' % b"x" * 250
+        )
+        client._on_message(b"topic/set/000000000002", b"[]")
+        client._on_message(b"topic/set/000000000003", b'{"interval": 60}')
+        assert client.downlink == {
+            "000000000001": {
+                "interval": 60,
+                "send_configs": {"sensor1": {"pressure": {"diff": 1}}},
+            }
+        }
+
+
+def test_send_qos_1(poll, mqtt_client, mqtt_socket, devices, ticks_ms):
+    ticks_ms.return_value = 1000
+    client = MQTTClient(poll, "topic", devices, 10, "host", qos=1, in_flight=2)
+    with client:
+        client._deadlines.set("000000000001", 7500)
+        mqtt_socket.publishes()
+        for i in range(3):
+            client.send("000000000001", {"some": i})
+        client.flush()
+        # Window full, the last one is held.
+        assert mqtt_socket.publishes() == [
+            call(
+                b"topic/get/000000000001",
+                b'{"some": 0}',
+                retain=False,
+                pid=1,
+                dup=False,
+            ),
+            call(
+                b"topic/get/000000000001",
+                b'{"some": 1}',
+                retain=False,
+                pid=2,
+                dup=False,
+            ),
+        ]
+        assert len(client.pending) == 1
+        mqtt_client.check_msg.return_value = 0x40
+        mqtt_socket.read = lambda n: b"\x02" if n == 1 else b"\x00\x01"
+        client.receive(select.POLLIN)
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(
+                b"topic/get/000000000001",
+                b'{"some": 2}',
+                retain=False,
+                pid=3,
+                dup=False,
+            ),
+        ]
+        assert len(client.pending) == 0
+        # Unacknowledged ones are sent again after reconnecting.
+        client.receive(select.POLLHUP)
+        client.ping()
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(b"topic/status/hub", b"online", retain=True),
+            call(
+                b"topic/get/000000000001", b'{"some": 1}', retain=False, pid=2, dup=True
+            ),
+            call(
+                b"topic/get/000000000001", b'{"some": 2}', retain=False, pid=3, dup=True
+            ),
+            call(b"topic/status/000000000001", b"online", retain=True),
+            call(b"topic/status/000000000002", b"offline", retain=True),
+        ]
+        assert client.telemetry()["retransmitted"] == 2
+
+
+def test_send_qos_1_unwritten(poll, mqtt_client, mqtt_socket, devices, ticks_ms):
+    ticks_ms.return_value = 1000
+    client = MQTTClient(poll, "topic", devices, 10, "host", qos=1)
+    with client:
+        client._deadlines.set("000000000001", 7500)
+        mqtt_socket.publishes()
+        mqtt_socket.room = 0
+        client.send("000000000001", {"some": 0})
+        client.flush()
+        assert mqtt_socket.publishes() == []
+        # Queued but never written, sent once after reconnecting.
+        mqtt_socket.room = None
+        client.receive(select.POLLHUP)
+        client.ping()
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(b"topic/status/hub", b"online", retain=True),
+            call(
+                b"topic/get/000000000001", b'{"some": 0}', retain=False, pid=1, dup=True
+            ),
+            call(b"topic/status/000000000001", b"online", retain=True),
+            call(b"topic/status/000000000002", b"offline", retain=True),
+        ]
+
+
+def test_send_non_blocking(client, poll, mqtt_client, mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client:
+        client._deadlines.set("000000000001", 7500)
+        mqtt_socket.publishes()
+        mqtt_socket.room = 0
+        full = client._writer.full
+        i = 0
+        while client._writer.full == full:
+            client.send("000000000001", {"some": i})
+            client.flush()
+            i += 1
+        poll.modify.assert_called_once_with(mqtt_socket, select.POLLIN | select.POLLOUT)
+        # The queue is full, the state is buffered.
+        assert len(client.pending) == 1
+        mqtt_socket.room = 40
+        client.receive(select.POLLOUT)
+        mqtt_socket.room = None
+        client.receive(select.POLLOUT)
+        poll.modify.assert_called_with(mqtt_socket, select.POLLIN)
+        client.send("000000000001", {"some": i})
+        client.flush()
+        assert [c.args[1] for c in mqtt_socket.publishes()] == [
+            b'{"some": %d}' % j for j in range(i + 1)
+        ]
+
+
+def test_send_too_large(poll, mqtt_client, mqtt_socket, devices, ticks_ms):
+    ticks_ms.return_value = 1000
+    client = MQTTClient(poll, "topic", devices, 10, "host", writer={"size": 64})
+    with client:
+        client._deadlines.set("000000000001", 7500)
+        mqtt_socket.publishes()
+        # Dropped instead of blocking or holding later states.
+        client.send("000000000001", {"some": "x" * 64})
+        client.send("000000000001", {"some": 1})
+        client.flush()
+        assert mqtt_socket.publishes() == [
+            call(b"topic/get/000000000001", b'{"some": 1}', retain=False),
+        ]
+        assert len(client.pending) == 0
+        assert client.telemetry()["publish_failures"] == 1
+
+
+def test_connect_backoff(client, poll, mqtt_client, mqtt_socket, ticks_ms, mocker):
+    ticks_ms.return_value = 1000
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
+    mqtt_client.connect.side_effect = OSError
+    with client:
+        poll.register.assert_not_called()
+        # States are held while connecting.
+        client.send("000000000001", {"some": 1})
+        assert len(client.pending) == 1
+        assert client.ping() == 1000
+        ticks_ms.return_value = 2000
+        assert client.ping() == 2000
+        ticks_ms.return_value = 4000
+        assert client.ping() == 4000
+        mqtt_client.connect.side_effect = None
+        ticks_ms.return_value = 8000
+        client.ping()
+        client.flush()
+        poll.register.assert_called_once_with(mqtt_socket, select.POLLIN)
+        assert mqtt_socket.publishes()[-1] == call(
+            b"topic/get/000000000001", b'{"some": 1}', retain=False
+        )
+    assert client.reconnect_attempts == 4
+    # Never disconnected.
+    assert client.reconnects == 0
+
+
+@pytest.fixture
+def brokers(mqtt_client):
+    """Local stand-in brokers accepting TCP connections, the MQTT client
+    connects if its broker accepts.
+    """
+    listeners = []
+    for _ in range(2):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        listeners.append(listener)
+
+    def _connect(clean_session, timeout):
+        with socket.create_connection((mqtt_client.server, mqtt_client.port), timeout):
+            pass
+
+    mqtt_client.connect.side_effect = _connect
+    yield listeners
+    for listener in listeners:
+        listener.close()
+
+
+def _config(listeners):
+    return [{"server": "127.0.0.1", "port": lst.getsockname()[1]} for lst in listeners]
+
+
+def _run(client, ticks_ms, until):
+    """Advance time by 10s steps, the broker answering."""
+    while ticks_ms.return_value < until:
+        ticks_ms.return_value += 10000
+        client.receive(select.POLLIN)
+        client.ping()
+        client.flush()
+
+
+def test_failover(poll, mqtt_client, mqtt_socket, devices, brokers, ticks_ms):
+    ticks_ms.return_value = 1000
+    client = MQTTClient(
+        poll, "topic", devices, 10, brokers=_config(brokers), failback=30
+    )
+    with client:
+        assert client.telemetry()["broker"] == 0
+        mqtt_socket.publishes()
+        # Pings not answered.
+        ticks_ms.return_value = 11000
+        client.ping()
+        ticks_ms.return_value = 21000
+        client.ping()
+        client.flush()
+        assert (mqtt_client.server, mqtt_client.port) == brokers[1].getsockname()
+        telemetry = client.telemetry()
+        assert telemetry["broker"] == 1
+        assert telemetry["failovers"] == 1
+        # All configs and statuses on the new broker.
+        assert len(mqtt_socket.publishes()) == 1 + 2 + len(_HUB_SENSORS) - 3 + 2
+        assert mqtt_client.connect.call_args_list[-1] == call(True, 2)
+        # Probed every 30s, answered for 30s, checked on the next ping.
+        _run(client, ticks_ms, 51000)
+        assert client._probe_socket is not None
+        assert client.ping() == 1000
+        _run(client, ticks_ms, 91000)
+        assert client.telemetry()["broker"] == 1
+        _run(client, ticks_ms, 101000)
+        telemetry = client.telemetry()
+        assert telemetry["broker"] == 0
+        assert telemetry["failovers"] == 2
+        publishes = mqtt_socket.publishes()
+        assert publishes[0] == call(b"topic/status/hub", b"offline", retain=True)
+        assert publishes[1] == call(b"topic/status/hub", b"online", retain=True)
+        mqtt_client.disconnect.assert_called_once()
+
+
+def test_failover_unreachable(
+    poll, mqtt_client, mqtt_socket, devices, brokers, ticks_ms, mocker
+):
+    ticks_ms.return_value = 1000
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
+    config = _config(brokers)
+    brokers[0].close()
+    client = MQTTClient(poll, "topic", devices, 10, brokers=config, failback=30)
+    with client:
+        # The next broker is tried at once.
+        assert client.ping() == 10000
+        assert client.telemetry()["broker"] == 1
+        _run(client, ticks_ms, 101000)
+        # The preferred broker does not answer probes.
+        assert client.telemetry()["broker"] == 1
+        # Both down, retried after a backoff.
+        brokers[1].close()
+        client.receive(select.POLLHUP)
+        assert client.ping() == 1000
+        assert client.reconnect_attempts == 4
+        ticks_ms.return_value += 1000
+        client.ping()
+        assert client.reconnect_attempts == 6
+        # Only counted when connected to another broker.
+        assert client.telemetry()["failovers"] == 0
+
+
+def test_failover_discovery(
+    poll, mqtt_client, mqtt_socket, devices, brokers, stored, ticks_ms
+):
+    ticks_ms.return_value = 1000
+    config = _config(brokers)
+    with MQTTClient(poll, "topic", devices, 10, brokers=config):
+        pass
+    mqtt_socket.publishes()
+    # The preferred broker is down at boot.
+    brokers[0].close()
+    with MQTTClient(poll, "topic", devices, 10, brokers=config) as client:
+        # The next broker is tried at once.
+        client.ping()
+        client.flush()
+        assert client.telemetry()["broker"] == 1
+        # All configs on the other broker.
+        assert len(mqtt_socket.publishes()) == 1 + 2 + len(_HUB_SENSORS) - 3 + 2
+    assert set(stored) == {
+        "000000000001",
+        "000000000002",
+        "hub",
+        "1/000000000001",
+        "1/000000000002",
+        "1/hub",
+    }
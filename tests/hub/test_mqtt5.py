@@ -0,0 +1,399 @@
+import select
+import socket
+import threading
+
+import pytest
+
+from esp_now_hub.hub import mqtt
+from esp_now_hub.hub.mqtt import MQTTClient
+
+
+class _Socket:
+    """MicroPython style socket over a host one."""
+
+    def __init__(self):
+        self._sock = socket.socket()
+
+    def connect(self, addr):
+        self._sock.connect(addr)
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def setblocking(self, blocking):
+        self._sock.setblocking(blocking)
+
+    def close(self):
+        self._sock.close()
+
+    def read(self, size):
+        try:
+            data = self._sock.recv(size)
+        except BlockingIOError:
+            return None
+        while data and len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def write(self, data):
+        if self._sock.getblocking():
+            self._sock.sendall(data)
+            return len(data)
+        try:
+            return self._sock.send(data)
+        except BlockingIOError:
+            return None
+
+
+class _Broker:
+    """Local stand-in broker, MQTT 5 capable or 3.1.1 only, rejecting version 5
+    with a CONNACK code or by closing the connection. Records publishes
+    with aliases resolved: topic, payload, message expiry, topic sent, packet size.
+    """
+
+    def __init__(self, v5=True, reject="code"):
+        self._v5 = v5
+        self._reject = reject
+        # Protocol level of each CONNECT.
+        self.levels = []
+        self.publishes = []
+        self.closed = 0
+        self._condition = threading.Condition()
+        self._listener = socket.socket()
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(1)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        self._listener.close()
+
+    def states(self, count):
+        """Wait for count state publishes, return them."""
+        with self._condition:
+            assert self._condition.wait_for(
+                lambda: len(self._states()) >= count, timeout=5
+            )
+            return self._states()
+
+    def configs(self, device_id, count):
+        """Wait for count discovery configs of a device, return them."""
+        with self._condition:
+            assert self._condition.wait_for(
+                lambda: len(self._configs(device_id)) >= count, timeout=5
+            )
+            return self._configs(device_id)
+
+    def wait_closed(self, count):
+        """Wait for count connections to be closed."""
+        with self._condition:
+            assert self._condition.wait_for(lambda: self.closed >= count, timeout=5)
+
+    def _states(self):
+        return [p for p in self.publishes if b"/get/0" in p[0]]
+
+    def _configs(self, device_id):
+        return [
+            p for p in self.publishes if device_id in p[0] and p[0].endswith(b"/config")
+        ]
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            with conn:
+                self._handle(conn)
+            with self._condition:
+                self.closed += 1
+                self._condition.notify_all()
+
+    def _handle(self, conn):
+        level = None
+        aliases = {}
+        while True:
+            op = _recv(conn, 1)
+            if not op:
+                return
+            size, size_bytes = _recv_varint(conn)
+            body = _recv(conn, size)
+            if op[0] == 0x10:
+                level = body[6]
+                self.levels.append(level)
+                if level == 5 and not self._v5:
+                    if self._reject == "code":
+                        conn.sendall(b"\x20\x02\x00\x01")
+                    return
+                if level == 5:
+                    # Topic Alias Maximum 10.
+                    conn.sendall(b"\x20\x06\x00\x00\x03\x22\x00\x0a")
+                else:
+                    conn.sendall(b"\x20\x02\x00\x00")
+            elif op[0] == 0x82:
+                if level == 5:
+                    conn.sendall(b"\x90\x04" + body[:2] + b"\x00\x00")
+                else:
+                    conn.sendall(b"\x90\x03" + body[:2] + b"\x00")
+            elif op[0] == 0xC0:
+                conn.sendall(b"\xd0\x00")
+            elif op[0] == 0xE0:
+                return
+            else:
+                assert op[0] & 0xF0 == 0x30
+                self._publish(conn, op[0], body, level, aliases, 1 + size_bytes + size)
+
+    def _publish(self, conn, op, body, level, aliases, packet_size):
+        i = 2 + (body[0] << 8 | body[1])
+        topic = sent = body[2:i]
+        pid = None
+        if op & 0x06:
+            pid = body[i : i + 2]
+            i += 2
+        expiry = None
+        if level == 5:
+            end = i + 1 + body[i]
+            i += 1
+            while i < end:
+                if body[i] == 0x23:
+                    alias = body[i + 1] << 8 | body[i + 2]
+                    if topic:
+                        aliases[alias] = topic
+                    else:
+                        topic = aliases[alias]
+                    i += 3
+                else:
+                    assert body[i] == 0x02
+                    expiry = int.from_bytes(body[i + 1 : i + 5], "big")
+                    i += 5
+        if pid is not None:
+            # With a reason code in MQTT 5.
+            conn.sendall(
+                b"\x40\x03" + pid + b"\x00" if level == 5 else b"\x40\x02" + pid
+            )
+        with self._condition:
+            self.publishes.append((topic, body[i:], expiry, sent, packet_size))
+            self._condition.notify_all()
+
+
+def _recv(conn, size):
+    data = b""
+    while len(data) < size:
+        try:
+            chunk = conn.recv(size - len(data))
+        except ConnectionResetError:
+            break
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _recv_varint(conn):
+    """Return the value and its size in bytes."""
+    value = shift = size = 0
+    while True:
+        byte = _recv(conn, 1)[0]
+        size += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, size
+        shift += 7
+
+
+@pytest.fixture(autouse=True)
+def host_socket(mocker, nvs):
+    nvs.get_i32.side_effect = OSError
+    mocker.patch.object(
+        mqtt.mqtt5,
+        "socket",
+        mocker.Mock(socket=_Socket, getaddrinfo=socket.getaddrinfo),
+    )
+
+
+@pytest.fixture
+def broker():
+    broker_ = _Broker()
+    yield broker_
+    broker_.close()
+
+
+@pytest.fixture
+def devices():
+    return (
+        {
+            "address": "00:00:00:00:00:01",
+            "keepalive": 5,
+            "name": "dev1",
+            "components": {"sensor1": {"pressure"}},
+        },
+    )
+
+
+@pytest.fixture
+def client(mocker, devices):
+    def _client(broker):
+        return MQTTClient(
+            mocker.Mock(),
+            "topic",
+            devices,
+            10,
+            "127.0.0.1",
+            broker.port,
+            qos=1,
+            protocol=5,
+        )
+
+    return _client
+
+
+def _receive(mqtt_client):
+    """Read acknowledgements until none are in flight."""
+    for _ in range(500):
+        if not mqtt_client.telemetry()["in_flight"]:
+            return
+        mqtt_client.receive(select.POLLIN)
+        threading.Event().wait(0.01)
+    raise AssertionError("not acknowledged")
+
+
+def test_topic_aliases(broker, client, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client(broker) as mqtt_client:
+        for i in range(3):
+            mqtt_client.send("000000000001", {"sensor1_pressure": i})
+            mqtt_client.flush()
+        states = broker.states(3)
+        _receive(mqtt_client)
+    broker.wait_closed(1)
+    assert broker.levels == [5]
+    assert [s[:3] for s in states] == [
+        (b"topic/get/000000000001", b'{"sensor1_pressure": 0}', 8),
+        (b"topic/get/000000000001", b'{"sensor1_pressure": 1}', 8),
+        (b"topic/get/000000000001", b'{"sensor1_pressure": 2}', 8),
+    ]
+    # Established by the first publish.
+    assert [s[3] for s in states] == [b"topic/get/000000000001", b"", b""]
+    statuses = [p for p in broker.publishes if b"/status/" in p[0]]
+    assert [(s[0], s[1], s[2]) for s in statuses] == [
+        (b"topic/status/hub", b"online", None),
+        (b"topic/status/000000000001", b"offline", None),
+        (b"topic/status/000000000001", b"online", None),
+        (b"topic/status/hub", b"offline", None),
+    ]
+    assert [s[3] for s in statuses] == [
+        b"topic/status/hub",
+        b"topic/status/000000000001",
+        b"",
+        b"",
+    ]
+
+
+def test_aliases_reconnect(broker, client, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client(broker) as mqtt_client:
+        mqtt_client.send("000000000001", {"sensor1_pressure": 0})
+        mqtt_client.flush()
+        broker.states(1)
+        _receive(mqtt_client)
+        mqtt_client.receive(select.POLLHUP)
+        mqtt_client.ping()
+        mqtt_client.send("000000000001", {"sensor1_pressure": 1})
+        mqtt_client.flush()
+        states = broker.states(2)
+        _receive(mqtt_client)
+    assert broker.levels == [5, 5]
+    # Aliases are established again on the new connection.
+    assert [s[3] for s in states] == [b"topic/get/000000000001"] * 2
+
+
+@pytest.mark.parametrize("reject", ["code", "close"])
+def test_fallback(client, ticks_ms, reject):
+    ticks_ms.return_value = 1000
+    broker = _Broker(v5=False, reject=reject)
+    try:
+        with client(broker) as mqtt_client:
+            mqtt_client.send("000000000001", {"sensor1_pressure": 0})
+            mqtt_client.flush()
+            broker.states(1)
+            _receive(mqtt_client)
+            mqtt_client.receive(select.POLLHUP)
+            mqtt_client.ping()
+            mqtt_client.send("000000000001", {"sensor1_pressure": 1})
+            mqtt_client.flush()
+            states = broker.states(2)
+            _receive(mqtt_client)
+    finally:
+        broker.close()
+    # The broker is remembered.
+    assert broker.levels == [5, 4, 4]
+    assert [s[:4] for s in states] == [
+        (
+            b"topic/get/000000000001",
+            b'{"sensor1_pressure": %d}' % i,
+            None,
+            b"topic/get/000000000001",
+        )
+        for i in range(2)
+    ]
+
+
+def test_discovery_reconnect(broker, client, devices, stored, ticks_ms):
+    ticks_ms.return_value = 1000
+    with client(broker) as mqtt_client:
+        broker.configs(b"000000000001", 1)
+        devices[0]["name"] = "renamed"
+        mqtt_client._send_discovery()
+        # Dropped from the queue on reconnect, sent again.
+        mqtt_client.receive(select.POLLHUP)
+        mqtt_client.ping()
+        mqtt_client.flush()
+        configs = broker.configs(b"000000000001", 2)
+        _receive(mqtt_client)
+    assert b"renamed" in configs[1][1]
+    assert len(configs) == 2
+
+
+def test_connect_timeout(client, mocker, ticks_ms):
+    """A broker accepting the connection but never answering CONNECT,
+    without a timeout the connect would block forever.
+    """
+    ticks_ms.return_value = 1000
+    mocker.patch.object(mqtt, "_CONNECT_TIMEOUT", 0.1)
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    try:
+        port = listener.getsockname()[1]
+        with client(mocker.Mock(port=port)) as mqtt_client:
+            assert not mqtt_client._connected
+            assert mqtt_client.telemetry()["reconnect_attempts"] == 1
+            # Retried after the backoff.
+            assert mqtt_client.ping() > 0
+    finally:
+        listener.close()
+
+
+def test_bytes_per_reading(client, ticks_ms):
+    ticks_ms.return_value = 1000
+    sizes = {}
+    # 3.1.1 through the fallback.
+    for protocol in (4, 5):
+        broker = _Broker(v5=protocol == 5)
+        try:
+            with client(broker) as mqtt_client:
+                for i in range(10):
+                    mqtt_client.send("000000000001", {"sensor1_pressure": i})
+                    mqtt_client.flush()
+                    _receive(mqtt_client)
+                states = broker.states(10)
+        finally:
+            broker.close()
+        assert broker.levels == ([5] if protocol == 5 else [5, 4])
+        sizes[protocol] = sum(s[4] for s in states)
+    # After the first reading, the 22 bytes topic is replaced by 9 bytes
+    # of properties: alias and expiry.
+    assert sizes[4] - sizes[5] == 9 * (22 - 9) - 9
@@ -0,0 +1,194 @@
+import struct
+import sys
+from unittest.mock import call
+
+import pytest
+
+from esp_now_hub.hub.packet_writer import PacketWriter
+
+from .conftest import FakeSocket
+
+
+def test_publish(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter()
+    writer.publish(mqtt_socket, b"topic/a", b"1")
+    writer.publish(mqtt_socket, b"topic/b", b"x" * 200, retain=True)
+    assert mqtt_socket.writes == 0
+    writer.flush(mqtt_socket)
+    assert mqtt_socket.writes == 1
+    assert mqtt_socket.publishes() == [
+        call(b"topic/a", b"1", retain=False),
+        call(b"topic/b", b"x" * 200, retain=True),
+    ]
+
+
+def test_publish_full(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter(size=64)
+    for i in range(3):
+        writer.publish(mqtt_socket, b"topic", b"%d" % i * 20)
+    # Flushed before the third packet.
+    assert mqtt_socket.writes == 1
+    writer.publish(mqtt_socket, b"topic", b"x" * 100)
+    # Flushed, then written as is.
+    assert mqtt_socket.writes == 5
+    assert len(writer) == 0
+    assert [c.args[1] for c in mqtt_socket.publishes()] == [
+        b"0" * 20,
+        b"1" * 20,
+        b"2" * 20,
+        b"x" * 100,
+    ]
+
+
+def test_publish_max_delay(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter(max_delay=50)
+    writer.publish(mqtt_socket, b"topic", b"1")
+    ticks_ms.return_value = 1049
+    writer.publish(mqtt_socket, b"topic", b"2")
+    assert mqtt_socket.writes == 0
+    ticks_ms.return_value = 1050
+    writer.publish(mqtt_socket, b"topic", b"3")
+    assert mqtt_socket.writes == 1
+    assert len(mqtt_socket.publishes()) == 3
+
+
+def test_publish_qos_1(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter(size=64)
+    writer.publish(mqtt_socket, b"topic", b"1", pid=1)
+    writer.publish(mqtt_socket, b"topic", b"2", pid=0x1234, dup=True)
+    writer.publish(mqtt_socket, b"topic", b"x" * 100, pid=3)
+    assert mqtt_socket.publishes() == [
+        call(b"topic", b"1", retain=False, pid=1, dup=False),
+        call(b"topic", b"2", retain=False, pid=0x1234, dup=True),
+        call(b"topic", b"x" * 100, retain=False, pid=3, dup=False),
+    ]
+
+
+def test_publish_too_large(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter(size=64)
+    writer.publish(mqtt_socket, b"topic", b"1")
+    # Refused without flushing the queue.
+    with pytest.raises(ValueError, match="larger than the write queue"):
+        writer.publish(mqtt_socket, b"topic", b"x" * 100, block=False)
+    assert mqtt_socket.writes == 0
+    writer.flush(mqtt_socket)
+    assert mqtt_socket.publishes() == [call(b"topic", b"1", retain=False)]
+
+
+def test_write_partial(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter(size=32)
+    mqtt_socket.room = 10
+    writer.publish(mqtt_socket, b"topic", b"1" * 10)
+    writer.ping(mqtt_socket)
+    assert not writer.write(mqtt_socket)
+    assert len(writer) == 11
+    assert not writer.write(mqtt_socket)
+    # Full, refused unless blocking.
+    assert not writer.publish(mqtt_socket, b"topic", b"2" * 10, block=False)
+    assert writer.full == 1
+    mqtt_socket.room = 11
+    assert writer.publish(mqtt_socket, b"topic", b"2" * 10, block=False)
+    mqtt_socket.room = None
+    assert writer.write(mqtt_socket)
+    assert mqtt_socket.publishes() == [
+        call(b"topic", b"1" * 10, retain=False),
+        call(b"topic", b"2" * 10, retain=False),
+    ]
+    assert mqtt_socket.pings == 1
+
+
+def test_rewind(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter()
+    writer.publish(mqtt_socket, b"topic", b"1")
+    writer.publish(mqtt_socket, b"topic", b"2")
+    mqtt_socket.room = 14
+    writer.write(mqtt_socket)
+    assert len(writer) == 6
+    # New connection, the second packet is written again whole.
+    del mqtt_socket.data[10:]
+    mqtt_socket.publishes()
+    mqtt_socket.room = None
+    writer.rewind()
+    writer.write(mqtt_socket)
+    assert mqtt_socket.publishes() == [call(b"topic", b"2", retain=False)]
+
+
+def test_drop_qos_1(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter()
+    writer.publish(mqtt_socket, b"topic", b"1", pid=1)
+    writer.publish(mqtt_socket, b"topic", b"2")
+    writer.publish(mqtt_socket, b"topic", b"3", pid=2, dup=True)
+    writer.ping(mqtt_socket)
+    mqtt_socket.room = 5
+    writer.write(mqtt_socket)
+    del mqtt_socket.data[:]
+    mqtt_socket.room = None
+    writer.rewind()
+    writer.drop_qos_1()
+    writer.flush(mqtt_socket)
+    assert mqtt_socket.publishes() == [call(b"topic", b"2", retain=False)]
+    assert mqtt_socket.pings == 1
+    writer.publish(mqtt_socket, b"topic", b"4", pid=3)
+    writer.rewind()
+    writer.drop_qos_1()
+    assert len(writer) == 0
+
+
+def test_flush_error(mqtt_socket, ticks_ms):
+    ticks_ms.return_value = 1000
+    writer = PacketWriter()
+    writer.publish(mqtt_socket, b"topic", b"1")
+    mqtt_socket.fail = True
+    with pytest.raises(OSError, match="write failed"):
+        writer.flush(mqtt_socket)
+    mqtt_socket.fail = False
+    writer.flush(mqtt_socket)
+    assert mqtt_socket.publishes() == [call(b"topic", b"1", retain=False)]
+
+
+def _publish_unbuffered(sock, topic, msg):
+    """Writes as umqtt.simple.MQTTClient.publish does."""
+    sock.write(bytes((0x30, 2 + len(topic) + len(msg))))
+    sock.write(struct.pack("!H", len(topic)))
+    sock.write(topic)
+    sock.write(msg)
+
+
+def _ticks_ms():
+    return 1000
+
+
+def test_benchmark(mocker, benchmark):
+    # Mock calls would dominate timings.
+    mocker.patch.object(sys.modules["time"], "ticks_ms", new=_ticks_ms)
+    topic = b"esp-now/get/000000000001"
+    msg = b'{"sensor1_temperature": 21.5, "sensor1_humidity": 40}'
+    count = 1000
+    writer = PacketWriter()
+    for name in ("unbuffered", "coalesced"):
+        sock = FakeSocket()
+        with benchmark.timed(f"{name} messages", count):
+            for i in range(count):
+                if name == "unbuffered":
+                    _publish_unbuffered(sock, topic, msg)
+                else:
+                    writer.publish(sock, topic, msg)
+                    # A loop iteration every 16 frames of a burst.
+                    if not (i + 1) % 16:
+                        writer.flush(sock)
+            writer.flush(sock)
+        assert sock.publishes() == [call(topic, msg, retain=False)] * count
+        # A send syscall per write.
+        if name == "unbuffered":
+            assert sock.writes == 4 * count
+        else:
+            # Every 16 packets, and when full after 12 (81 bytes each).
+            assert sock.writes == 2 * count // 16
@@ -0,0 +1,35 @@
+import pytest
+
+from esp_now_hub.hub.ring_buffer import RingBuffer
+
+
+def _drain(buffer):
+    items = []
+    while buffer:
+        items.append(buffer.peek())
+        buffer.pop()
+    return items
+
+
+def test_drop_oldest():
+    buffer = RingBuffer(2)
+    buffer.push("dev1", {"a": 1})
+    buffer.push("dev2", {"a": 2})
+    buffer.push("dev1", {"a": 3})
+    assert _drain(buffer) == [("dev2", {"a": 2}), ("dev1", {"a": 3})]
+    assert (buffer.buffered, buffer.flushed, buffer.evicted) == (3, 2, 1)
+
+
+def test_latest_per_device():
+    buffer = RingBuffer(2, "latest")
+    buffer.push("dev1", {"a": 1, "b": 1})
+    buffer.push("dev2", {"a": 2})
+    buffer.push("dev1", {"a": 3})
+    buffer.push("dev3", {"a": 4})
+    assert _drain(buffer) == [("dev2", {"a": 2}), ("dev3", {"a": 4})]
+    assert (buffer.buffered, buffer.flushed, buffer.evicted) == (4, 2, 2)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="unknown buffer policy"):
+        RingBuffer(2, "newest")
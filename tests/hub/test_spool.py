@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from esp_now_hub.hub.spool import Spool
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "spool")
+
+
+def _segments(path):
+    return {
+        name: os.stat(os.path.join(path, name)).st_size for name in os.listdir(path)
+    }
+
+
+def _drain_all(spool):
+    records = []
+
+    def _publish(device_id, data):
+        records.append((device_id, data))
+        return True
+
+    assert spool.drain(_publish)
+    return records
+
+
+def test_drain_from_buffer(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path)
+    spool.append("dev1", b"1")
+    spool.append("dev2", b"22")
+    assert _drain_all(spool) == [("dev1", b"1"), ("dev2", b"22")]
+    assert not len(spool)
+    # Nothing written to flash.
+    assert _segments(path) == {}
+
+
+def test_flush_pages(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path, page_size=16)
+    for i in range(4):
+        spool.append("dev1", str(i).encode())
+    # 8 bytes per record, written 2 by 2.
+    assert _segments(path) == {"00000000": 16}
+    spool.flush()
+    assert _segments(path) == {"00000000": 32}
+    assert _drain_all(spool) == [("dev1", str(i).encode()) for i in range(4)]
+    assert _segments(path) == {}
+
+
+def test_sync(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path, flush_interval=1)
+    spool.append("dev1", b"1")
+    ticks_ms.return_value = 999
+    spool.sync()
+    assert _segments(path) == {}
+    ticks_ms.return_value = 1000
+    spool.sync()
+    assert _segments(path) == {"00000000": 8}
+
+
+def test_rotate_and_cap(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path, segment_size=16, max_size=32, page_size=16)
+    for i in range(8):
+        spool.append("dev1", str(i).encode())
+    spool.flush()
+    assert _segments(path) == {"00000002": 16, "00000003": 16}
+    assert spool.dropped == 2
+    assert _drain_all(spool) == [("dev1", str(i).encode()) for i in range(4, 8)]
+
+
+def test_restart(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path, segment_size=16)
+    for i in range(3):
+        spool.append("dev1", str(i).encode())
+    spool.flush()
+    spool = Spool(path, segment_size=16)
+    spool.append("dev1", b"3")
+    assert len(spool) == 32
+    assert _drain_all(spool) == [("dev1", str(i).encode()) for i in range(4)]
+
+
+def test_drain_rate(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path, drain_rate=10, drain_burst=2)
+    for i in range(4):
+        spool.append("dev1", str(i).encode())
+    published = []
+
+    def _publish(device_id, data):
+        published.append(data)
+        return True
+
+    assert not spool.drain(_publish)
+    assert published == [b"0", b"1"]
+    assert spool.wait() == 100
+    ticks_ms.return_value = 100
+    assert not spool.drain(_publish)
+    assert published == [b"0", b"1", b"2"]
+    ticks_ms.return_value = 1000
+    assert spool.drain(_publish)
+    assert published == [b"0", b"1", b"2", b"3"]
+    assert spool.wait() is None
+
+
+def test_drain_failure(path, ticks_ms):
+    ticks_ms.return_value = 0
+    spool = Spool(path)
+    spool.append("dev1", b"1")
+    assert not spool.drain(lambda device_id, data: False)
+    assert spool.drained == 0
+    assert _drain_all(spool) == [("dev1", b"1")]
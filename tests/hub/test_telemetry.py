@@ -0,0 +1,34 @@
+import sys
+
+from esp_now_hub.hub.telemetry import Telemetry
+
+
+class Source:
+    def telemetry(self):
+        return {"frames": 3}
+
+
+def test_collect(ticks_ms, mem_free):
+    time = sys.modules["time"]
+    ticks_ms.return_value = 1000
+    time.ticks_add.side_effect = lambda a, b: a + b
+    telemetry = Telemetry(10)
+    assert telemetry.due()
+    for latency in (5, 20, 10):
+        telemetry.loop_start()
+        ticks_ms.return_value += latency
+        telemetry.loop_end()
+    mem_free.return_value = 5000
+    time.time.return_value = 1030
+    assert telemetry.collect(Source()) == {
+        "loop_iterations": 3,
+        "max_loop_latency": 20,
+        "mem_free_low": 5000,
+        "uptime": 30,
+        "frames": 3,
+    }
+    assert not telemetry.due()
+    assert telemetry.timeout() == 10000
+    mem_free.return_value = 100000
+    assert telemetry.collect()["max_loop_latency"] == 0
+    assert telemetry.collect()["mem_free_low"] == 5000
@@ -0,0 +1,157 @@
+import sys
+
+import network
+import pytest
+
+from esp_now_hub.hub.wifi import WLan
+
+pytestmark = pytest.mark.usefixtures("stored")
+
+
+@pytest.fixture
+def wlan(mocker):
+    w = mocker.Mock()
+    w.status.return_value = network.STAT_CONNECTING
+    w.isconnected.return_value = False
+    w.scan.return_value = []
+    # Channel of the interface.
+    w.config.return_value = 11
+    mocker.patch.object(network, "WLAN", return_value=w)
+    return w
+
+
+@pytest.fixture(autouse=True)
+def _ticks_add(mocker):
+    mocker.patch.object(sys.modules["time"], "ticks_add", new=lambda a, b: a + b)
+
+
+def _connected(wlan, connected):
+    wlan.status.return_value = (
+        network.STAT_GOT_IP if connected else network.STAT_CONNECT_FAIL
+    )
+    wlan.isconnected.return_value = connected
+
+
+def test_enter(wlan, ticks_ms, mocker):
+    ticks_ms.return_value = 1000
+    sleep_ms = mocker.patch.object(
+        sys.modules["time"], "sleep_ms", side_effect=lambda ms: _connected(wlan, True)
+    )
+    with WLan("ssid", "password") as client:
+        assert client.isconnected()
+    # Waited for the attempt only.
+    sleep_ms.assert_called_once_with(100)
+
+
+def test_reconnect(wlan, ticks_ms, mocker):
+    ticks_ms.return_value = 1000
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
+    client = WLan("ssid", "password", backoff={"initial": 1000})
+    _connected(wlan, True)
+    with client:
+        assert client.isconnected()
+        assert client.check() == 5000
+        # Dropped, then the attempt fails.
+        _connected(wlan, False)
+        ticks_ms.return_value = 2000
+        assert client.check() == 100
+        assert not client.isconnected()
+        assert client.check() == 1000
+        ticks_ms.return_value = 2500
+        assert client.check() == 500
+        ticks_ms.return_value = 3000
+        wlan.status.return_value = network.STAT_CONNECTING
+        assert client.check() == 100
+        assert wlan.connect.call_count == 3
+        # Timed out.
+        ticks_ms.return_value = 13000
+        assert client.check() == 2000
+        ticks_ms.return_value = 15000
+        client.check()
+        _connected(wlan, True)
+        ticks_ms.return_value = 16000
+        assert client.check() == 5000
+        assert client.isconnected()
+    assert client.telemetry() == {
+        "wifi_reconnects": 1,
+        "wifi_reconnect_attempts": 4,
+        "wifi_reconnect_time": 14000,
+        "wifi_connect_time": 1000,
+        "wifi_resets": 0,
+    }
+
+
+def test_reset(wlan, ticks_ms, mocker):
+    ticks_ms.return_value = 1000
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
+    _connected(wlan, True)
+    with WLan("ssid", "password", backoff={"initial": 1000}) as client:
+        client.reset(RuntimeError("driver error"))
+        assert not client.isconnected()
+        wlan.disconnect.assert_called_once()
+        assert client.check() == 1000
+        ticks_ms.return_value = 2000
+        assert client.check() == 100
+        assert client.check() == 5000
+    telemetry = client.telemetry()
+    assert telemetry["wifi_resets"] == 1
+    assert telemetry["wifi_reconnect_time"] == 1000
+
+
+_BSSID = b"\x01\x02\x03\x04\x05\x06"
+
+
+def test_fast_join(wlan, stored, ticks_ms, mocker):
+    ticks_ms.return_value = 1000
+    wlan.scan.return_value = [
+        (b"other", b"\x00" * 6, 1, -40, 3, False),
+        (b"ssid", b"\x00" * 6, 6, -80, 3, False),
+        (b"ssid", _BSSID, 11, -60, 3, False),
+    ]
+    _connected(wlan, True)
+    with WLan("ssid", "password"):
+        pass
+    # Strongest access point of the network, stored once joined.
+    wlan.connect.assert_called_once_with("ssid", "password", bssid=_BSSID)
+    wlan.config.assert_any_call(channel=11)
+    assert stored == {"ap": _BSSID + b"\x0b"}
+    # Joined without scanning on restart.
+    wlan.reset_mock()
+    wlan.scan.return_value = []
+    with WLan("ssid", "password"):
+        pass
+    wlan.scan.assert_not_called()
+    wlan.connect.assert_called_once_with("ssid", "password", bssid=_BSSID)
+    wlan.config.assert_any_call(channel=11)
+
+
+def test_fast_join_failed(wlan, stored, ticks_ms, mocker):
+    ticks_ms.return_value = 1000
+    mocker.patch("random.randint", side_effect=lambda a, b: b)
+    stored["ap"] = _BSSID + b"\x0b"
+    _connected(wlan, False)
+    with WLan("ssid", "password", backoff={"initial": 1000}) as client:
+        wlan.scan.assert_not_called()
+        for tick in (2000, 4000):
+            # Kept until failed repeatedly.
+            assert stored == {"ap": _BSSID + b"\x0b"}
+            ticks_ms.return_value = tick
+            client.check()
+            client.check()
+        assert wlan.connect.call_count == 3
+        wlan.connect.assert_called_with("ssid", "password", bssid=_BSSID)
+        # Dropped, the access point is found by connect.
+        assert stored == {}
+        ticks_ms.return_value = 8000
+        client.check()
+        wlan.connect.assert_called_with("ssid", "password")
+        # Joined another access point, found on the interface channel by a scan.
+        wlan.config.return_value = 6
+        wlan.scan.return_value = [
+            (b"ssid", _BSSID, 11, -40, 3, False),
+            (b"ssid", b"\x00" * 6, 6, -80, 3, False),
+        ]
+        _connected(wlan, True)
+        client.check()
+        assert client.isconnected()
+        assert stored == {"ap": b"\x00" * 6 + b"\x06"}
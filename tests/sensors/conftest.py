@@ -0,0 +1,80 @@
+import operator
+
+import pytest
+
+# MicroPython small ints, larger ones are allocated on the heap.
+_SMALL_INT = 2**30
+_OPERATORS = (
+    "add",
+    "sub",
+    "mul",
+    "truediv",
+    "floordiv",
+    "mod",
+    "pow",
+    "lshift",
+    "rshift",
+    "and",
+    "or",
+    "xor",
+)
+_allocations = [0]
+
+
+class _Int(int):
+    """Counts allocations of results of operations, see allocations."""
+
+
+class _Float(float):
+    pass
+
+
+def _plain(value):
+    if isinstance(value, _Int):
+        return int(value)
+    if isinstance(value, _Float):
+        return float(value)
+    return value
+
+
+def _tracked(value):
+    if isinstance(value, float):
+        # Boxed on the ESP32.
+        _allocations[0] += 1
+        return _Float(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        if not -_SMALL_INT <= value < _SMALL_INT:
+            _allocations[0] += 1
+        return _Int(value)
+    return value
+
+
+def _operator(op, reflected):
+    def _method(self, other):
+        if reflected:
+            return _tracked(op(_plain(other), _plain(self)))
+        return _tracked(op(_plain(self), _plain(other)))
+
+    return _method
+
+
+for _cls in (_Int, _Float):
+    for _name in _OPERATORS:
+        _op = getattr(operator, _name + "_" if _name in ("and", "or") else _name)
+        setattr(_cls, f"__{_name}__", _operator(_op, False))
+        setattr(_cls, f"__r{_name}__", _operator(_op, True))
+    _cls.__neg__ = lambda self: _tracked(-_plain(self))
+
+
+@pytest.fixture
+def allocations():
+    """Return the number of MicroPython heap allocations of compute(*readings),
+    floats and big ints resulting from operations on readings.
+    """
+
+    def _count(compute, *readings):
+        _allocations[0] = 0
+        compute(*map(_Int, readings))
+        return _allocations[0]
+
+    return _count
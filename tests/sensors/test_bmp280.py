@@ -1,6 +1,8 @@
+import random
+
 import pytest
 
-from esp_now_hub.sensors.bmp280 import _compute
+from esp_now_hub.sensors.bmp280 import _compute, _compute_fixed, _derive, _derive_fixed
 
 
 @pytest.fixture(scope="session")
@@ -22,4 +24,142 @@ def coefficients():
 
 
 def test_compute(coefficients):
-    assert _compute(519888, 415148, *coefficients) == (1.0065, 25.1)
+    assert _compute(519888, 415148, *_derive(*coefficients)) == (1.0065, 25.1)
+
+
+def _compute_reference(
+    adc_t,
+    adc_p,
+    dig_t1,
+    dig_t2,
+    dig_t3,
+    dig_p1,
+    dig_p2,
+    dig_p3,
+    dig_p4,
+    dig_p5,
+    dig_p6,
+    dig_p7,
+    dig_p8,
+    dig_p9,
+):
+    """Datasheet floating point compensation, from the coefficients."""
+    var1 = (adc_t / 16384.0 - dig_t1 / 1024.0) * dig_t2
+    var2 = (adc_t / 131072.0 - dig_t1 / 8192.0) ** 2 * dig_t3
+    t_fine = var1 + var2
+    t = t_fine / 5120
+    var1 = t_fine / 2 - 64000
+    var2 = var1**2 * dig_p6 / 32768.0
+    var2 = var2 + var1 * dig_p5 * 2
+    var2 = var2 / 4 + dig_p4 * 65536.0
+    var1 = (dig_p3 * var1**2 / 524288 + dig_p2 * var1) / 524288
+    var1 = (1.0 + var1 / 32768) * dig_p1
+    p = (1048576.0 - adc_p - var2 / 4096) * 6250 / var1
+    var1 = dig_p9 * p**2 / 2147483648
+    var2 = p * dig_p8 / 32768
+    p = p + (var1 + var2 + dig_p7) / 16
+    return p / 100000, t
+
+
+def test_derive(coefficients, monkeypatch):
+    # Unrounded.
+    monkeypatch.setitem(_compute.__globals__, "round", lambda value, _: value)
+    constants = _derive(*coefficients)
+    for adc_t in range(400000, 650000, 2503):
+        for adc_p in range(200000, 600000, 4001):
+            assert _compute(adc_t, adc_p, *constants) == _compute_reference(
+                adc_t, adc_p, *coefficients
+            )
+
+
+def _compute_reference_fixed(
+    adc_t,
+    adc_p,
+    dig_t1,
+    dig_t2,
+    dig_t3,
+    dig_p1,
+    dig_p2,
+    dig_p3,
+    dig_p4,
+    dig_p5,
+    dig_p6,
+    dig_p7,
+    dig_p8,
+    dig_p9,
+):
+    """Datasheet 64 bits integer compensation, from the coefficients."""
+    var1 = (((adc_t >> 3) - (dig_t1 << 1)) * dig_t2) >> 11
+    var2 = (((((adc_t >> 4) - dig_t1) * ((adc_t >> 4) - dig_t1)) >> 12) * dig_t3) >> 14
+    t_fine = var1 + var2
+    var1 = t_fine - 128000
+    var2 = var1 * var1 * dig_p6
+    var2 = var2 + ((var1 * dig_p5) << 17)
+    var2 = var2 + (dig_p4 << 35)
+    var1 = ((var1 * var1 * dig_p3) >> 8) + ((var1 * dig_p2) << 12)
+    var1 = (((1 << 47) + var1) * dig_p1) >> 33
+    p = 1048576 - adc_p
+    p = (((p << 31) - var2) * 3125) // var1
+    var1 = (dig_p9 * (p >> 13) * (p >> 13)) >> 25
+    var2 = (dig_p8 * p) >> 19
+    p = ((p + var1 + var2) >> 8) + (dig_p7 << 4)
+    return (p + 1280) // 2560 / 10000, (t_fine + 256) // 512 / 10
+
+
+def test_compute_fixed(coefficients):
+    # 100653.25 Pa, against 100653.27 Pa with floats.
+    assert _compute_fixed(519888, 415148, *_derive_fixed(*coefficients)) == (
+        1.0065,
+        25.1,
+    )
+
+
+def test_compute_fixed_reference(coefficients):
+    constants = _derive_fixed(*coefficients)
+    # Identical over the full range.
+    rand = random.Random(0)
+    for _ in range(10000):
+        adc_t = rand.randrange(2**20)
+        adc_p = rand.randrange(2**20)
+        assert _compute_fixed(adc_t, adc_p, *constants) == _compute_reference_fixed(
+            adc_t, adc_p, *coefficients
+        )
+
+
+def test_compute_fixed_float(coefficients):
+    constants = _derive_fixed(*coefficients)
+    float_constants = _derive(*coefficients)
+    # Temperature from -44 to 81 Celsius, pressure from 0.65 to 1.31 bar.
+    for adc_t in range(300000, 700000, 2503):
+        for adc_p in range(150000, 650000, 4001):
+            pres, temp = _compute_fixed(adc_t, adc_p, *constants)
+            float_pres, float_temp = _compute(adc_t, adc_p, *float_constants)
+            # Integer errors are under 0.6 Pa and 0.002 Celsius, results only
+            # differ when floats are that close to a rounding boundary.
+            exact_pres, exact_temp = _compute_reference(adc_t, adc_p, *coefficients)
+            if pres != float_pres:
+                assert abs(exact_pres * 10000 % 1 - 0.5) < 0.06
+                assert abs(pres - float_pres) < 0.00011
+            if temp != float_temp:
+                assert abs(exact_temp * 10 % 1 - 0.5) < 0.02
+                assert abs(temp - float_temp) < 0.11
+
+
+def test_benchmark(coefficients, allocations, benchmark):
+    readings = [(300000, 150000), (519888, 415148), (700000, 650000)]
+    computes = {
+        "float": (_compute, _derive(*coefficients)),
+        "fixed": (_compute_fixed, _derive_fixed(*coefficients)),
+    }
+    counts = {}
+    for name, (compute, constants) in computes.items():
+        counts[name] = max(
+            allocations(compute, adc_t, adc_p, *constants) for adc_t, adc_p in readings
+        )
+        benchmark.report(f"{name} allocations", counts[name])
+        count = benchmark.iterations(10000)
+        with benchmark.timed(f"{name} computes", count):
+            for _ in range(count):
+                compute(519888, 415148, *constants)
+    assert counts["fixed"] == 2
+    assert counts["float"] > 10 * counts["fixed"]
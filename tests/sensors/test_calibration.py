@@ -0,0 +1,58 @@
+import pytest
+
+from esp_now_hub.sensors.calibration import load
+
+_FORMAT = "<Hh"
+_BLOB = b"\x01\x00\xfe\xff\xc7\x9b\xc5>"
+
+
+@pytest.fixture
+def stored(nvs):
+    """Blobs stored in NVS."""
+    blobs = {}
+
+    def _get_blob(key, buf):
+        if key not in blobs:
+            raise OSError
+        if len(blobs[key]) > len(buf):
+            raise OSError
+        buf[: len(blobs[key])] = blobs[key]
+        return len(blobs[key])
+
+    nvs.get_blob.side_effect = _get_blob
+    nvs.set_blob.side_effect = lambda key, data: blobs.__setitem__(key, bytes(data))
+    return blobs
+
+
+def _derive(c1, c2):
+    return c1 * 2, c2
+
+
+def test_load_read(stored, nvs, mocker):
+    read = mocker.Mock(return_value=[1, -2])
+    assert load("sensor1", _FORMAT, read, _derive) == (2, -2)
+    assert stored == {"calibration": _BLOB}
+    nvs.commit.assert_called_once()
+    # Then stored.
+    read.reset_mock()
+    assert load("sensor1", _FORMAT, read, _derive) == (2, -2)
+    read.assert_not_called()
+    nvs.commit.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "blob",
+    [
+        # Corrupted.
+        b"\x02" + _BLOB[1:],
+        # Previous text format.
+        b"1,-2",
+        b"10000,-20000",
+    ],
+)
+def test_load_invalid(stored, mocker, blob):
+    stored["calibration"] = blob
+    read = mocker.Mock(return_value=(1, -2))
+    assert load("sensor1", _FORMAT, read, _derive) == (2, -2)
+    read.assert_called_once()
+    assert stored == {"calibration": _BLOB}
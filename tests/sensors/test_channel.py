@@ -0,0 +1,105 @@
+import pytest
+
+from esp_now_hub.sensors.channel import Channel
+
+_HUB = b"\x00\x00\x00\x00\x00\x01"
+
+
+class FakeWLan:
+    def __init__(self):
+        self.channel = None
+
+    def config(self, channel):
+        self.channel = channel
+
+
+class FakeESPNow:
+    """Acknowledges sends on the channel the hub listens on."""
+
+    def __init__(self, wlan, hub_channel):
+        self._wlan = wlan
+        self.hub_channel = hub_channel
+        # Channel of each send.
+        self.sends = []
+
+    def send(self, peer, msg):
+        self.sends.append(self._wlan.channel)
+        return peer == _HUB and self._wlan.channel == self.hub_channel
+
+
+class FakeRTCMemory:
+    def __init__(self, channel=0):
+        self.channel = channel
+        self.failures = 0
+
+
+@pytest.fixture
+def wlan():
+    return FakeWLan()
+
+
+def test_cached(wlan, stored):
+    e = FakeESPNow(wlan, 6)
+    channel = Channel(wlan, FakeRTCMemory(6), 1)
+    assert wlan.channel == 6
+    assert channel.send(e, _HUB, b"frame")
+    # A single send.
+    assert e.sends == [6]
+    assert stored == {}
+
+
+def test_probe(wlan, stored, nvs):
+    rtc_memory = FakeRTCMemory()
+    e = FakeESPNow(wlan, 6)
+    channel = Channel(wlan, rtc_memory, 1)
+    assert rtc_memory.channel == 1
+    assert channel.send(e, _HUB, b"frame")
+    assert e.sends == [1, 2, 3, 4, 5, 6]
+    assert channel.channel == 6
+    assert rtc_memory.channel == 6
+    assert stored == {"channel": 6}
+    nvs.commit.assert_called_once()
+    # Next wake after power loss.
+    e.sends = []
+    assert Channel(wlan, FakeRTCMemory(), 1).send(e, _HUB, b"frame")
+    assert e.sends == [6]
+
+
+def test_probe_moved(wlan, stored):
+    rtc_memory = FakeRTCMemory(6)
+    e = FakeESPNow(wlan, 6)
+    channel = Channel(wlan, rtc_memory)
+    assert channel.send(e, _HUB, b"frame")
+    # The access point moved.
+    e.hub_channel = 2
+    e.sends = []
+    assert channel.send(e, _HUB, b"frame")
+    assert e.sends == [6, 1, 2]
+    assert rtc_memory.channel == 2
+
+
+def test_hub_down(wlan, stored):
+    rtc_memory = FakeRTCMemory(6)
+    e = FakeESPNow(wlan, None)
+    channel = Channel(wlan, rtc_memory)
+    assert not channel.send(e, _HUB, b"frame")
+    assert e.sends == [6] + [c for c in range(1, 14) if c != 6]
+    # Kept, the hub is probably down.
+    assert wlan.channel == 6
+    assert rtc_memory.channel == 6
+    assert stored == {}
+
+
+def test_hub_down_wakes(wlan, stored):
+    rtc_memory = FakeRTCMemory(6)
+    e = FakeESPNow(wlan, None)
+    for _ in range(9):
+        # A wake.
+        Channel(wlan, rtc_memory).send(e, _HUB, b"frame")
+    # Probed on the first and ninth failed wakes only.
+    assert len(e.sends) == 13 + 7 + 13
+    assert rtc_memory.failures == 9
+    # Reset once acknowledged.
+    e.hub_channel = 6
+    assert Channel(wlan, rtc_memory).send(e, _HUB, b"frame")
+    assert rtc_memory.failures == 0
@@ -1,6 +1,6 @@
 import pytest
 
-from esp_now_hub.sensors.ms5540c import _compute, _get_coefficients
+from esp_now_hub.sensors.ms5540c import _compute, _derive, _get_coefficients
 
 
 @pytest.fixture(scope="session")
@@ -20,4 +20,38 @@ def test_get_coefficients(coefficients):
 
 
 def test_compute(coefficients):
-    assert _compute(16460, 27856, *coefficients) == (0.9717, 39.1)
+    assert _compute(16460, 27856, *_derive(*coefficients)) == (0.9717, 39.1)
+
+
+def _compute_reference(d1, d2, c1, c2, c3, c4, c5, c6):
+    """Datasheet compensation, from the coefficients."""
+    ut1 = 8 * c5 + 20224
+    dt = d2 - ut1
+    temp = 200 + dt * (c6 + 50) / 2**10
+    off = c2 * 4 + ((c4 - 512) * dt) / 2**12
+    sens = c1 + (c3 * dt) / 2**10 + 24576
+    x = (sens * (d1 - 7168)) / 2**14 - off
+    p = x * 10 / 2**5 + 250 * 10
+    if temp < 200:
+        t2 = 11 * (c6 + 24) * (200 - temp) * (200 - temp) / 2**20
+        p2 = 3 * t2 * (p - 3500) / 2**14
+        temp -= t2
+        p -= p2
+    elif temp > 450:
+        t2 = 3 * (c6 + 24) * (450 - temp) * (450 - temp) / 2**20
+        p2 = t2 * (p - 10000) / 2**13
+        temp -= t2
+        p -= p2
+    return p / 10000, temp / 10
+
+
+def test_derive(coefficients, monkeypatch):
+    # Unrounded.
+    monkeypatch.setitem(_compute.__globals__, "round", lambda value, _: value)
+    constants = _derive(*coefficients)
+    # Temperature from -40 to 85 Celsius.
+    for d2 in range(18000, 36000, 97):
+        for d1 in range(10000, 30000, 101):
+            assert _compute(d1, d2, *constants) == _compute_reference(
+                d1, d2, *coefficients
+            )
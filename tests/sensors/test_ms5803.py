@@ -1,6 +1,8 @@
+import random
+
 import pytest
 
-from esp_now_hub.sensors.ms5803 import _compute
+from esp_now_hub.sensors.ms5803 import _compute, _compute_fixed, _derive, _derive_fixed
 
 
 @pytest.fixture(scope="session")
@@ -16,4 +18,47 @@ def coefficients():
 
 
 def test_compute(coefficients):
-    assert _compute(4311550, 8387300, *coefficients) == (1.0005, 20.1)
+    assert _compute(4311550, 8387300, *_derive(*coefficients)) == (1.0005, 20.1)
+
+
+def test_compute_fixed(coefficients):
+    constants = _derive(*coefficients)
+    fixed_constants = _derive_fixed(*coefficients)
+    # Temperature from -40 to 85 Celsius, pressure from 0 to 14 bar.
+    for d2 in range(6600000, 10300000, 9973):
+        for d1 in range(3800000, 10600000, 49999):
+            assert _compute_fixed(d1, d2, *fixed_constants) == _compute(
+                d1, d2, *constants
+            )
+
+
+def test_compute_fixed_random():
+    # Identical over the full range, allocating out of the operating range.
+    rand = random.Random(0)
+    for _ in range(10000):
+        coefficients = tuple(rand.randrange(2**16) for _ in range(6))
+        d1 = rand.randrange(2**24)
+        d2 = rand.randrange(2**24)
+        assert _compute_fixed(d1, d2, *_derive_fixed(*coefficients)) == _compute(
+            d1, d2, *_derive(*coefficients)
+        )
+
+
+def test_benchmark(coefficients, allocations, benchmark):
+    readings = [(3800000, 6600000), (4311550, 8387300), (10600000, 10300000)]
+    computes = {
+        "big_int": (_compute, _derive(*coefficients)),
+        "fixed": (_compute_fixed, _derive_fixed(*coefficients)),
+    }
+    counts = {}
+    for name, (compute, constants) in computes.items():
+        counts[name] = max(
+            allocations(compute, d1, d2, *constants) for d1, d2 in readings
+        )
+        benchmark.report(f"{name} allocations", counts[name])
+        count = benchmark.iterations(10000)
+        with benchmark.timed(f"{name} computes", count):
+            for _ in range(count):
+                compute(4311550, 8387300, *constants)
+    assert counts["fixed"] == 2
+    assert counts["big_int"] > counts["fixed"]
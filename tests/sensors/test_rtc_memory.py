@@ -0,0 +1,75 @@
+import machine
+import pytest
+
+from esp_now_hub.sensors.rtc_memory import RTCMemory
+
+
+@pytest.fixture
+def rtc(mocker):
+    rtc_ = mocker.Mock()
+    mocker.patch.object(machine, "RTC", return_value=rtc_)
+    return rtc_
+
+
+def test_sequence_power_loss(rtc, mocker):
+    mocker.patch("random.getrandbits", return_value=0xFFFF)
+    rtc.memory.return_value = b""
+    memory = RTCMemory()
+    assert memory.next_sequence() == 0
+    rtc.memory.assert_called_with(b"\xe6\x00\x00\x00\x00\x00")
+
+
+def test_sequence_deepsleep(rtc):
+    rtc.memory.return_value = b"\xe6\x01\x02\x06\x00\x00"
+    memory = RTCMemory()
+    assert memory.next_sequence() == 0x0202
+    assert memory.next_sequence() == 0x0203
+    rtc.memory.assert_called_with(b"\xe6\x03\x02\x06\x00\x00")
+
+
+def test_channel(rtc, mocker):
+    mocker.patch("random.getrandbits", return_value=0)
+    rtc.memory.return_value = b"\xe5\x01\x02\x06\x00"
+    memory = RTCMemory()
+    # Written by a previous version.
+    assert memory.channel == 0
+    memory.channel = 11
+    assert memory.channel == 11
+    rtc.memory.assert_called_with(b"\xe6\x00\x00\x0b\x00\x00")
+
+
+def test_failures(rtc):
+    rtc.memory.return_value = b"\xe6\x01\x02\x06\x03\x00"
+    memory = RTCMemory()
+    assert memory.failures == 3
+    memory.failures = 4
+    rtc.memory.assert_called_with(b"\xe6\x01\x02\x06\x04\x00")
+
+
+def test_values(rtc):
+    rtc.memory.return_value = b"\xe6\x01\x02\x06\x00\x2a\x01\x02"
+    memory = RTCMemory(2, 0x2A)
+    assert memory.values_valid
+    assert bytes(memory.values) == b"\x01\x02"
+    memory.values[0] = 3
+    assert memory.next_sequence() == 0x0202
+    rtc.memory.assert_called_with(b"\xe6\x02\x02\x06\x00\x2a\x03\x02")
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # Another layout.
+        b"\xe6\x01\x02\x06\x00\x2b\x01\x02",
+        # Another size.
+        b"\xe6\x01\x02\x06\x00\x2a\x01",
+    ],
+)
+def test_values_invalid(rtc, data):
+    rtc.memory.return_value = data
+    memory = RTCMemory(2, 0x2A)
+    assert not memory.values_valid
+    assert bytes(memory.values) == b"\x00\x00"
+    # Kept.
+    assert memory.channel == 6
+    assert memory.next_sequence() == 0x0202
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from esp_now_hub.sensors import settings
+from esp_now_hub.wire import encode_settings
+
+
+@pytest.fixture
+def config():
+    return {
+        "interval": 10,
+        "sensors": [
+            {"id": "sensor1", "type": "bmp280"},
+            {
+                "id": "sensor2",
+                "type": "aht20",
+                "send_configs": {"temperature": {"diff": 0.5, "time": 600}},
+            },
+        ],
+    }
+
+
+@pytest.fixture
+def stored(nvs):
+    """Settings blob stored in NVS."""
+    blob = {}
+
+    def _get_blob(key, buf):
+        if key not in blob:
+            raise OSError
+        buf[: len(blob[key])] = blob[key]
+        return len(blob[key])
+
+    nvs.get_blob.side_effect = _get_blob
+    nvs.set_blob.side_effect = blob.__setitem__
+    return blob
+
+
+def test_receive(config, nvs, stored):
+    assert settings.receive(config, encode_settings({"interval": 60}))
+    assert settings.receive(
+        config,
+        encode_settings({"send_configs": {"sensor2": {"temperature": {"diff": 1}}}}),
+    )
+    assert config["interval"] == 60
+    assert config["sensors"][1]["send_configs"] == {
+        "temperature": {"diff": 1, "time": 600}
+    }
+    assert json.loads(stored["settings"]) == {
+        "interval": 60,
+        "send_configs": {"sensor2": {"temperature": {"diff": 1}}},
+    }
+    assert nvs.commit.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "update",
+    [
+        {"interval": 0},
+        {"interval": "60"},
+        {"send_configs": {"other": {"temperature": {"diff": 1, "time": 60}}}},
+        # Incomplete without a current send config.
+        {"send_configs": {"sensor1": {"pressure": {"diff": 1}}}},
+        {"send_configs": {"sensor2": {"temperature": {"diff": None}}}},
+    ],
+)
+def test_receive_invalid(config, nvs, stored, update):
+    assert not settings.receive(config, encode_settings(update))
+    assert config["interval"] == 10
+    assert stored == {}
+
+
+def test_receive_other_frame(config, stored):
+    assert not settings.receive(config, b'{"interval": 60}')
+
+
+def test_load(config, stored):
+    settings.load(config)
+    assert config["interval"] == 10
+    stored["settings"] = json.dumps(
+        {
+            "interval": 60,
+            "send_configs": {"sensor1": {"pressure": {"diff": 1, "time": 60}}},
+        }
+    ).encode()
+    settings.load(config)
+    assert config["interval"] == 60
+    assert config["sensors"][0]["send_configs"] == {"pressure": {"diff": 1, "time": 60}}
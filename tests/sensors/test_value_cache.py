@@ -1,97 +1,217 @@
+import sys
+
 import pytest
 
-from esp_now_hub.sensors.value_cache import (
-    _get,
-    _set,
-    process_sensor_data,
-    store_sensor_data,
-)
+from esp_now_hub.sensors.value_cache import ValueCache, size
 
+_SENSOR_IDS = ("sensor1", "sensor2")
+_LAYOUT_ID = 0x2A
+_SEND_CONFIGS = {"temperature": {"diff": 0.2, "time": 5}}
 
-def test_get_not_found(mocker):
-    nvs_ = mocker.Mock()
-    nvs_.get_blob.side_effect = OSError
-    assert _get(nvs_, "prop") == (None, None)
 
+class FakeNVS:
+    """NVS namespace, counting commits."""
 
-def test_get(mocker):
-    nvs_ = mocker.Mock()
+    def __init__(self):
+        self.blobs = {}
+        self.commits = 0
 
-    def _get_blob(_, buf):
-        buf += bytearray(b"21.2,3000")
+    def get_blob(self, key, buf):
+        if key not in self.blobs:
+            raise OSError
+        data = self.blobs[key]
+        if len(data) > len(buf):
+            raise OSError
+        buf[: len(data)] = data
+        return len(data)
 
-    nvs_.get_blob = _get_blob
-    assert _get(nvs_, "prop") == (21.2, 3000)
+    def set_blob(self, key, data):
+        self.blobs[key] = bytes(data)
 
+    def commit(self):
+        self.commits += 1
 
-def test_set(mocker, ticks_ms):
-    nvs_ = mocker.Mock()
-    ticks_ms.return_value = 3000
-    _set(nvs_, "prop", 21.2)
-    nvs_.set_blob.assert_called_once_with("prop", b"21.2,3000")
-    nvs_.commit.assert_called_once()
+
+class FakeRTCMemory:
+    def __init__(self, values_size, values=None):
+        self.values_valid = values is not None
+        self.values = memoryview(bytearray(values or values_size))
+        self.saves = 0
+
+    def save(self):
+        self.saves += 1
 
 
 @pytest.fixture
-def nvs_get(mocker):
-    return mocker.patch("esp_now_hub.sensors.value_cache._get")
+def namespaces(mocker):
+    namespaces_ = {}
 
+    def _nvs(namespace):
+        return namespaces_.setdefault(namespace, FakeNVS())
 
-def test_process_sensor_no_config():
-    assert process_sensor_data("id", {"temp": 21.2}, {}) == {"temp": 21.2}
+    mocker.patch.object(sys.modules["esp32"], "NVS", side_effect=_nvs)
+    return namespaces_
 
 
-def test_process_sensor_data_no_cache(nvs_get):
-    nvs_get.return_value = (None, None)
-    assert process_sensor_data(
-        "id",
-        {"temp": 21.2},
-        {"temp": {"diff": 0.2, "time": 5}},
-    ) == {"temp": 21.2}
+@pytest.fixture
+def rtc_memory():
+    return FakeRTCMemory(size(_SENSOR_IDS))
 
 
-def test_process_sensor_data_should_not_send(nvs_get, ticks_ms):
-    nvs_get.return_value = (21.2, 3000)
-    ticks_ms.return_value = 6000
-    assert (
-        process_sensor_data(
-            "id",
-            {"temp": 21.3},
-            {"temp": {"diff": 0.2, "time": 5}},
-        )
-        == {}
-    )
+@pytest.fixture
+def cache(namespaces, rtc_memory):
+    return ValueCache(rtc_memory, _SENSOR_IDS, _LAYOUT_ID)
 
 
-def test_process_sensor_data_send_for_diff(nvs_get, ticks_ms):
-    nvs_get.return_value = (21.2, 3000)
-    ticks_ms.return_value = 6000
-    assert process_sensor_data(
-        "id",
-        {"temp": 21.4},
-        {"temp": {"diff": 0.2, "time": 5}},
-    ) == {"temp": 21.4}
+def test_process_no_config(cache):
+    assert cache.process("sensor1", {"temperature": 21.2}, {}) == {"temperature": 21.2}
 
 
-def test_process_sensor_data_send_for_time(nvs_get, ticks_ms):
-    nvs_get.return_value = (21.2, 3000)
-    ticks_ms.return_value = 10000
-    assert process_sensor_data(
-        "id",
-        {"temp": 21.3},
-        {"temp": {"diff": 0.2, "time": 5}},
-    ) == {"temp": 21.3}
+def test_process_no_cache(cache):
+    assert cache.process("sensor1", {"temperature": 21.2}, _SEND_CONFIGS) == {
+        "temperature": 21.2
+    }
 
 
-@pytest.fixture
-def nvs_set(mocker):
-    return mocker.patch("esp_now_hub.sensors.value_cache._set")
+def test_process_unknown(cache):
+    send_configs = {"other": {"diff": 0.2, "time": 5}}
+    cache.store("sensor3", {"temperature": 21.2}, _SEND_CONFIGS)
+    cache.store("sensor1", {"other": 21.2}, send_configs)
+    assert cache.process("sensor3", {"temperature": 21.2}, _SEND_CONFIGS) == {
+        "temperature": 21.2
+    }
+    assert cache.process("sensor1", {"other": 21.2}, send_configs) == {"other": 21.2}
 
 
-def test_store_sensor_data(nvs, nvs_set):
-    store_sensor_data(
-        "id",
-        {"temp": 21.3, "no_config": 10},
-        {"temp": 1, "not_sent": 1},
+@pytest.mark.parametrize(
+    ("value", "ticks", "sent"),
+    [
+        (21.3, 6000, False),
+        # Diff.
+        (21.4, 6000, True),
+        # Time.
+        (21.3, 10000, True),
+    ],
+)
+def test_process(cache, ticks_ms, value, ticks, sent):
+    ticks_ms.return_value = 3000
+    cache.store("sensor1", {"temperature": 21.2}, _SEND_CONFIGS)
+    ticks_ms.return_value = ticks
+    data = {"temperature": value}
+    assert cache.process("sensor1", data, _SEND_CONFIGS) == (data if sent else {})
+    # Other sensors and components are separate.
+    assert cache.process("sensor2", data, _SEND_CONFIGS) == data
+    send_configs = {"humidity": {"diff": 1, "time": 5}}
+    assert cache.process("sensor1", {"humidity": 40}, send_configs) == {"humidity": 40}
+
+
+def test_store_commit(cache, namespaces, rtc_memory, ticks_ms):
+    ticks_ms.return_value = 3000
+    # Without send configs.
+    cache.store("sensor1", {"temperature": 21.2}, {})
+    cache.commit()
+    assert rtc_memory.saves == 0
+    assert namespaces["values"].commits == 0
+    cache.store("sensor1", {"temperature": 21.2, "humidity": 40}, _SEND_CONFIGS)
+    cache.store("sensor2", {"temperature": 22.5}, _SEND_CONFIGS)
+    cache.commit()
+    assert rtc_memory.saves == 1
+    assert namespaces["values"].commits == 1
+    assert namespaces["values"].blobs == {"values_2a": bytes(rtc_memory.values)}
+    # Saved once.
+    cache.commit()
+    assert namespaces["values"].commits == 1
+
+
+def test_deepsleep(cache, namespaces, rtc_memory, ticks_ms):
+    ticks_ms.return_value = 3000
+    cache.store("sensor1", {"temperature": 21.2}, _SEND_CONFIGS)
+    cache.commit()
+    namespaces["values"].blobs.clear()
+    cache = ValueCache(
+        FakeRTCMemory(0, bytes(rtc_memory.values)), _SENSOR_IDS, _LAYOUT_ID
     )
-    nvs_set.assert_called_once_with(nvs, "temp", 21.3)
+    assert cache.process("sensor1", {"temperature": 21.3}, _SEND_CONFIGS) == {}
+
+
+@pytest.mark.parametrize(("layout_id", "sent"), [(_LAYOUT_ID, False), (0x2B, True)])
+def test_power_loss(cache, ticks_ms, layout_id, sent):
+    ticks_ms.return_value = 3000
+    cache.store("sensor1", {"temperature": 21.2}, _SEND_CONFIGS)
+    cache.commit()
+    cache = ValueCache(FakeRTCMemory(size(_SENSOR_IDS)), _SENSOR_IDS, layout_id)
+    data = {"temperature": 21.3}
+    assert cache.process("sensor1", data, _SEND_CONFIGS) == (data if sent else {})
+
+
+def _process_nvs(esp32, sensor_id, data, send_configs):
+    """Previous implementation: a decimal string in NVS per component."""
+    nvs = esp32.NVS(sensor_id)
+    data_to_send = {}
+    for prop, value in data.items():
+        send_config = send_configs.get(prop)
+        buf = bytearray(100)
+        try:
+            nvs.get_blob(prop, buf)
+        except OSError:
+            data_to_send[prop] = value
+            continue
+        last_value, last_time = buf.replace(b"\x00", b"").decode("utf-8").split(",")
+        if (
+            round(abs(value - float(last_value)), 10) >= send_config["diff"]
+            or _ticks_ms() - int(last_time) >= send_config["time"] * 1000
+        ):
+            data_to_send[prop] = value
+    return data_to_send
+
+
+def _store_nvs(esp32, sensor_id, data):
+    nvs = esp32.NVS(sensor_id)
+    for prop, value in data.items():
+        nvs.set_blob(prop, f"{value},{_ticks_ms()}".encode())
+        nvs.commit()
+
+
+def _ticks_ms():
+    return 3000
+
+
+def test_benchmark(mocker, namespaces, benchmark):
+    # Mock calls would dominate timings.
+    mocker.patch.object(sys.modules["time"], "ticks_ms", new=_ticks_ms)
+    esp32 = sys.modules["esp32"]
+    sensor_ids = tuple(f"sensor{i}" for i in range(4))
+    send_configs = {
+        "temperature": {"diff": 0.2, "time": 5},
+        "humidity": {"diff": 1, "time": 5},
+        "pressure": {"diff": 0.5, "time": 5},
+    }
+    count = 1000
+    commits = {}
+    for name in ("nvs", "rtc_memory"):
+        namespaces.clear()
+        rtc_memory = FakeRTCMemory(size(sensor_ids))
+        with benchmark.timed(f"{name} wakes", count):
+            for i in range(count):
+                # A wake: the cache is created, then every sensor processed and stored.
+                if name == "rtc_memory":
+                    cache = ValueCache(rtc_memory, sensor_ids, _LAYOUT_ID)
+                    rtc_memory.values_valid = True
+                for sensor_id in sensor_ids:
+                    data = {
+                        "temperature": 21.5 + i,
+                        "humidity": 40,
+                        "pressure": 1013.25,
+                    }
+                    if name == "nvs":
+                        data = _process_nvs(esp32, sensor_id, data, send_configs)
+                        _store_nvs(esp32, sensor_id, data)
+                    else:
+                        data = cache.process(sensor_id, data, send_configs)
+                        cache.store(sensor_id, data, send_configs)
+                if name == "rtc_memory":
+                    cache.commit()
+        commits[name] = sum(nvs.commits for nvs in namespaces.values())
+    # Every stored component, then the temperature only.
+    assert commits["nvs"] == 3 * len(sensor_ids) + (count - 1) * len(sensor_ids)
+    assert commits["rtc_memory"] == count
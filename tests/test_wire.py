@@ -0,0 +1,63 @@
+import pytest
+
+from esp_now_hub.wire import (
+    BINARY_V2,
+    decode_settings,
+    encode,
+    encode_settings,
+    layout,
+    merge_settings,
+    sequence,
+)
+
+
+@pytest.fixture(scope="session")
+def sensors():
+    return layout(("sensor2", "sensor1"))
+
+
+@pytest.fixture(scope="session")
+def data():
+    return {
+        "sensor1": {"pressure": 1.0065, "temperature": -25.1},
+        "sensor2": {"humidity": 45},
+    }
+
+
+def test_layout(sensors):
+    sensor_ids, layout_id = sensors
+    assert sensor_ids == ("sensor1", "sensor2")
+    assert layout(("sensor1", "sensor2"))[1] == layout_id
+    assert layout(("sensor1", "sensor3"))[1] != layout_id
+
+
+def test_encode(sensors, data):
+    frame = encode(data, *sensors, 0x1234)
+    assert frame[0] == BINARY_V2
+    assert frame[1] == sensors[1]
+    assert sequence(frame) == 0x1234
+    assert len(frame) == 4 + 3 * 4
+
+
+def test_settings():
+    settings = {"interval": 60, "send_configs": {"sensor1": {"pressure": {"diff": 1}}}}
+    frame = encode_settings(settings)
+    assert decode_settings(frame) == settings
+    assert decode_settings(frame[:-1]) is None
+    assert decode_settings(b'{"interval": 60}') is None
+    with pytest.raises(ValueError, match="too large"):
+        encode_settings({"interval": "x" * 250})
+
+
+def test_merge_settings():
+    settings = {"interval": 60, "send_configs": {"sensor1": {"pressure": {"diff": 1}}}}
+    merge_settings(
+        settings,
+        {"send_configs": {"sensor1": {"pressure": {"time": 10}, "temperature": {}}}},
+    )
+    assert settings == {
+        "interval": 60,
+        "send_configs": {
+            "sensor1": {"pressure": {"diff": 1, "time": 10}, "temperature": {}}
+        },
+    }